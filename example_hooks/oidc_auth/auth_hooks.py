@@ -70,3 +70,9 @@ def get_opensearch_config(userinfo: UserInfo) -> hu.OpensearchConfig:
         # Authenticate by forwarding user token
         extra_headers={"Authorization": f"Bearer {userinfo['access_token']}"},
     )
+
+
+## Results of get_opensearch_config are cached per key returned by this hook,
+## since the config only depends on the access token it is enough to key on that
+def get_opensearch_config_cache_key(userinfo: UserInfo) -> str:
+    return userinfo["access_token"]
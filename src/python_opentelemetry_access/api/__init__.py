@@ -1,12 +1,18 @@
+import asyncio
 import binascii
+from collections.abc import AsyncGenerator, AsyncIterable, AsyncIterator
+from contextlib import asynccontextmanager
+from itertools import chain
 from typing import Optional, Annotated, List, Tuple, Any
 from dataclasses import dataclass
 from fastapi import FastAPI, Query, Request, Response, status, Depends
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, Field
 import base64
 from datetime import datetime
+import logging
 import os
 
 from plugin_utils.runner import call_hooks_until_not_none
@@ -33,6 +39,7 @@ from eoepca_api_utils.json_api_types import (
     Links,
     Resource as JSONAPIResource,
 )
+import python_opentelemetry_access.base as base
 import python_opentelemetry_access.proxy as proxy
 import python_opentelemetry_access.otlpjson as otlpjson
 import python_opentelemetry_access.util as util
@@ -42,6 +49,10 @@ import python_opentelemetry_access.util as util
 class Settings:
     _proxy: Optional[proxy.Proxy]
     _base_url: Optional[str]
+    ## Stream span collections to the client instead of building the whole response
+    streaming_responses: bool = False
+    ## How many of the parts of a multi-part page token are queried at the same time
+    max_concurrent_page_queries: int = 8
 
     @property
     def proxy(self) -> proxy.Proxy:
@@ -67,7 +78,8 @@ class QueryParams(BaseModel):
     span_attributes: list[str] = Field([])
     span_name: Optional[str] = Field(None)
 
-    ## TODO: Projection/verbosity parameters??
+    ## Projection parameters
+    verbosity: proxy.Verbosity = Field("full")
 
     ## Pagination parameters
     ## TODO: (Maybe?) expand this with max_results hint
@@ -78,12 +90,26 @@ class QueryParams(BaseModel):
     page_token: Optional[str] = Field(None)
 
 
+class SpansQueryParams(QueryParams):
+    ## Only spans from these traces, all fetched with a single backend query
+    trace_ids: list[str] = Field([])
+
+
 class ResponseNextPageToken(BaseModel):
     next_page_token: str | None
 
 
+class ResponseError(BaseModel):
+    status: str
+    title: str
+    detail: str
+
+
 class ResponseMeta(BaseModel):
     page: ResponseNextPageToken
+    ## Only set on streamed responses, when the query failed after the response
+    ## was started, so that the data is incomplete
+    error: Optional[ResponseError] = None
 
 
 type APIOKResponse = APIOKResponseList[
@@ -138,6 +164,8 @@ def list_to_dict(values: list[str]) -> util.AttributesFilter:
 
 settings = Settings(_proxy=None, _base_url=None)
 
+logger = logging.getLogger("python-opentelemetry-access")
+
 GET_FASTAPI_SECURITY_HOOK_NAME = (
     os.environ.get("RH_TELEMETRY_GET_FASTAPI_SECURITY_HOOK_NAME")
     or "get_fastapi_security"
@@ -156,34 +184,34 @@ async def security_scheme(request: Request) -> Any | None:
         return None
 
 
-async def run_query(
+def _parse_page_tokens(page_token: Optional[str]) -> List[Optional[proxy.PageToken]]:
+    if page_token is None:
+        return [None]
+
+    try:
+        return [
+            proxy.PageToken(base64.b64decode(token, validate=True))
+            for token in page_token.split(".")
+        ]
+    except binascii.Error:
+        raise util.InvalidPageTokenException()
+
+
+async def _query_pages(
     auth_info: Any,
-    request: Request,
-    path: str,
     span_ids: Optional[List[Tuple[Optional[str], Optional[str]]]],
     query_params: QueryParams,
-) -> APIOKResponse:
-    new_page_tokens = []
-    span_sets = []
-
-    if query_params.page_token is not None:
-        try:
-            page_tokens: List[Optional[proxy.PageToken]] = [
-                proxy.PageToken(base64.b64decode(token, validate=True))
-                for token in query_params.page_token.split(".")
-            ]
-        except binascii.Error:
-            raise util.InvalidPageTokenException()
-
-    else:
-        page_tokens = [None]
+) -> AsyncGenerator[base.SpanCollection | proxy.PageToken]:
+    page_tokens = _parse_page_tokens(query_params.page_token)
 
     resource_attributes = list_to_dict(query_params.resource_attributes)
     scope_attributes = list_to_dict(query_params.scope_attributes)
     span_attributes = list_to_dict(query_params.span_attributes)
 
-    for page_token in page_tokens:
-        async for res in settings.proxy.query_spans_page(
+    def query_page(
+        page_token: Optional[proxy.PageToken],
+    ) -> AsyncIterable[base.SpanCollection | proxy.PageToken]:
+        return settings.proxy.query_spans_page(
             auth_info=auth_info,
             span_ids=span_ids,
             from_time=query_params.from_time,
@@ -194,17 +222,48 @@ async def run_query(
             span_name=query_params.span_name,
             page_size=query_params.page_size,
             page_token=page_token,
-        ):
-            if isinstance(res, proxy.PageToken):
-                new_page_tokens.append(res)
-            else:
-                span_sets.append(
-                    otlpjson.OTLPJsonSpanCollection.Representation(
-                        util.force_jsonlike_dict_iter(res.to_otlp_json_iter())
-                    )  # type: ignore
-                )
+            verbosity=query_params.verbosity,
+        )
+
+    if len(page_tokens) == 1:
+        async for res in query_page(page_tokens[0]):
+            yield res
+        return
+
+    ## The parts of a multi-part page token are queried concurrently, but their
+    ## results (and so the parts of the next page token) are still returned in
+    ## the order of the parts
+    semaphore = asyncio.Semaphore(max(1, settings.max_concurrent_page_queries))
 
-    next_page_token: Optional[str] = (
+    async def collect_page(
+        page_token: Optional[proxy.PageToken],
+    ) -> List[base.SpanCollection | proxy.PageToken]:
+        async with semaphore:
+            return [res async for res in query_page(page_token)]
+
+    tasks = [asyncio.create_task(collect_page(token)) for token in page_tokens]
+    pending = set(tasks)
+    try:
+        for task in tasks:
+            ## Fails as soon as any part fails, not only once the parts before it
+            ## are done
+            while not task.done():
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for finished in done:
+                    finished.result()
+            for res in task.result():
+                yield res
+    finally:
+        for task in tasks:
+            task.cancel()
+        ## Retrieves the exceptions of the cancelled (or failed) queries
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _join_page_tokens(new_page_tokens: List[proxy.PageToken]) -> Optional[str]:
+    return (
         None
         if not new_page_tokens
         else ".".join(
@@ -212,14 +271,10 @@ async def run_query(
         )
     )
 
-    # # Disable validation for now
-    # return APIResponse.model_construct(
-    #     None, results=span_sets, next_page_token=next_page_token
-    # )
-
-    # query_params = request.query_params
-    # query_params
 
+def _response_links(
+    request: Request, path: str, next_page_token: Optional[str]
+) -> Links:
     query_params_list = [
         (key, value)
         for key, value in request.query_params.multi_items()
@@ -239,6 +294,45 @@ async def run_query(
         else None
     )
 
+    return Links(
+        self=get_request_url_str(settings.base_url, request),
+        first=link_first,
+        next=link_next,
+        root=settings.base_url,
+    )
+
+
+async def run_query(
+    auth_info: Any,
+    request: Request,
+    response: Response,
+    path: str,
+    span_ids: Optional[List[Tuple[Optional[str], Optional[str]]]],
+    query_params: QueryParams,
+) -> APIOKResponse | Response:
+    if settings.streaming_responses:
+        return await run_query_streaming(
+            auth_info, request, response, path, span_ids, query_params
+        )
+
+    new_page_tokens = []
+    span_sets = []
+
+    async for res in _query_pages(auth_info, span_ids, query_params):
+        if isinstance(res, proxy.PageToken):
+            new_page_tokens.append(res)
+        else:
+            span_sets.append(
+                otlpjson.OTLPJsonSpanCollection.Representation(res.to_otlp_json_dict())  # type: ignore
+            )
+
+    next_page_token = _join_page_tokens(new_page_tokens)
+
+    # # Disable validation for now
+    # return APIResponse.model_construct(
+    #     None, results=span_sets, next_page_token=next_page_token
+    # )
+
     return APIOKResponseList[
         otlpjson.OTLPJsonSpanCollection.Representation, ResponseMeta
     ](
@@ -248,17 +342,118 @@ async def run_query(
             ].model_construct(id=None, type="resourceSpans", attributes=span_set)
             for span_set in span_sets
         ],
-        links=Links(
-            self=get_request_url_str(settings.base_url, request),
-            first=link_first,
-            next=link_next,
-            root=settings.base_url,
-        ),
+        links=_response_links(request, path, next_page_token),
         meta=ResponseMeta(page=ResponseNextPageToken(next_page_token=next_page_token)),
     )
 
 
-app = FastAPI()
+## Starlette sends every chunk separately, so avoid sending the many tiny
+## strings produced by the JSON encoder one by one
+STREAMING_CHUNK_SIZE = 64 * 1024
+## Reported in the meta of a streamed response when the query fails midway
+STREAMING_ERROR = ResponseError(
+    status="500",
+    title="Internal Server Error",
+    detail="The query failed after part of the response was sent, the response is incomplete.",
+)
+
+
+async def run_query_streaming(
+    auth_info: Any,
+    request: Request,
+    response: Response,
+    path: str,
+    span_ids: Optional[List[Tuple[Optional[str], Optional[str]]]],
+    query_params: QueryParams,
+) -> StreamingResponse:
+    """
+    Same response as run_query, but the span collections are encoded and sent as
+    they are returned by the proxy rather than first being collected in memory.
+    Links and meta depend on the page tokens returned last, so they are written
+    after the data. If the proxy fails after the response was started, the data
+    ends with the last span collection that was encoded completely, there is no
+    next page and meta.error is set instead.
+    """
+    results = _query_pages(auth_info, span_ids, query_params)
+    ## Wait for the first result before starting the response so that errors
+    ## from the proxy (e.g. invalid page tokens) still result in an error response
+    first = await anext(results, None)
+
+    def encode_data(span_set: base.SpanCollection, is_first: bool) -> str:
+        ## Encoded completely before any of it is sent, so that a failure never
+        ## leaves half a span collection in the response
+        return "".join(
+            chain(
+                [
+                    '{"id":null,"type":"resourceSpans","attributes":'
+                    if is_first
+                    else ',{"id":null,"type":"resourceSpans","attributes":'
+                ],
+                span_set.to_otlp_json_str_iter(),
+                ["}"],
+            )
+        )
+
+    async def encode() -> AsyncIterator[str]:
+        new_page_tokens: List[proxy.PageToken] = []
+        buffer: List[str] = ['{"data":[']
+        buffered = 0
+        is_first = True
+        error: Optional[ResponseError] = None
+
+        try:
+            res = first
+            while res is not None:
+                if isinstance(res, proxy.PageToken):
+                    new_page_tokens.append(res)
+                else:
+                    chunk = encode_data(res, is_first)
+                    buffer.append(chunk)
+                    buffered += len(chunk)
+                    if buffered >= STREAMING_CHUNK_SIZE:
+                        yield "".join(buffer)
+                        buffer = []
+                        buffered = 0
+                    is_first = False
+                res = await anext(results, None)
+        except Exception:
+            ## Can no longer change the status code, but can still end with a
+            ## well-formed document. The details are not exposed to the client.
+            logger.exception("Span query failed while streaming the response")
+            error = STREAMING_ERROR
+            ## The page tokens of an incomplete page must not be followed
+            new_page_tokens = []
+        finally:
+            ## Cancels the queries of the remaining page token parts, if any
+            await results.aclose()
+
+        next_page_token = _join_page_tokens(new_page_tokens)
+        links = _response_links(request, path, next_page_token)
+        meta = ResponseMeta(page=ResponseNextPageToken(next_page_token=next_page_token))
+        if error is not None:
+            meta.error = error
+        buffer.append('],"links":')
+        buffer.append(links.model_dump_json(exclude_unset=True))
+        buffer.append(',"meta":')
+        buffer.append(meta.model_dump_json(exclude_unset=True))
+        buffer.append("}")
+        yield "".join(buffer)
+
+    ## With the headers (e.g. Allow) set on the response by the endpoint
+    return StreamingResponse(
+        encode(), headers=response.headers, media_type=JSONAPIResponse.media_type
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    yield
+    ## Close pooled backend connections and such on shutdown
+    if settings._proxy is not None:
+        await settings._proxy.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 # A solution to make CORS headers appear in error responses too, based on
 # https://github.com/fastapi/fastapi/discussions/8027#discussioncomment-5146484
 wrapped_app = CORSMiddleware(
@@ -321,14 +516,16 @@ async def root(
 @router.get(
     "/v1/spans",
     status_code=status.HTTP_200_OK,
+    ## Explicit, since the endpoint may also return a StreamingResponse
+    response_model=APIOKResponse,
     response_model_exclude_unset=True,
 )
 async def get_spans(
     auth_info: Annotated[Any, Depends(security_scheme)],
     request: Request,
     response: Response,
-    query_params: Annotated[QueryParams, Query()],
-) -> APIOKResponse:
+    query_params: Annotated[SpansQueryParams, Query()],
+) -> APIOKResponse | Response:
     if ON_AUTH_HOOK_NAME in loaded_hooks:
         auth_info = await call_hooks_until_not_none(
             loaded_hooks[ON_AUTH_HOOK_NAME], auth_info
@@ -336,13 +533,20 @@ async def get_spans(
 
     response.headers["Allow"] = "GET"
     return await run_query(
-        auth_info, request, path="/v1/spans", span_ids=None, query_params=query_params
+        auth_info,
+        request,
+        response,
+        path="/v1/spans",
+        span_ids=[(trace_id, None) for trace_id in query_params.trace_ids] or None,
+        query_params=query_params,
     )
 
 
 @router.get(
     "/v1/spans/{trace_id}",
     status_code=status.HTTP_200_OK,
+    ## Explicit, since the endpoint may also return a StreamingResponse
+    response_model=APIOKResponse,
     response_model_exclude_unset=True,
 )
 async def get_trace(
@@ -351,7 +555,7 @@ async def get_trace(
     response: Response,
     trace_id: str,
     query_params: Annotated[QueryParams, Query()],
-) -> APIOKResponse:
+) -> APIOKResponse | Response:
     if ON_AUTH_HOOK_NAME in loaded_hooks:
         auth_info = await call_hooks_until_not_none(
             loaded_hooks[ON_AUTH_HOOK_NAME], auth_info
@@ -361,6 +565,7 @@ async def get_trace(
     return await run_query(
         auth_info,
         request,
+        response,
         path="/v1/spans/{trace_id}",
         span_ids=[(trace_id, None)],
         query_params=query_params,
@@ -370,6 +575,8 @@ async def get_trace(
 @router.get(
     "/v1/spans/{trace_id}/{span_id}",
     status_code=status.HTTP_200_OK,
+    ## Explicit, since the endpoint may also return a StreamingResponse
+    response_model=APIOKResponse,
     response_model_exclude_unset=True,
 )
 async def get_span(
@@ -379,7 +586,7 @@ async def get_span(
     trace_id: str,
     span_id: str,
     query_params: Annotated[QueryParams, Query()],
-) -> APIOKResponse:
+) -> APIOKResponse | Response:
     if ON_AUTH_HOOK_NAME in loaded_hooks:
         auth_info = await call_hooks_until_not_none(
             loaded_hooks[ON_AUTH_HOOK_NAME], auth_info
@@ -389,6 +596,7 @@ async def get_span(
     return await run_query(
         auth_info,
         request,
+        response,
         path="/v1/spans/{trace_id}/{span_id}",
         span_ids=[(trace_id, span_id)],
         query_params=query_params,
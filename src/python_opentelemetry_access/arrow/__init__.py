@@ -0,0 +1,396 @@
+"""
+Apache Arrow IPC and Parquet representations of span collections, with one row per span.
+
+Resource and scope are repeated on every row (dictionary encoded), events and links are
+nested lists of structs, and attributes are stored as JSON text, so the files can be read
+directly with e.g. pandas.read_parquet/pyarrow.ipc.open_file and loaded back losslessly.
+"""
+
+from collections.abc import Iterator
+from itertools import groupby
+from typing import Any, BinaryIO, List, Optional
+import io
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError as e:
+    raise ImportError(
+        "The arrow-ipc and parquet formats require pyarrow, "
+        "install it with `pip install python-opentelemetry-access[arrow]`"
+    ) from e
+
+from .. import base
+from .. import util
+from ..util.jsoncodec import get_codec
+
+_DICT_STRING = pa.dictionary(pa.int32(), pa.string())
+_TIMESTAMP = pa.timestamp("ns", tz="UTC")
+
+
+def _schema(timestamp: pa.DataType) -> pa.Schema:
+    return pa.schema(
+        [
+            ## Position of the resource (and scope) spans in the collection, so
+            ## that the grouping survives the round-trip
+            ("resource_index", pa.int32()),
+            ("resource_attributes", _DICT_STRING),
+            ("resource_dropped_attributes_count", pa.uint32()),
+            ("resource_schema_url", _DICT_STRING),
+            ("scope_index", pa.int32()),
+            ("scope_name", _DICT_STRING),
+            ("scope_version", _DICT_STRING),
+            ("scope_attributes", _DICT_STRING),
+            ("scope_dropped_attributes_count", pa.uint32()),
+            ("scope_schema_url", _DICT_STRING),
+            ("trace_id", pa.string()),
+            ("span_id", pa.string()),
+            ("trace_state", pa.string()),
+            ("parent_span_id", pa.string()),
+            ("flags", pa.uint32()),
+            ("name", _DICT_STRING),
+            ("kind", pa.int8()),
+            ("start_time", timestamp),
+            ("end_time", timestamp),
+            ("attributes", pa.string()),
+            ("dropped_attributes_count", pa.uint32()),
+            (
+                "events",
+                pa.list_(
+                    pa.struct(
+                        [
+                            ("time", timestamp),
+                            ("name", pa.string()),
+                            ("attributes", pa.string()),
+                            ("dropped_attributes_count", pa.uint32()),
+                        ]
+                    )
+                ),
+            ),
+            ("dropped_events_count", pa.uint32()),
+            (
+                "links",
+                pa.list_(
+                    pa.struct(
+                        [
+                            ("trace_id", pa.string()),
+                            ("span_id", pa.string()),
+                            ("trace_state", pa.string()),
+                            ("attributes", pa.string()),
+                            ("dropped_attributes_count", pa.uint32()),
+                            ("flags", pa.uint32()),
+                        ]
+                    )
+                ),
+            ),
+            ("dropped_links_count", pa.uint32()),
+            ("status_code", pa.int8()),
+            ("status_message", pa.string()),
+        ]
+    )
+
+
+SCHEMA = _schema(_TIMESTAMP)
+## SCHEMA with times as plain integers, which is what loading converts to
+_INT_TIME_SCHEMA = _schema(pa.int64())
+
+DEFAULT_ROWS_PER_BATCH = 64 * 1024
+
+
+class _GrowingDictionary:
+    """
+    Dictionary encodes string columns batch by batch, such that the dictionary of
+    every batch extends that of the previous one. IPC files cannot replace
+    dictionaries between batches, only add to them.
+    """
+
+    def __init__(self) -> None:
+        self._values: List[str] = []
+        self._codes: dict[str, int] = {}
+
+    def encode(self, values: List[Optional[str]]) -> pa.DictionaryArray:
+        indices: List[Optional[int]] = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            code = self._codes.get(value)
+            if code is None:
+                code = len(self._values)
+                self._codes[value] = code
+                self._values.append(value)
+            indices.append(code)
+        return pa.DictionaryArray.from_arrays(
+            pa.array(indices, type=pa.int32()), pa.array(self._values, pa.string())
+        )
+
+
+def _attributes_json(attributes: util.JSONLikeDictIter) -> str:
+    return get_codec().dumps(util.force_jsonlike_dict_iter(attributes))
+
+
+def to_record_batches(
+    spans: base.SpanCollection, rows_per_batch: int = DEFAULT_ROWS_PER_BATCH
+) -> Iterator[pa.RecordBatch]:
+    """
+    Converts spans to record batches of SCHEMA, of at most rows_per_batch rows each
+    """
+    columns: dict[str, List[Any]] = {name: [] for name in SCHEMA.names}
+    dictionaries = {
+        field.name: _GrowingDictionary()
+        for field in SCHEMA
+        if pa.types.is_dictionary(field.type)
+    }
+
+    def flush() -> pa.RecordBatch:
+        arrays = [
+            dictionaries[field.name].encode(columns[field.name])
+            if field.name in dictionaries
+            else pa.array(columns[field.name], type=field.type)
+            for field in SCHEMA
+        ]
+        for column in columns.values():
+            column.clear()
+        return pa.RecordBatch.from_arrays(arrays, schema=SCHEMA)
+
+    scope_index = 0
+    for resource_index, rs in enumerate(spans.otlp_resource_spans):
+        resource = rs.otlp_resource
+        resource_attributes = _attributes_json(resource.otlp_attributes_iter)
+        for ss in rs.otlp_scope_spans:
+            scope = ss.otlp_scope
+            scope_attributes = _attributes_json(scope.otlp_attributes_iter)
+            for span in ss.otlp_spans:
+                columns["resource_index"].append(resource_index)
+                columns["resource_attributes"].append(resource_attributes)
+                columns["resource_dropped_attributes_count"].append(
+                    resource.otlp_dropped_attributes_count
+                )
+                columns["resource_schema_url"].append(rs.otlp_schema_url)
+                columns["scope_index"].append(scope_index)
+                columns["scope_name"].append(scope.otlp_name)
+                columns["scope_version"].append(scope.otlp_version)
+                columns["scope_attributes"].append(scope_attributes)
+                columns["scope_dropped_attributes_count"].append(
+                    scope.otlp_dropped_attributes_count
+                )
+                columns["scope_schema_url"].append(ss.otlp_schema_url)
+                columns["trace_id"].append(span.otlp_trace_id)
+                columns["span_id"].append(span.otlp_span_id)
+                columns["trace_state"].append(span.otlp_trace_state)
+                columns["parent_span_id"].append(span.otlp_parent_span_id)
+                columns["flags"].append(span.otlp_flags)
+                columns["name"].append(span.otlp_name)
+                columns["kind"].append(int(span.otlp_kind.otlp_kind_code))
+                columns["start_time"].append(span.otlp_start_time_unix_nano)
+                columns["end_time"].append(span.otlp_end_time_unix_nano)
+                columns["attributes"].append(
+                    _attributes_json(span.otlp_attributes_iter)
+                )
+                columns["dropped_attributes_count"].append(
+                    span.otlp_dropped_attributes_count
+                )
+                columns["events"].append(
+                    [
+                        {
+                            "time": event.otlp_time_unix_nano,
+                            "name": event.otlp_name,
+                            "attributes": _attributes_json(event.otlp_attributes_iter),
+                            "dropped_attributes_count": event.otlp_dropped_attributes_count,
+                        }
+                        for event in span.otlp_events
+                    ]
+                )
+                columns["dropped_events_count"].append(span.otlp_dropped_events_count)
+                columns["links"].append(
+                    [
+                        {
+                            "trace_id": link.otlp_trace_id,
+                            "span_id": link.otlp_span_id,
+                            "trace_state": link.otlp_state,
+                            "attributes": _attributes_json(link.otlp_attributes_iter),
+                            "dropped_attributes_count": link.otlp_dropped_attributes_count,
+                            "flags": link.otlp_flags,
+                        }
+                        for link in span.otlp_links
+                    ]
+                )
+                columns["dropped_links_count"].append(span.otlp_dropped_links_count)
+                status = span.otlp_status
+                columns["status_code"].append(int(status.otlp_code))
+                columns["status_message"].append(status.otlp_message)
+
+                if len(columns["span_id"]) >= rows_per_batch:
+                    yield flush()
+            scope_index += 1
+
+    if columns["span_id"]:
+        yield flush()
+
+
+def to_table(spans: base.SpanCollection) -> pa.Table:
+    return pa.Table.from_batches(list(to_record_batches(spans)), schema=SCHEMA)
+
+
+def _rows(table: pa.Table) -> Iterator[dict[str, Any]]:
+    try:
+        ## Tolerate extra columns (e.g. a pandas index) and other encodings of
+        ## the same values (e.g. plain instead of dictionary encoded strings)
+        table = table.select(SCHEMA.names).cast(_INT_TIME_SCHEMA)
+    except (KeyError, pa.ArrowException) as e:
+        raise ValueError(f"Not a span table: {e}") from e
+    for batch in table.to_batches():
+        columns = batch.to_pydict()
+        for i in range(batch.num_rows):
+            yield {name: values[i] for name, values in columns.items()}
+
+
+def from_table(table: pa.Table) -> base.ReifiedSpanCollection:
+    """
+    Inverse of to_table. Resources and scopes without any spans are not represented
+    in a table, so those are lost in the round-trip.
+    """
+    codec = get_codec()
+
+    def _attributes(s: str) -> util.JSONLikeDict:
+        return util.intern_keys(codec.loads(s))  # type: ignore
+
+    def span(row: dict[str, Any]) -> base.ReifiedSpan:
+        return base.ReifiedSpan(
+            trace_id=row["trace_id"],
+            span_id=row["span_id"],
+            trace_state=row["trace_state"],
+            parent_span_id=row["parent_span_id"],
+            flags=row["flags"],
+            name=row["name"],
+            kind=base.ReifiedSpanKind(kind_code=row["kind"]),
+            start_time_unix_nano=row["start_time"],
+            end_time_unix_nano=row["end_time"],
+            attributes=_attributes(row["attributes"]),
+            dropped_attributes_count=row["dropped_attributes_count"],
+            events=[
+                base.ReifiedSpanEvent(
+                    time_unix_nano=event["time"],
+                    name=event["name"],
+                    attributes=_attributes(event["attributes"]),
+                    dropped_attributes_count=event["dropped_attributes_count"],
+                )
+                for event in row["events"]
+            ],
+            dropped_events_count=row["dropped_events_count"],
+            links=[
+                base.ReifiedSpanLink(
+                    trace_id=link["trace_id"],
+                    span_id=link["span_id"],
+                    state=link["trace_state"],
+                    attributes=_attributes(link["attributes"]),
+                    dropped_attributes_count=link["dropped_attributes_count"],
+                    flags=link["flags"],
+                )
+                for link in row["links"]
+            ],
+            dropped_links_count=row["dropped_links_count"],
+            status=base.ReifiedStatus(
+                message=row["status_message"], code=row["status_code"]
+            ),
+        )
+
+    interners = base.ReifiedInterners()
+    resource_spans = []
+    for _, resource_rows in groupby(_rows(table), key=lambda r: r["resource_index"]):
+        scope_spans = []
+        first: Optional[dict[str, Any]] = None
+        for _, scope_rows_iter in groupby(
+            resource_rows, key=lambda r: r["scope_index"]
+        ):
+            scope_rows = list(scope_rows_iter)
+            first = first or scope_rows[0]
+            scope_spans.append(
+                base.ReifiedScopeSpanCollection(
+                    scope=interners.scopes.intern(
+                        base.ReifiedInstrumentationScope(
+                            name=scope_rows[0]["scope_name"],
+                            version=scope_rows[0]["scope_version"],
+                            attributes=_attributes(scope_rows[0]["scope_attributes"]),
+                            dropped_attributes_count=scope_rows[0][
+                                "scope_dropped_attributes_count"
+                            ],
+                        )
+                    ),
+                    spans=[span(row) for row in scope_rows],
+                    schema_url=scope_rows[0]["scope_schema_url"],
+                )
+            )
+        assert first is not None
+        resource_spans.append(
+            base.ReifiedResourceSpanCollection(
+                resource=interners.resources.intern(
+                    base.ReifiedResource(
+                        attributes=_attributes(first["resource_attributes"]),
+                        dropped_attributes_count=first[
+                            "resource_dropped_attributes_count"
+                        ],
+                    )
+                ),
+                scope_spans=scope_spans,
+                schema_url=first["resource_schema_url"],
+            )
+        )
+    return base.ReifiedSpanCollection(resource_spans=resource_spans)
+
+
+def _seekable_source(fp: BinaryIO) -> Any:
+    """
+    A memory map of the file behind fp if there is one, else its (buffered) contents
+    """
+    path = getattr(fp, "name", None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return pa.memory_map(path)
+    return pa.BufferReader(fp.read())
+
+
+def load_parquet(fp: BinaryIO) -> base.ReifiedSpanCollection:
+    return from_table(pq.read_table(_seekable_source(fp)))
+
+
+def dump_parquet(
+    x: base.SpanCollection,
+    fp: BinaryIO,
+    compression: str = "zstd",
+    rows_per_batch: int = DEFAULT_ROWS_PER_BATCH,
+) -> None:
+    with pq.ParquetWriter(fp, SCHEMA, compression=compression) as writer:
+        for batch in to_record_batches(x, rows_per_batch):
+            writer.write_batch(batch)
+
+
+def load_ipc(fp: BinaryIO) -> base.ReifiedSpanCollection:
+    with pa.ipc.open_file(_seekable_source(fp)) as reader:
+        return from_table(reader.read_all())
+
+
+def dump_ipc(
+    x: base.SpanCollection,
+    fp: BinaryIO,
+    compression: Optional[str] = None,
+    rows_per_batch: int = DEFAULT_ROWS_PER_BATCH,
+) -> None:
+    """
+    Uncompressed by default, so that the file can be memory mapped without copying
+    """
+    options = pa.ipc.IpcWriteOptions(
+        compression=compression, emit_dictionary_deltas=True
+    )
+    with pa.ipc.new_file(fp, SCHEMA, options=options) as writer:
+        for batch in to_record_batches(x, rows_per_batch):
+            writer.write_batch(batch)
+
+
+def loads_parquet(s: bytes) -> base.ReifiedSpanCollection:
+    return load_parquet(io.BytesIO(s))
+
+
+def loads_ipc(s: bytes) -> base.ReifiedSpanCollection:
+    return load_ipc(io.BytesIO(s))
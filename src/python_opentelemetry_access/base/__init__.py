@@ -2,10 +2,10 @@ from collections.abc import Iterator
 from datetime import timedelta
 from typing import Union, Protocol, Optional, Tuple, List, assert_never, override
 from abc import abstractmethod
-import json
 from dataclasses import dataclass
 
 import binascii
+import json
 
 import opentelemetry_betterproto.opentelemetry.proto.common.v1 as common
 import opentelemetry_betterproto.opentelemetry.proto.trace.v1 as trace
@@ -13,6 +13,7 @@ import opentelemetry_betterproto.opentelemetry.proto.collector.trace.v1 as trace
 import opentelemetry_betterproto.opentelemetry.proto.resource.v1 as resource
 
 from .. import util
+from ..util.jsoncodec import OTLPJSONEncoder as OTLPJSONEncoder, get_codec
 
 OTLPProtobufType = Union[
     trace.SpanSpanKind,
@@ -41,16 +42,6 @@ ReifiedType = Union[
 ]
 
 
-class OTLPJSONEncoder(json.JSONEncoder):
-    ## TODO: Is there a better way to do this (without forcing the dict)?
-    @override
-    def default(self, o):
-        if isinstance(o, util.JSONLikeDictIter):
-            return {k: v for k, v in iter(o)}
-        else:
-            return super().default(o)
-
-
 # def to_otlp_json_iter(self) -> util.JSONLikeIter:
 #     def inner():
 #         raise NotImplementedError("Not implemented yet")
@@ -60,12 +51,16 @@ class OTLPJSONEncoder(json.JSONEncoder):
 # def to_otlp_protobuf(self) -> OTLPProtobufType:
 #     raise NotImplementedError("Not implemented yet")
 class OTLPData(Protocol):
+    ## Empty slots throughout the protocols, so that the (slotted) Reified* classes
+    ## can do without a per-instance __dict__
+    __slots__ = ()
+
     @abstractmethod
     def to_otlp_json_iter(self) -> util.JSONLikeIter:
         pass
 
     def to_otlp_json_str_iter(self) -> Iterator[str]:
-        return OTLPJSONEncoder().iterencode(self.to_otlp_json_iter())
+        return get_codec().iterencode(self.to_otlp_json_iter())
 
     def to_otlp_json(self) -> str:
         return "".join(self.to_otlp_json_str_iter())
@@ -83,6 +78,8 @@ class OTLPData(Protocol):
 
 
 class SpanEvent(OTLPData, Protocol):
+    __slots__ = ()
+
     @override
     def to_reified(self) -> "ReifiedSpanEvent":
         return ReifiedSpanEvent(
@@ -110,6 +107,29 @@ class SpanEvent(OTLPData, Protocol):
 
         return util.JSONLikeDictIter(inner())
 
+    def to_otlp_json_dict(self) -> util.JSONLikeDict:
+        """
+        Same as forcing to_otlp_json_iter, see Span.to_otlp_json_dict
+        """
+        result: util.JSONLikeDict = {
+            "timeUnixNano": str(self.otlp_time_unix_nano),
+            "name": self.otlp_name,
+        }
+
+        ## Not forced into a dict first, which would drop repeated keys
+        attributes = [
+            {"key": k, "value": util.to_otlp_any_value(util.force_jsonlike_iter(v))}
+            for k, v in self.otlp_attributes_iter
+        ]
+        if attributes:
+            result["attributes"] = attributes  # type: ignore
+
+        dropped = self.otlp_dropped_attributes_count
+        if dropped and dropped != 0:
+            result["droppedAttributesCount"] = dropped
+
+        return result
+
     @override
     def to_otlp_protobuf(self) -> trace.SpanEvent:
         return trace.SpanEvent(
@@ -145,6 +165,8 @@ class SpanEvent(OTLPData, Protocol):
 
 
 class Status(OTLPData, Protocol):
+    __slots__ = ()
+
     @override
     def to_reified(self) -> "ReifiedStatus":
         return ReifiedStatus(message=self.otlp_message, code=self.otlp_code)
@@ -164,6 +186,22 @@ class Status(OTLPData, Protocol):
 
         return util.JSONLikeDictIter(inner())
 
+    def to_otlp_json_dict(self) -> util.JSONLikeDict:
+        """
+        Same as forcing to_otlp_json_iter, see Span.to_otlp_json_dict
+        """
+        result: util.JSONLikeDict = {}
+
+        message = self.otlp_message
+        if message is not None:
+            result["message"] = message
+
+        code = self.otlp_code
+        if code != 0:
+            result["code"] = int(code)
+
+        return result
+
     @override
     def to_otlp_protobuf(self) -> trace.Status:
         return trace.Status(
@@ -186,6 +224,8 @@ class Status(OTLPData, Protocol):
 
 
 class SpanKind(OTLPData, Protocol):
+    __slots__ = ()
+
     @override
     def to_reified(self) -> "ReifiedSpanKind":
         return ReifiedSpanKind(kind_code=self.otlp_kind_code)
@@ -209,6 +249,8 @@ class SpanKind(OTLPData, Protocol):
 
 
 class SpanLink(OTLPData, Protocol):
+    __slots__ = ()
+
     @override
     def to_reified(self) -> "ReifiedSpanLink":
         return ReifiedSpanLink(
@@ -290,6 +332,8 @@ class SpanLink(OTLPData, Protocol):
 
 
 class Span(OTLPData, Protocol):
+    __slots__ = ()
+
     @override
     def to_reified(self) -> "ReifiedSpan":
         return ReifiedSpan(
@@ -346,10 +390,6 @@ class Span(OTLPData, Protocol):
             if dropped != 0:
                 yield ("droppedAttributesCount", dropped)
 
-            flags = self.otlp_flags
-            if flags:
-                yield ("flags", flags)
-
             peek_events = util.peek_iterator(self.otlp_events)
             if peek_events:
                 _, events = peek_events
@@ -366,6 +406,49 @@ class Span(OTLPData, Protocol):
 
         return util.JSONLikeDictIter(inner())
 
+    def to_otlp_json_dict(self) -> util.JSONLikeDict:
+        """
+        Same as forcing to_otlp_json_iter, but builds the dicts and lists directly,
+        without the iterators wrapping every attribute. Spans that can do so
+        cheaper straight from their source (e.g. OTLPProtoSpan) override this.
+        See DirectJSONSpanCollection.
+        """
+        result: util.JSONLikeDict = {
+            "traceId": self.otlp_trace_id,
+            "spanId": self.otlp_span_id,
+        }
+
+        traceState = self.otlp_trace_state
+        if traceState:
+            result["traceState"] = traceState
+
+        result["parentSpanId"] = self.otlp_parent_span_id
+
+        flags = self.otlp_flags
+        if flags != 0:
+            result["flags"] = flags
+
+        result["name"] = self.otlp_name
+        result["kind"] = self.otlp_kind.to_otlp_json_iter()
+        result["startTimeUnixNano"] = str(self.otlp_start_time_unix_nano)
+        result["endTimeUnixNano"] = str(self.otlp_end_time_unix_nano)
+
+        attributes = self.otlp_attributes_normalised()
+        if len(attributes) > 0:
+            result["attributes"] = util.to_kv_list(attributes)
+
+        dropped = self.otlp_dropped_attributes_count
+        if dropped != 0:
+            result["droppedAttributesCount"] = dropped
+
+        events = [event.to_otlp_json_dict() for event in self.otlp_events]
+        if events:
+            result["events"] = events  # type: ignore
+
+        result["status"] = self.otlp_status.to_otlp_json_dict()
+
+        return result
+
     @override
     def to_otlp_protobuf(self) -> trace.Span:
         return trace.Span(
@@ -540,6 +623,8 @@ class Span(OTLPData, Protocol):
 
 
 class InstrumentationScope(OTLPData, Protocol):
+    __slots__ = ()
+
     @override
     def to_reified(self) -> "ReifiedInstrumentationScope":
         return ReifiedInstrumentationScope(
@@ -605,6 +690,8 @@ class InstrumentationScope(OTLPData, Protocol):
 
 
 class Resource(OTLPData, Protocol):
+    __slots__ = ()
+
     @override
     def to_reified(self) -> "ReifiedResource":
         return ReifiedResource(
@@ -654,10 +741,15 @@ class Resource(OTLPData, Protocol):
 
 
 class ScopeSpanCollection(OTLPData, Protocol):
+    __slots__ = ()
+
     @override
-    def to_reified(self) -> "ReifiedScopeSpanCollection":
+    def to_reified(
+        self, interners: Optional["ReifiedInterners"] = None
+    ) -> "ReifiedScopeSpanCollection":
+        scope = self.otlp_scope.to_reified()
         return ReifiedScopeSpanCollection(
-            scope=self.otlp_scope.to_reified(),
+            scope=scope if interners is None else interners.scopes.intern(scope),
             spans=[span.to_reified() for span in self.otlp_spans],
             schema_url=self.otlp_schema_url,
         )
@@ -705,12 +797,19 @@ class ScopeSpanCollection(OTLPData, Protocol):
 
 
 class ResourceSpanCollection(OTLPData, Protocol):
+    __slots__ = ()
+
     @override
-    def to_reified(self) -> "ReifiedResourceSpanCollection":
+    def to_reified(
+        self, interners: Optional["ReifiedInterners"] = None
+    ) -> "ReifiedResourceSpanCollection":
+        if interners is None:
+            interners = ReifiedInterners()
         return ReifiedResourceSpanCollection(
-            resource=self.otlp_resource.to_reified(),
+            resource=interners.resources.intern(self.otlp_resource.to_reified()),
             scope_spans=[
-                scope_spans.to_reified() for scope_spans in self.otlp_scope_spans
+                scope_spans.to_reified(interners)
+                for scope_spans in self.otlp_scope_spans
             ],
             schema_url=self.otlp_schema_url,
         )
@@ -766,11 +865,14 @@ class ResourceSpanCollection(OTLPData, Protocol):
 
 
 class SpanCollection(OTLPData, Protocol):
+    __slots__ = ()
+
     @override
     def to_reified(self) -> "ReifiedSpanCollection":
+        interners = ReifiedInterners()
         return ReifiedSpanCollection(
             resource_spans=[
-                resource_spans.to_reified()
+                resource_spans.to_reified(interners)
                 for resource_spans in self.otlp_resource_spans
             ]
         )
@@ -789,6 +891,9 @@ class SpanCollection(OTLPData, Protocol):
 
         return util.JSONLikeDictIter(inner())
 
+    def to_otlp_json_dict(self) -> util.JSONLikeDict:
+        return util.force_jsonlike_dict_iter(self.to_otlp_json_iter())
+
     @override
     def to_otlp_protobuf(self) -> trace_collector.ExportTraceServiceRequest:
         return trace_collector.ExportTraceServiceRequest(
@@ -810,6 +915,72 @@ class SpanCollection(OTLPData, Protocol):
                 yield (resource, scope, span)
 
 
+class DirectJSONSpanCollection(SpanCollection, Protocol):
+    """
+    A span collection encoded to OTLP JSON with its spans' to_otlp_json_dict,
+    which they build straight from their source, rather than with the generic
+    to_otlp_json_iter. The output is the same. Used for the sources with such
+    spans (OTLP protobuf, SS4O), so the CLI and API pick it automatically.
+    """
+
+    __slots__ = ()
+
+    def to_otlp_json_direct_iter(self) -> util.JSONLikeDictIter:
+        """
+        Like to_otlp_json_iter, but with the spans as plain dicts
+        """
+
+        def scope_spans(ssc: ScopeSpanCollection):
+            yield (
+                "scope",
+                util.force_jsonlike_iter(ssc.otlp_scope.to_otlp_json_iter()),
+            )
+            yield (
+                "spans",
+                util.JSONLikeListIter(x.to_otlp_json_dict() for x in ssc.otlp_spans),
+            )
+            schema_url = ssc.otlp_schema_url
+            if schema_url:
+                yield ("schemaUrl", schema_url)
+
+        def resource_spans(rsc: ResourceSpanCollection):
+            yield (
+                "resource",
+                util.force_jsonlike_iter(rsc.otlp_resource.to_otlp_json_iter()),
+            )
+            yield (
+                "scopeSpans",
+                util.JSONLikeListIter(
+                    util.JSONLikeDictIter(scope_spans(x)) for x in rsc.otlp_scope_spans
+                ),
+            )
+            schema_url = rsc.otlp_schema_url
+            if schema_url:
+                yield ("schemaUrl", schema_url)
+
+        return util.JSONLikeDictIter(
+            iter(
+                [
+                    (
+                        "resourceSpans",
+                        util.JSONLikeListIter(
+                            util.JSONLikeDictIter(resource_spans(x))
+                            for x in self.otlp_resource_spans
+                        ),
+                    )
+                ]
+            )
+        )
+
+    @override
+    def to_otlp_json_str_iter(self) -> Iterator[str]:
+        return get_codec().iterencode_shallow(self.to_otlp_json_direct_iter())
+
+    @override
+    def to_otlp_json_dict(self) -> util.JSONLikeDict:
+        return util.force_jsonlike_dict_iter(self.to_otlp_json_direct_iter())
+
+
 def iter_jsonlike(jobj: util.JSONLike) -> util.JSONLikeIter:
     if isinstance(jobj, dict):
         return iter_jsonlike_dict(jobj)
@@ -829,7 +1000,7 @@ def iter_jsonlike_dict(jobj: util.JSONLikeDict) -> util.JSONLikeDictIter:
     return util.JSONLikeDictIter(((k, iter_jsonlike(v)) for k, v in jobj.items()))
 
 
-@dataclass
+@dataclass(slots=True)
 class ReifiedSpanEvent(SpanEvent):
     time_unix_nano: int
 
@@ -860,7 +1031,7 @@ class ReifiedSpanEvent(SpanEvent):
         return self.dropped_attributes_count
 
 
-@dataclass
+@dataclass(slots=True)
 class ReifiedStatus(Status):
     message: Optional[str]
 
@@ -877,7 +1048,7 @@ class ReifiedStatus(Status):
         return self.code
 
 
-@dataclass
+@dataclass(slots=True)
 class ReifiedSpanKind(SpanKind):
     kind_code: int
 
@@ -887,7 +1058,7 @@ class ReifiedSpanKind(SpanKind):
         return self.kind_code
 
 
-@dataclass
+@dataclass(slots=True)
 class ReifiedSpanLink(SpanLink):
     trace_id: str
 
@@ -932,7 +1103,7 @@ class ReifiedSpanLink(SpanLink):
         return self.flags
 
 
-@dataclass
+@dataclass(slots=True)
 class ReifiedSpan(Span):
     trace_id: str
 
@@ -1047,7 +1218,8 @@ class ReifiedSpan(Span):
         return self.status
 
 
-@dataclass
+## Weak references for ReifiedInterners
+@dataclass(slots=True, weakref_slot=True)
 class ReifiedInstrumentationScope(InstrumentationScope):
     name: str
 
@@ -1078,7 +1250,7 @@ class ReifiedInstrumentationScope(InstrumentationScope):
         return self.dropped_attributes_count
 
 
-@dataclass
+@dataclass(slots=True, weakref_slot=True)
 class ReifiedResource(Resource):
     attributes: util.JSONLikeDict
 
@@ -1099,7 +1271,36 @@ class ReifiedResource(Resource):
 ## "SpanCollection" abstraction
 
 
-@dataclass
+class ReifiedInterners:
+    """
+    Identical resources and scopes are typically repeated in every resource (scope)
+    spans, so a single reification (e.g. SpanCollection.to_reified) shares one object
+    between all of them. The objects are only shared within that one collection, so
+    modifying one collection never affects another (within it, replace a resource
+    or scope rather than modify it). Attributes are keyed canonically: OTLP
+    attributes are a map, so their order does not matter.
+    """
+
+    __slots__ = ("resources", "scopes")
+
+    def __init__(self) -> None:
+        self.resources = util.Interner[ReifiedResource](
+            lambda r: (
+                json.dumps(r.attributes, sort_keys=True),
+                r.dropped_attributes_count,
+            )
+        )
+        self.scopes = util.Interner[ReifiedInstrumentationScope](
+            lambda s: (
+                s.name,
+                s.version,
+                json.dumps(s.attributes, sort_keys=True),
+                s.dropped_attributes_count,
+            )
+        )
+
+
+@dataclass(slots=True)
 class ReifiedScopeSpanCollection(ScopeSpanCollection):
     scope: ReifiedInstrumentationScope
 
@@ -1123,7 +1324,7 @@ class ReifiedScopeSpanCollection(ScopeSpanCollection):
         return self.schema_url
 
 
-@dataclass
+@dataclass(slots=True)
 class ReifiedResourceSpanCollection(ResourceSpanCollection):
     resource: ReifiedResource
 
@@ -1147,7 +1348,7 @@ class ReifiedResourceSpanCollection(ResourceSpanCollection):
         return self.schema_url
 
 
-@dataclass
+@dataclass(slots=True)
 class ReifiedSpanCollection(SpanCollection):
     resource_spans: List[ReifiedResourceSpanCollection]
 
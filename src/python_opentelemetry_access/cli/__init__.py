@@ -1,23 +1,23 @@
 # type: ignore
-import python_opentelemetry_access.opensearch.ss4o as ss4o
-import python_opentelemetry_access.otlpjson as otlpjson
-import python_opentelemetry_access.otlpproto as otlpproto
+## Formats, the API, the proxies and their dependencies are imported lazily,
+## so that each command only pays for the modules it actually uses
 
-import python_opentelemetry_access.proxy as proxy_mod
-import python_opentelemetry_access.proxy.opensearch.ss4o as ss4o_proxy
-import python_opentelemetry_access.api as api
-from eoepca_api_utils.api_utils import get_env_var_or_throw
-
-from python_opentelemetry_access.telemetry_hooks import load_hooks, Hooks
-from python_opentelemetry_access.telemetry_hooks.utils import OpensearchConfig
-
-import uvicorn
 # from opensearchpy import AsyncOpenSearch
 
-from typing import Optional, Any
+from typing import Optional, Any, Callable, TYPE_CHECKING
+from contextlib import ExitStack
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from itertools import batched
+from glob import glob
+from datetime import timedelta
+from importlib import import_module
 
 # import asyncio
+import io
 import logging
+import time
 from os import environ
 from pathlib import Path
 from sys import stdin, stdout
@@ -25,29 +25,78 @@ import os
 
 import click
 
+if TYPE_CHECKING:
+    import python_opentelemetry_access.proxy as proxy_mod
+    from python_opentelemetry_access.telemetry_hooks import Hooks
+
 logger = logging.getLogger("python-opentelemetry-access")
 
 
 CONTEXT_SETTINGS = {"help_option_names": ["-h", "--help"]}
 
+## Same as util.jsoncodec.CODECS (plus auto), which is not imported here as it
+## would import util and its dependencies
+JSON_CODECS = ["auto", "stdlib", "orjson", "msgspec"]
+
+
+def _set_codec(name: str) -> None:
+    from python_opentelemetry_access.util.jsoncodec import set_codec
+
+    set_codec(name)
+
+
+def _codec_name() -> str:
+    from python_opentelemetry_access.util.jsoncodec import get_codec
+
+    return get_codec().name
+
 
 @click.group(context_settings=CONTEXT_SETTINGS)
 @click.option("--verbose/--no-verbose", "-v", default=False)
+@click.option(
+    "--json-codec",
+    type=click.Choice(JSON_CODECS),
+    default=None,
+    help="JSON library used for loading and dumping (default: $RH_TELEMETRY_JSON_CODEC or stdlib). "
+    "otlp-json input is parsed incrementally with the standard library regardless.",
+)
 # @click.version_option(version=0.1.0, prog_name="python-opentelemetry-access")
 @click.pass_context
-def cli(ctx, verbose: bool) -> None:
+def cli(ctx, verbose: bool, json_codec: Optional[str]) -> None:
     """
     python-opentelemetry-access command line interface
     """
     ctx.obj = {"verbose": verbose}
+    if json_codec is not None:
+        _set_codec(json_codec)
     logger.setLevel(logging.INFO if verbose else logging.WARNING)
 
 
+def _lazy(module: str, name: str) -> Callable[..., Any]:
+    """
+    A function that imports python_opentelemetry_access.<module> on first call
+    and calls <name> from it
+    """
+
+    def call(*args, **kwargs):
+        return getattr(import_module(f"python_opentelemetry_access.{module}"), name)(
+            *args, **kwargs
+        )
+
+    return call
+
+
 IN_FORMATS = {
-    "ss4o_bare": (False, ss4o.load_bare),
-    "ss4o": (False, ss4o.load),
-    "otlp-json": (False, otlpjson.load),
-    "otlp-proto": (True, otlpproto.load),
+    "ss4o_bare": (False, _lazy("opensearch.ss4o", "load_bare")),
+    "ss4o": (False, _lazy("opensearch.ss4o", "load")),
+    ## Streams resource spans, so memory does not grow with the size of the file
+    "otlp-json": (False, _lazy("otlpjson", "load_streaming")),
+    "otlp-proto": (True, _lazy("otlpproto", "load")),
+    "otlp-jsonl": (False, _lazy("otlpjson", "load_lines")),
+    "otlp-proto-delimited": (True, _lazy("otlpproto", "load_delimited")),
+    ## Need pyarrow
+    "parquet": (True, _lazy("arrow", "load_parquet")),
+    "arrow-ipc": (True, _lazy("arrow", "load_ipc")),
 }
 
 
@@ -63,8 +112,66 @@ def dump_otlp_proto(x, f):
 OUT_FORMATS = {
     "otlp-json": (False, dump_otlp_json),
     "otlp-proto": (True, dump_otlp_proto),
+    "otlp-jsonl": (False, _lazy("otlpjson", "dump_lines")),
+    "otlp-proto-delimited": (True, _lazy("otlpproto", "dump_delimited")),
+    "parquet": (True, _lazy("arrow", "dump_parquet")),
+    "arrow-ipc": (True, _lazy("arrow", "dump_ipc")),
+}
+
+## Output formats for which converting parts of the input separately and
+## concatenating the results is the same as converting the input as a whole
+## (concatenated protobuf messages are merged, which appends repeated fields)
+CONCATENABLE_OUT_FORMATS = {"otlp-jsonl", "otlp-proto", "otlp-proto-delimited"}
+
+## File extensions used by convert-many --output-dir
+OUT_FORMAT_EXTENSIONS = {
+    "otlp-json": ".json",
+    "otlp-proto": ".binpb",
+    "otlp-jsonl": ".jsonl",
+    "otlp-proto-delimited": ".binpbd",
+    "parquet": ".parquet",
+    "arrow-ipc": ".arrow",
+}
+
+## Files picked from directories given to convert-many, unless --glob is given
+IN_FORMAT_GLOBS = {
+    "ss4o_bare": "*.json",
+    "ss4o": "*.json",
+    "otlp-json": "*.json",
+    "otlp-proto": "*.binpb",
+    "otlp-jsonl": "*.jsonl",
+    "otlp-proto-delimited": "*.binpbd",
+    "parquet": "*.parquet",
+    "arrow-ipc": "*.arrow",
 }
 
+## Lines of otlp-jsonl handed to a worker at once, when converting in parallel
+LINES_PER_TASK = 64
+
+
+def _convert_jsonl_lines(lines: tuple[str, ...], to: str) -> str | bytes:
+    import python_opentelemetry_access.otlpjson as otlpjson
+
+    is_binary_out, writer = OUT_FORMATS[to]
+    out = io.BytesIO() if is_binary_out else io.StringIO()
+    for line in lines:
+        if line.strip():
+            writer(otlpjson.loads(line), out)
+    return out.getvalue()
+
+
+def convert_jsonl_parallel(in_f: Any, out_f: Any, to: str, jobs: int) -> None:
+    """
+    Converts otlp-jsonl line by line across jobs processes, keeping the order
+    of the input. At most 2 * jobs batches of lines are in flight at any time.
+    """
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_set_codec, initargs=(_codec_name(),)
+    ) as executor:
+        for window in batched(batched(in_f, LINES_PER_TASK), 2 * jobs):
+            for converted in executor.map(partial(_convert_jsonl_lines, to=to), window):
+                out_f.write(converted)
+
 
 @cli.command()
 def list_formats() -> None:
@@ -90,45 +197,254 @@ def list_formats() -> None:
 )
 @click.option("--from", "-f", "from_", type=click.Choice(list(IN_FORMATS.keys())))
 @click.option("--to", "-t", type=click.Choice(list(OUT_FORMATS.keys())))
-def convert(infile: Path, outfile: Path, from_: str, to: str) -> None:
+@click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    type=click.IntRange(min=1),
+    help=f"Number of processes (only for --from=otlp-jsonl --to={'|'.join(sorted(CONCATENABLE_OUT_FORMATS))})",
+)
+@click.option(
+    "--append/--no-append",
+    default=False,
+    help=f"Append to OUTFILE instead of overwriting it (only for --to={'|'.join(sorted(CONCATENABLE_OUT_FORMATS))})",
+)
+def convert(
+    infile: Path, outfile: Path, from_: str, to: str, jobs: int, append: bool
+) -> None:
     """
     Converts from one representation to another
     """
 
     is_binary_in, reader = IN_FORMATS[from_]
-    if infile.name == "-":
-        if is_binary_in:
-            rep = reader(stdin.buffer)
+    is_binary_out, writer = OUT_FORMATS[to]
+
+    if jobs > 1 and (from_ != "otlp-jsonl" or to not in CONCATENABLE_OUT_FORMATS):
+        raise click.UsageError(
+            f"--jobs is only supported for --from=otlp-jsonl and --to={'|'.join(sorted(CONCATENABLE_OUT_FORMATS))}"
+        )
+    if append and to not in CONCATENABLE_OUT_FORMATS:
+        raise click.UsageError(
+            f"--append is only supported for --to={'|'.join(sorted(CONCATENABLE_OUT_FORMATS))}"
+        )
+
+    ## Readers may parse lazily, so the input has to stay open while writing
+    with ExitStack() as stack:
+        if infile.name == "-":
+            in_f = stdin.buffer if is_binary_in else stdin
         else:
-            rep = reader(stdin)
-    else:
-        if is_binary_in:
-            with open(infile, "rb") as f:
-                rep = reader(f)
+            in_f = stack.enter_context(open(infile, "rb" if is_binary_in else "r"))
+
+        if outfile.name == "-":
+            out_f = stdout.buffer if is_binary_out else stdout
         else:
-            with open(infile, "r") as f:
-                rep = reader(f)
+            mode = ("a" if append else "w") + ("b" if is_binary_out else "")
+            out_f = stack.enter_context(open(outfile, mode))
 
-    is_binary_out, writer = OUT_FORMATS[to]
-    if outfile.name == "-":
-        if is_binary_out:
-            writer(rep, stdout.buffer)
+        if jobs > 1:
+            convert_jsonl_parallel(in_f, out_f, to, jobs)
         else:
-            writer(rep, stdout)
-        stdout.flush()
-    else:
-        if is_binary_out:
-            with open(outfile, "wb") as f:
-                writer(rep, f)
+            writer(reader(in_f), out_f)
+        out_f.flush()
+
+
+def _expand_inputs(inputs: tuple[str, ...], dir_glob: str) -> list[Path]:
+    """
+    The files given directly or matching a glob pattern, and the files in the given
+    directories (recursively) matching dir_glob, except for hidden files
+    """
+    paths: list[Path] = []
+    for pattern in inputs:
+        path = Path(pattern)
+        if path.is_dir():
+            paths.extend(
+                sorted(
+                    p
+                    for p in path.rglob(dir_glob)
+                    if p.is_file()
+                    and not any(
+                        part.startswith(".") for part in p.relative_to(path).parts
+                    )
+                )
+            )
+        elif path.is_file():
+            paths.append(path)
         else:
-            with open(outfile, "w") as f:
-                writer(rep, f)
+            matches = sorted(Path(p) for p in glob(pattern, recursive=True))
+            if not matches:
+                raise click.BadParameter(
+                    f"'{pattern}' is not a file or directory and matches no files",
+                    param_hint="INPUTS",
+                )
+            paths.extend(p for p in matches if p.is_file())
+    return list(dict.fromkeys(paths))
+
+
+def _convert_file(
+    infile: Path, from_: str, to: str, outfile: Optional[Path]
+) -> tuple[float, Optional[str | bytes]]:
+    """
+    Converts infile to outfile, or returns the converted data if outfile is None,
+    together with the time it took
+    """
+    start = time.perf_counter()
+    is_binary_in, reader = IN_FORMATS[from_]
+    is_binary_out, writer = OUT_FORMATS[to]
+
+    with open(infile, "rb" if is_binary_in else "r") as in_f:
+        if outfile is None:
+            out = io.BytesIO() if is_binary_out else io.StringIO()
+            writer(reader(in_f), out)
+            return time.perf_counter() - start, out.getvalue()
+        with open(outfile, "wb" if is_binary_out else "w") as out_f:
+            writer(reader(in_f), out_f)
+    return time.perf_counter() - start, None
+
+
+def _format_throughput(n_bytes: int, seconds: float) -> str:
+    mb = n_bytes / 1e6
+    return f"{mb:.1f} MB in {seconds:.2f}s ({mb / max(seconds, 1e-9):.1f} MB/s)"
+
+
+@cli.command()
+@click.argument("inputs", nargs=-1, required=True)
+@click.option(
+    "--from", "-f", "from_", required=True, type=click.Choice(list(IN_FORMATS.keys()))
+)
+@click.option("--to", "-t", required=True, type=click.Choice(list(OUT_FORMATS.keys())))
+@click.option(
+    "--output-dir",
+    "-o",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Write each converted file to this directory",
+)
+@click.option(
+    "--merge",
+    "-m",
+    type=click.Path(dir_okay=False, path_type=Path, allow_dash=True),
+    help=f"Write all converted files to this one file, in order (only for --to={'|'.join(sorted(CONCATENABLE_OUT_FORMATS))})",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of processes (default: number of CPUs)",
+)
+@click.option(
+    "--glob",
+    "dir_glob",
+    default=None,
+    help="Files to convert from the given directories (default: by the extension of --from, e.g. '*.json')",
+)
+def convert_many(
+    inputs: tuple[str, ...],
+    from_: str,
+    to: str,
+    output_dir: Optional[Path],
+    merge: Optional[Path],
+    jobs: Optional[int],
+    dir_glob: Optional[str],
+) -> None:
+    """
+    Converts many files (given as files, directories or glob patterns) in parallel
+    """
+    if (output_dir is None) == (merge is None):
+        raise click.UsageError("Exactly one of --output-dir and --merge is required")
+    if merge is not None and to not in CONCATENABLE_OUT_FORMATS:
+        raise click.UsageError(
+            f"--merge is only supported for --to={'|'.join(sorted(CONCATENABLE_OUT_FORMATS))}"
+        )
+
+    infiles = _expand_inputs(inputs, dir_glob or IN_FORMAT_GLOBS[from_])
+    outfiles: list[Optional[Path]] = [None] * len(infiles)
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        outfiles = [output_dir / (f.stem + OUT_FORMAT_EXTENSIONS[to]) for f in infiles]
+        if len(set(outfiles)) != len(outfiles):
+            raise click.UsageError(
+                "Several input files have the same name, which would overwrite each other in --output-dir"
+            )
 
+    total_bytes = 0
+    failed = 0
+    start = time.perf_counter()
+    is_binary_out = OUT_FORMATS[to][0]
+
+    with ExitStack() as stack:
+        out_f = None
+        if merge is not None:
+            if merge.name == "-":
+                out_f = stdout.buffer if is_binary_out else stdout
+            else:
+                out_f = stack.enter_context(open(merge, "wb" if is_binary_out else "w"))
+
+        max_workers = jobs or os.cpu_count() or 1
+        executor = stack.enter_context(
+            ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_set_codec,
+                initargs=(_codec_name(),),
+            )
+        )
+
+        ## Results are collected in order, so that merged output is deterministic.
+        ## Only a bounded number of files is in flight, so that converted data
+        ## waiting to be merged does not pile up.
+        tasks = iter(zip(infiles, outfiles))
+        pending: deque[tuple[Path, Future]] = deque()
+        for i in range(1, len(infiles) + 1):
+            while len(pending) < 2 * max_workers and (task := next(tasks, None)):
+                task_in, task_out = task
+                future = executor.submit(_convert_file, task_in, from_, to, task_out)
+                pending.append((task_in, future))
+            infile, future = pending.popleft()
+            try:
+                seconds, converted = future.result()
+            except Exception as e:
+                failed += 1
+                click.echo(f"[{i}/{len(infiles)}] {infile}: FAILED: {e}", err=True)
+                continue
+
+            if out_f is not None and converted is not None:
+                out_f.write(converted)
+
+            n_bytes = infile.stat().st_size
+            total_bytes += n_bytes
+            click.echo(
+                f"[{i}/{len(infiles)}] {infile}: {_format_throughput(n_bytes, seconds)}",
+                err=True,
+            )
+
+        if out_f is not None:
+            out_f.flush()
+
+    click.echo(
+        f"Converted {len(infiles) - failed}/{len(infiles)} files, "
+        + _format_throughput(total_bytes, time.perf_counter() - start),
+        err=True,
+    )
+    if failed:
+        raise click.ClickException(f"{failed} file(s) failed to convert")
+
+
+def run_proxy(ctx: Any, proxy: "proxy_mod.Proxy", hooks: dict[str, "Hooks"]) -> None:
+    import uvicorn
+    from eoepca_api_utils.api_utils import get_env_var_or_throw
+
+    ## Importing the API also loads the hooks
+    import python_opentelemetry_access.api as api
 
-def run_proxy(ctx: Any, proxy: proxy_mod.Proxy, hooks: dict[str, Hooks]) -> None:
     api.settings._proxy = proxy
     api.settings._base_url = get_env_var_or_throw("RH_TELEMETRY_API_BASE_URL")
     api.settings._hooks = hooks
+    api.settings.streaming_responses = environ.get(
+        "RH_TELEMETRY_API_STREAMING_RESPONSES", ""
+    ).lower() in ("1", "true", "yes")
+    api.settings.max_concurrent_page_queries = int(
+        environ.get("RH_TELEMETRY_API_MAX_CONCURRENT_PAGE_QUERIES")
+        or api.settings.max_concurrent_page_queries
+    )
 
     uvicorn.run(
         api.wrapped_app,
@@ -160,8 +476,21 @@ def proxy(ctx, host: str, port: str, root_path: str) -> None:
 )
 @click.pass_context
 def mock(ctx, file) -> None:
+    import python_opentelemetry_access.otlpjson as otlpjson
+    import python_opentelemetry_access.proxy as proxy_mod
+    from python_opentelemetry_access.telemetry_hooks import load_hooks
+
+    default_page_size_str = environ.get("RH_TELEMETRY_API_DEFAULT_PAGE_SIZE")
+    max_page_size_str = environ.get("RH_TELEMETRY_API_MAX_PAGE_SIZE")
     with open(file, "r") as f:
-        this_proxy = proxy_mod.MockProxy(otlpjson.load(f))
+        this_proxy = proxy_mod.MockProxy(
+            otlpjson.load(f),
+            ## Unlike for OpenSearch, by default return everything in one page
+            default_page_size=int(default_page_size_str)
+            if default_page_size_str
+            else None,
+            max_page_size=int(max_page_size_str) if max_page_size_str else None,
+        )
 
     run_proxy(ctx, this_proxy, hooks=load_hooks())
 
@@ -185,6 +514,10 @@ def opensearch_ss4o(
     client_cert: Optional[click.Path(exists=True, path_type=Path, allow_dash=False)],
     client_key: Optional[click.Path(exists=True, path_type=Path, allow_dash=False)],
 ) -> None:
+    import python_opentelemetry_access.proxy.opensearch.ss4o as ss4o_proxy
+    from python_opentelemetry_access.telemetry_hooks import load_hooks
+    from python_opentelemetry_access.telemetry_hooks.utils import OpensearchConfig
+
     hooks = load_hooks()
     GET_OPENSEARCH_CONFIG_HOOK_NAME = (
         os.environ.get("RH_TELEMETRY_GET_OPENSEARCH_CONFIG_HOOK_NAME")
@@ -219,9 +552,33 @@ def opensearch_ss4o(
 
     default_page_size_str = environ.get("RH_TELEMETRY_API_DEFAULT_PAGE_SIZE")
     max_page_size_str = environ.get("RH_TELEMETRY_API_MAX_PAGE_SIZE")
+    client_pool_size_str = environ.get("RH_TELEMETRY_OPENSEARCH_CLIENT_POOL_SIZE")
+    client_idle_timeout_str = environ.get(
+        "RH_TELEMETRY_OPENSEARCH_CLIENT_IDLE_TIMEOUT_SECONDS"
+    )
+    config_cache_size_str = environ.get("RH_TELEMETRY_OPENSEARCH_CONFIG_CACHE_SIZE")
+    config_cache_ttl_str = environ.get(
+        "RH_TELEMETRY_OPENSEARCH_CONFIG_CACHE_TTL_SECONDS"
+    )
+    max_terms_count_str = environ.get("RH_TELEMETRY_OPENSEARCH_MAX_TERMS_COUNT")
+    pit_keep_alive_str = environ.get("RH_TELEMETRY_OPENSEARCH_PIT_KEEP_ALIVE_SECONDS")
     proxy = ss4o_proxy.OpenSearchSS40Proxy(
         hooks,
         default_page_size=int(default_page_size_str) if default_page_size_str else 100,
         max_page_size=int(max_page_size_str) if max_page_size_str else 10000,
+        client_pool_size=int(client_pool_size_str) if client_pool_size_str else 8,
+        client_idle_timeout=timedelta(
+            seconds=float(client_idle_timeout_str) if client_idle_timeout_str else 300
+        ),
+        config_cache_size=int(config_cache_size_str) if config_cache_size_str else 1024,
+        config_cache_ttl=timedelta(
+            seconds=float(config_cache_ttl_str) if config_cache_ttl_str else 60
+        ),
+        max_terms_count=int(max_terms_count_str)
+        if max_terms_count_str
+        else ss4o_proxy.DEFAULT_MAX_TERMS_COUNT,
+        pit_keep_alive=timedelta(seconds=float(pit_keep_alive_str))
+        if pit_keep_alive_str
+        else None,
     )
     run_proxy(ctx, proxy, hooks)
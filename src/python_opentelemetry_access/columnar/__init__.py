@@ -0,0 +1,546 @@
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import Any, List, Optional, Sequence, Tuple, override
+import json
+
+import numpy as np
+import numpy.typing as npt
+
+import opentelemetry_betterproto.opentelemetry.proto.trace.v1 as trace
+
+from .. import base
+from .. import util
+
+type AttributePath = Tuple[str, ...]
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+## Columns that can be passed to SpanBatch.sort_by
+SORT_KEYS = ("start_time", "end_time", "duration", "trace_id", "span_id", "name")
+
+
+class _DictionaryEncoder:
+    """
+    Assigns consecutive integer codes to distinct values, in order of first appearance
+    """
+
+    def __init__(self) -> None:
+        self.values: List[Any] = []
+        self._codes: dict[Any, int] = {}
+
+    @staticmethod
+    def _key(value: Any) -> Any:
+        ## Keep e.g. True, 1 and 1.0 apart, and allow unhashable values
+        if isinstance(value, (dict, list)):
+            return (list, json.dumps(value, sort_keys=True))
+        return (type(value), value)
+
+    def encode(self, value: Any) -> int:
+        key = self._key(value)
+        code = self._codes.get(key)
+        if code is None:
+            code = len(self.values)
+            self._codes[key] = code
+            self.values.append(value)
+        return code
+
+
+@dataclass
+class AttributeColumn:
+    """
+    Dictionary encoded values of one attribute for every span in a batch;
+    codes index into values, -1 means that the span does not have the attribute
+    """
+
+    codes: npt.NDArray[np.int32]
+    values: List[util.JSONLike]
+
+    def take(self, indices: npt.NDArray[np.intp]) -> "AttributeColumn":
+        return AttributeColumn(self.codes[indices], self.values)
+
+
+def _flatten_attributes(
+    attributes: util.JSONLikeDict, prefix: AttributePath = ()
+) -> Iterator[Tuple[AttributePath, util.JSONLike]]:
+    for k, v in attributes.items():
+        if isinstance(v, dict) and v:
+            yield from _flatten_attributes(v, prefix + (k,))
+        else:
+            yield prefix + (k,), v
+
+
+def _unflatten_attributes(
+    items: Iterable[Tuple[AttributePath, util.JSONLike]],
+) -> util.JSONLikeDict:
+    result: util.JSONLikeDict = {}
+    for path, value in items:
+        current = result
+        for part in path[:-1]:
+            current = current.setdefault(part, {})  # type: ignore
+        current[path[-1]] = value
+    return result
+
+
+@dataclass
+class DurationStats:
+    """
+    Span duration statistics, in nanoseconds
+    """
+
+    count: int
+    min: int
+    max: int
+    mean: float
+    percentiles: dict[float, float] = field(default_factory=dict)
+
+
+@dataclass
+class SpanBatch(base.SpanCollection):
+    """
+    Column oriented span collection. Every per-span field is stored as a NumPy
+    array (names, kinds etc. dictionary encoded, attributes as one column per
+    attribute path), so that filtering, sorting and statistics are vectorised.
+    Events and links are kept as (reified) objects.
+    """
+
+    ## Hex ids as fixed-width ASCII byte strings
+    trace_id: npt.NDArray[np.bytes_]
+    span_id: npt.NDArray[np.bytes_]
+    parent_span_id: npt.NDArray[np.bytes_]
+    trace_state_codes: npt.NDArray[np.int32]
+    trace_states: List[Optional[str]]
+    flags: npt.NDArray[np.uint32]
+    name_codes: npt.NDArray[np.int32]
+    names: List[str]
+    kind: npt.NDArray[np.int8]
+    start_time_unix_nano: npt.NDArray[np.int64]
+    end_time_unix_nano: npt.NDArray[np.int64]
+    attributes: dict[AttributePath, AttributeColumn]
+    dropped_attributes_count: npt.NDArray[np.uint32]
+    events: npt.NDArray[np.object_]
+    dropped_events_count: npt.NDArray[np.uint32]
+    links: npt.NDArray[np.object_]
+    dropped_links_count: npt.NDArray[np.uint32]
+    status_code: npt.NDArray[np.int8]
+    status_message_codes: npt.NDArray[np.int32]
+    status_messages: List[Optional[str]]
+    ## Index into resource_spans/scope_spans for each span
+    resource_spans_index: npt.NDArray[np.int32]
+    scope_spans_index: npt.NDArray[np.int32]
+    resource_spans: List[Tuple[base.ReifiedResource, Optional[str]]]
+    scope_spans: List[Tuple[base.ReifiedInstrumentationScope, Optional[str]]]
+
+    @classmethod
+    def from_span_collection(cls, spans: base.SpanCollection) -> "SpanBatch":
+        """
+        Works with the span collections of every loader (otlpjson, otlpproto, ss4o, ...)
+        """
+        trace_ids: List[bytes] = []
+        span_ids: List[bytes] = []
+        parent_span_ids: List[bytes] = []
+        trace_states = _DictionaryEncoder()
+        trace_state_codes: List[int] = []
+        flags: List[int] = []
+        names = _DictionaryEncoder()
+        name_codes: List[int] = []
+        kinds: List[int] = []
+        start_times: List[int] = []
+        end_times: List[int] = []
+        attribute_rows: dict[
+            AttributePath, Tuple[List[int], _DictionaryEncoder, List[int]]
+        ] = {}
+        dropped_attributes_counts: List[int] = []
+        events: List[List[base.ReifiedSpanEvent]] = []
+        dropped_events_counts: List[int] = []
+        links: List[List[base.ReifiedSpanLink]] = []
+        dropped_links_counts: List[int] = []
+        status_codes: List[int] = []
+        status_messages = _DictionaryEncoder()
+        status_message_codes: List[int] = []
+        resource_spans_index: List[int] = []
+        scope_spans_index: List[int] = []
+        resource_spans: List[Tuple[base.ReifiedResource, Optional[str]]] = []
+        scope_spans: List[Tuple[base.ReifiedInstrumentationScope, Optional[str]]] = []
+
+        interners = base.ReifiedInterners()
+
+        for rs in spans.otlp_resource_spans:
+            resource_spans.append(
+                (
+                    interners.resources.intern(rs.otlp_resource.to_reified()),
+                    rs.otlp_schema_url,
+                )
+            )
+            for ss in rs.otlp_scope_spans:
+                scope_spans.append(
+                    (
+                        interners.scopes.intern(ss.otlp_scope.to_reified()),
+                        ss.otlp_schema_url,
+                    )
+                )
+                for span in ss.otlp_spans:
+                    row = len(start_times)
+                    trace_ids.append(span.otlp_trace_id.encode("ascii"))
+                    span_ids.append(span.otlp_span_id.encode("ascii"))
+                    parent_span_ids.append(span.otlp_parent_span_id.encode("ascii"))
+                    trace_state_codes.append(trace_states.encode(span.otlp_trace_state))
+                    flags.append(span.otlp_flags)
+                    name_codes.append(names.encode(span.otlp_name))
+                    kinds.append(int(span.otlp_kind.otlp_kind_code))
+                    start_times.append(span.otlp_start_time_unix_nano)
+                    end_times.append(span.otlp_end_time_unix_nano)
+                    for path, value in _flatten_attributes(
+                        util.force_jsonlike_dict_iter(span.otlp_attributes_iter)
+                    ):
+                        rows, encoder, codes = attribute_rows.setdefault(
+                            path, ([], _DictionaryEncoder(), [])
+                        )
+                        rows.append(row)
+                        codes.append(encoder.encode(value))
+                    dropped_attributes_counts.append(span.otlp_dropped_attributes_count)
+                    events.append([e.to_reified() for e in span.otlp_events])
+                    dropped_events_counts.append(span.otlp_dropped_events_count)
+                    links.append([link.to_reified() for link in span.otlp_links])
+                    dropped_links_counts.append(span.otlp_dropped_links_count)
+                    status = span.otlp_status
+                    status_codes.append(int(status.otlp_code))
+                    status_message_codes.append(
+                        status_messages.encode(status.otlp_message)
+                    )
+                    resource_spans_index.append(len(resource_spans) - 1)
+                    scope_spans_index.append(len(scope_spans) - 1)
+
+        n = len(start_times)
+        attributes = {}
+        for path, (rows, encoder, codes) in attribute_rows.items():
+            column_codes = np.full(n, -1, dtype=np.int32)
+            column_codes[rows] = codes
+            attributes[path] = AttributeColumn(column_codes, encoder.values)
+
+        return cls(
+            trace_id=_id_array(trace_ids),
+            span_id=_id_array(span_ids),
+            parent_span_id=_id_array(parent_span_ids),
+            trace_state_codes=np.array(trace_state_codes, dtype=np.int32),
+            trace_states=trace_states.values,
+            flags=np.array(flags, dtype=np.uint32),
+            name_codes=np.array(name_codes, dtype=np.int32),
+            names=names.values,
+            kind=np.array(kinds, dtype=np.int8),
+            start_time_unix_nano=np.array(start_times, dtype=np.int64),
+            end_time_unix_nano=np.array(end_times, dtype=np.int64),
+            attributes=attributes,
+            dropped_attributes_count=np.array(
+                dropped_attributes_counts, dtype=np.uint32
+            ),
+            events=_object_array(events),
+            dropped_events_count=np.array(dropped_events_counts, dtype=np.uint32),
+            links=_object_array(links),
+            dropped_links_count=np.array(dropped_links_counts, dtype=np.uint32),
+            status_code=np.array(status_codes, dtype=np.int8),
+            status_message_codes=np.array(status_message_codes, dtype=np.int32),
+            status_messages=status_messages.values,
+            resource_spans_index=np.array(resource_spans_index, dtype=np.int32),
+            scope_spans_index=np.array(scope_spans_index, dtype=np.int32),
+            resource_spans=resource_spans,
+            scope_spans=scope_spans,
+        )
+
+    def __len__(self) -> int:
+        return len(self.start_time_unix_nano)
+
+    def take(self, indices: npt.ArrayLike) -> "SpanBatch":
+        """
+        The spans at the given positions, in the given order
+        """
+        idx = np.asarray(indices, dtype=np.intp)
+        return SpanBatch(
+            trace_id=self.trace_id[idx],
+            span_id=self.span_id[idx],
+            parent_span_id=self.parent_span_id[idx],
+            trace_state_codes=self.trace_state_codes[idx],
+            trace_states=self.trace_states,
+            flags=self.flags[idx],
+            name_codes=self.name_codes[idx],
+            names=self.names,
+            kind=self.kind[idx],
+            start_time_unix_nano=self.start_time_unix_nano[idx],
+            end_time_unix_nano=self.end_time_unix_nano[idx],
+            attributes={
+                path: column.take(idx) for path, column in self.attributes.items()
+            },
+            dropped_attributes_count=self.dropped_attributes_count[idx],
+            events=self.events[idx],
+            dropped_events_count=self.dropped_events_count[idx],
+            links=self.links[idx],
+            dropped_links_count=self.dropped_links_count[idx],
+            status_code=self.status_code[idx],
+            status_message_codes=self.status_message_codes[idx],
+            status_messages=self.status_messages,
+            resource_spans_index=self.resource_spans_index[idx],
+            scope_spans_index=self.scope_spans_index[idx],
+            resource_spans=self.resource_spans,
+            scope_spans=self.scope_spans,
+        )
+
+    def filter(self, mask: npt.NDArray[np.bool_]) -> "SpanBatch":
+        return self.take(np.flatnonzero(mask))
+
+    ## Masks, with the same semantics as the proxy's in-memory filtering
+
+    def time_mask(
+        self, from_time: Optional[datetime], to_time: Optional[datetime]
+    ) -> npt.NDArray[np.bool_]:
+        """
+        Spans overlapping [from_time, to_time]
+        """
+        mask = np.ones(len(self), dtype=np.bool_)
+        if to_time is not None:
+            mask &= self.start_time_unix_nano <= _unix_nano(to_time)
+        if from_time is not None:
+            mask &= self.end_time_unix_nano >= _unix_nano(from_time)
+        return mask
+
+    def name_mask(self, span_name: str) -> npt.NDArray[np.bool_]:
+        try:
+            return self.name_codes == self.names.index(span_name)
+        except ValueError:
+            return np.zeros(len(self), dtype=np.bool_)
+
+    def span_ids_mask(
+        self, span_ids: List[Tuple[Optional[str], Optional[str]]]
+    ) -> npt.NDArray[np.bool_]:
+        """
+        Spans matching (trace_id, span_id) or (trace_id, None) for some entry
+        """
+        whole_traces = [
+            t.encode("ascii") for t, s in span_ids if t is not None and s is None
+        ]
+        mask = np.isin(self.trace_id, whole_traces)
+        for trace_id, span_id in span_ids:
+            if trace_id is not None and span_id is not None:
+                mask |= (self.trace_id == trace_id.encode("ascii")) & (
+                    self.span_id == span_id.encode("ascii")
+                )
+        return mask
+
+    def attributes_mask(
+        self, expected_attributes: Optional[util.AttributesFilter]
+    ) -> npt.NDArray[np.bool_]:
+        mask = np.ones(len(self), dtype=np.bool_)
+        if not expected_attributes:
+            return mask
+        ## The attribute column paths as nested dicts, to resolve dotted keys against
+        column_tree: dict[str, Any] = {}
+        for path in self.attributes:
+            node = column_tree
+            for part in path:
+                node = node.setdefault(part, {})
+        for key, values in expected_attributes.items():
+            mask &= self._attribute_mask(key, values, column_tree)
+        return mask
+
+    def _attribute_mask(
+        self,
+        key: str,
+        values: Optional[List[str | int | float | bool]],
+        column_tree: dict[str, Any],
+    ) -> npt.NDArray[np.bool_]:
+        value_set = None if values is None else frozenset(values)
+        matches = np.zeros(len(self), dtype=np.bool_)
+        ## As in util.CompiledAttributesFilter, the first path that exists decides
+        decided = np.zeros(len(self), dtype=np.bool_)
+        for path, subtree in util._dotted_key_paths(key, column_tree):
+            column = self.attributes.get(path)
+            if column is not None:
+                present = column.codes >= 0
+                if value_set is None:
+                    matching = present
+                else:
+                    matching_codes = [
+                        code
+                        for code, value in enumerate(column.values)
+                        if not isinstance(value, (dict, list)) and value in value_set
+                    ]
+                    matching = np.isin(column.codes, matching_codes)
+                matches |= matching & ~decided
+                decided |= present
+
+            ## A nested (dict) value at this path, which only satisfies existence
+            nested = np.zeros(len(self), dtype=np.bool_)
+            for nested_path in _tree_paths(subtree, path):
+                nested_column = self.attributes.get(nested_path)
+                if nested_column is not None:
+                    nested |= nested_column.codes >= 0
+            if value_set is None:
+                matches |= nested & ~decided
+            decided |= nested
+        return matches
+
+    def query(
+        self,
+        from_time: Optional[datetime] = None,
+        to_time: Optional[datetime] = None,
+        span_ids: Optional[List[Tuple[Optional[str], Optional[str]]]] = None,
+        span_attributes: Optional[util.AttributesFilter] = None,
+        span_name: Optional[str] = None,
+    ) -> "SpanBatch":
+        mask = self.time_mask(from_time, to_time)
+        if span_ids is not None:
+            mask &= self.span_ids_mask(span_ids)
+        if span_attributes:
+            mask &= self.attributes_mask(span_attributes)
+        if span_name is not None:
+            mask &= self.name_mask(span_name)
+        return self.filter(mask)
+
+    @property
+    def durations(self) -> npt.NDArray[np.int64]:
+        return self.end_time_unix_nano - self.start_time_unix_nano
+
+    def duration_stats(
+        self, percentiles: Sequence[float] = (50, 90, 99)
+    ) -> Optional[DurationStats]:
+        """
+        None if the batch is empty
+        """
+        if len(self) == 0:
+            return None
+        durations = self.durations
+        return DurationStats(
+            count=len(durations),
+            min=int(durations.min()),
+            max=int(durations.max()),
+            mean=float(durations.mean()),
+            percentiles=dict(
+                zip(
+                    percentiles,
+                    (float(p) for p in np.percentile(durations, percentiles)),
+                )
+            ),
+        )
+
+    def sort_by(self, *keys: str) -> "SpanBatch":
+        """
+        Stable sort by the given SORT_KEYS, the first one being the primary key
+        """
+        columns: List[npt.NDArray[Any]] = []
+        for key in keys:
+            match key:
+                case "start_time":
+                    columns.append(self.start_time_unix_nano)
+                case "end_time":
+                    columns.append(self.end_time_unix_nano)
+                case "duration":
+                    columns.append(self.durations)
+                case "trace_id":
+                    columns.append(self.trace_id)
+                case "span_id":
+                    columns.append(self.span_id)
+                case "name":
+                    ## Sort codes by name, rather than by first appearance
+                    name_rank = np.argsort(
+                        np.argsort(np.array(self.names, dtype=object))
+                    )
+                    columns.append(name_rank[self.name_codes])
+                case _:
+                    raise ValueError(
+                        f"Cannot sort by '{key}', expected one of {', '.join(SORT_KEYS)}"
+                    )
+        if not columns:
+            return self
+        return self.take(np.lexsort(columns[::-1]))
+
+    def span(self, i: int) -> base.ReifiedSpan:
+        return base.ReifiedSpan(
+            trace_id=_id_str(self.trace_id[i]),
+            span_id=_id_str(self.span_id[i]),
+            trace_state=self.trace_states[self.trace_state_codes[i]],
+            parent_span_id=_id_str(self.parent_span_id[i]),
+            flags=int(self.flags[i]),
+            name=self.names[self.name_codes[i]],
+            kind=base.ReifiedSpanKind(trace.SpanSpanKind(int(self.kind[i]))),
+            start_time_unix_nano=int(self.start_time_unix_nano[i]),
+            end_time_unix_nano=int(self.end_time_unix_nano[i]),
+            attributes=_unflatten_attributes(
+                (path, column.values[column.codes[i]])
+                for path, column in self.attributes.items()
+                if column.codes[i] >= 0
+            ),
+            dropped_attributes_count=int(self.dropped_attributes_count[i]),
+            events=list(self.events[i]),
+            dropped_events_count=int(self.dropped_events_count[i]),
+            links=list(self.links[i]),
+            dropped_links_count=int(self.dropped_links_count[i]),
+            status=base.ReifiedStatus(
+                message=self.status_messages[self.status_message_codes[i]],
+                code=int(self.status_code[i]),
+            ),
+        )
+
+    @property
+    @override
+    def otlp_resource_spans(self) -> Iterator[base.ReifiedResourceSpanCollection]:
+        ## Consecutive spans from the same resource/scope are grouped together
+        for resource_idx, rows in groupby(
+            range(len(self)), key=lambda i: int(self.resource_spans_index[i])
+        ):
+            resource, resource_schema_url = self.resource_spans[resource_idx]
+            scope_spans = []
+            for scope_idx, scope_rows in groupby(
+                rows, key=lambda i: int(self.scope_spans_index[i])
+            ):
+                scope, scope_schema_url = self.scope_spans[scope_idx]
+                scope_spans.append(
+                    base.ReifiedScopeSpanCollection(
+                        scope=scope,
+                        spans=[self.span(i) for i in scope_rows],
+                        schema_url=scope_schema_url,
+                    )
+                )
+            yield base.ReifiedResourceSpanCollection(
+                resource=resource,
+                scope_spans=scope_spans,
+                schema_url=resource_schema_url,
+            )
+
+
+def _tree_paths(
+    tree: dict[str, Any], prefix: Tuple[str, ...]
+) -> Iterator[Tuple[str, ...]]:
+    """
+    The paths of all the nodes below the root of tree, each prefixed with prefix
+    """
+    for part, subtree in tree.items():
+        path = prefix + (part,)
+        yield path
+        yield from _tree_paths(subtree, path)
+
+
+def _unix_nano(dt: datetime) -> int:
+    ## Integer arithmetic, so that the comparison is exact (a float of the
+    ## nanoseconds since the epoch cannot even hold every microsecond).
+    ## Naive datetimes are local time, as for datetime.timestamp.
+    return (dt.astimezone(timezone.utc) - _EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def _id_array(ids: List[bytes]) -> npt.NDArray[np.bytes_]:
+    return np.array(ids, dtype=f"S{max((len(i) for i in ids), default=1) or 1}")
+
+
+def _id_str(id: bytes) -> str:
+    return id.decode("ascii")
+
+
+def _object_array(values: List[Any]) -> npt.NDArray[np.object_]:
+    ## np.array would try to make a 2d array out of lists of equal length
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def from_span_collection(spans: base.SpanCollection) -> SpanBatch:
+    return SpanBatch.from_span_collection(spans)
@@ -1,21 +1,74 @@
 from collections.abc import Iterator, Generator
 from typing import Optional, TextIO, override
 from threading import Lock
-import json
+from datetime import date, datetime, timezone
+from functools import lru_cache
+import re
 
 
 from itertools import groupby
 
 from ... import base
 from ... import util
+from ...util.jsoncodec import get_codec
 
-## Only needed for correctly parsing nanosecond timestamps
-from pandas import Timestamp
 import opentelemetry_betterproto.opentelemetry.proto.trace.v1 as trace
 
 
+_ISOTIME_RE = re.compile(
+    r"(\d{4}-\d{2}-\d{2})[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d+))?)?"
+    r"(?:[Zz]|([+-])([01]\d|2[0-3])(?::?([0-5]\d))?)?"
+)
+## The same shape with any two digit offset, which is invalid when _ISOTIME_RE
+## does not match (datetime.fromisoformat accepts e.g. +05:60)
+_INVALID_OFFSET_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:[.,]\d+)?)?[+-]\d{2}:?(?:\d{2})?"
+)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=1024)
+def _days_since_epoch(ymd: str) -> int:
+    return date.fromisoformat(ymd).toordinal() - _EPOCH_ORDINAL
+
+
 def _parse_ns_isotime(t: str) -> int:
-    return int(Timestamp(t).asm8.astype("datetime64[ns]"))
+    """
+    Parses an ISO-8601 timestamp (as written by Data Prepper) to nanoseconds since
+    the epoch, keeping all 9 fractional digits. Timestamps without an offset are UTC.
+    """
+    m = _ISOTIME_RE.fullmatch(t)
+    if m is None:
+        if _INVALID_OFFSET_RE.fullmatch(t):
+            raise ValueError(f"Invalid ISO-8601 timestamp: '{t}'")
+        ## Other ISO-8601 variants, with microsecond precision
+        try:
+            dt = datetime.fromisoformat(t)
+        except ValueError:
+            raise ValueError(f"Invalid ISO-8601 timestamp: '{t}'") from None
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        delta = dt - datetime(1970, 1, 1, tzinfo=timezone.utc)
+        return (
+            delta.days * 86400 + delta.seconds
+        ) * 1_000_000_000 + delta.microseconds * 1000
+
+    ymd, hour, minute, second, fraction, sign, off_h, off_m = m.groups()
+    hour_i, minute_i, second_i = int(hour), int(minute), int(second or 0)
+    if hour_i > 23 or minute_i > 59 or second_i > 59:
+        raise ValueError(f"Invalid ISO-8601 timestamp: '{t}'")
+    try:
+        days = _days_since_epoch(ymd)
+    except ValueError:
+        raise ValueError(f"Invalid ISO-8601 timestamp: '{t}'") from None
+
+    seconds = days * 86400 + hour_i * 3600 + minute_i * 60 + second_i
+    if sign is not None:
+        offset = int(off_h) * 3600 + int(off_m or 0) * 60
+        seconds += -offset if sign == "+" else offset
+
+    nanos = int(fraction[:9].ljust(9, "0")) if fraction else 0
+    return seconds * 1_000_000_000 + nanos
 
 
 class SS4OSpanEvent(base.SpanEvent):
@@ -24,6 +77,7 @@ class SS4OSpanEvent(base.SpanEvent):
 
     @property
     @override
+    @util.memoised
     def otlp_time_unix_nano(self) -> int:
         return _parse_ns_isotime(util._expect_field_type(self.jobj, "@timestamp", str))
 
@@ -167,11 +221,13 @@ class SS4OSpan(base.Span):
 
     @property
     @override
+    @util.memoised
     def otlp_start_time_unix_nano(self) -> int:
         return _parse_ns_isotime(util._expect_field_type(self.jobj, "startTime", str))
 
     @property
     @override
+    @util.memoised
     def otlp_end_time_unix_nano(self) -> int:
         return _parse_ns_isotime(util._expect_field_type(self.jobj, "endTime", str))
 
@@ -384,7 +440,11 @@ def _iter_full_results(
                 util.expect_dict(util.expect_dict(search_results)["hits"])["hits"]
             )
         ),
-        key=lambda x: util.expect_dict(util.expect_dict(x)["resource"]),
+        ## Without resource attributes, e.g. when only some _source fields were fetched
+        ## and the resource has none of them
+        key=lambda x: util._expect_field_type(
+            util.expect_dict(x), "resource", dict, optional=True, default={}
+        ),
     ):
         new = SS4OResourceSpanCollection(
             SS4OResource(resource),
@@ -394,7 +454,7 @@ def _iter_full_results(
         new._invalidated = True
 
 
-class SS4OSpanCollection(base.SpanCollection):
+class SS4OSpanCollection(base.DirectJSONSpanCollection):
     def __init__(self, search_results: util.JSONLike):
         self._search_results = search_results
 
@@ -404,7 +464,7 @@ class SS4OSpanCollection(base.SpanCollection):
         return _iter_full_results(util.expect_dict(self._search_results))
 
 
-class SS4OSpanCollectionBare(base.SpanCollection):
+class SS4OSpanCollectionBare(base.DirectJSONSpanCollection):
     def __init__(self, search_results: util.JSONLike):
         self._search_results = search_results
 
@@ -423,16 +483,16 @@ def loado_bare(o: util.JSONLike):
 
 
 def load(fp: TextIO):
-    return loado(json.load(fp))
+    return loado(get_codec().load(fp))
 
 
 def load_bare(fp: TextIO):
-    return loado_bare(json.load(fp))
+    return loado_bare(get_codec().load(fp))
 
 
 def loads(s: str):
-    return loado(json.loads(s))
+    return loado(get_codec().loads(s))
 
 
 def loads_bare(s: str):
-    return loado_bare(json.loads(s))
+    return loado_bare(get_codec().loads(s))
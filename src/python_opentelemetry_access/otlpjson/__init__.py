@@ -1,10 +1,18 @@
 from collections.abc import Iterator
 from typing import Tuple, Optional, TextIO, BinaryIO, NewType, List, Union, override
 from typing_extensions import TypedDict
+from sys import intern
+import binascii
+import codecs
 import json
+import re
 
 from .. import base
 from .. import util
+from ..util.jsoncodec import get_codec
+
+import opentelemetry_betterproto.opentelemetry.proto.common.v1 as common
+import opentelemetry_betterproto.opentelemetry.proto.trace.v1 as trace
 
 
 class OTLPJsonIntAnyValueRepresentation(TypedDict):
@@ -121,7 +129,7 @@ def iter_otlp_jsonlike_kv(
                 )
 
             if isinstance(key, str):
-                return (key, iter_otlp_jsonlike_anyvalue(jsonlike_value))
+                return (intern(key), iter_otlp_jsonlike_anyvalue(jsonlike_value))
             else:
                 raise TypeError(f"OTLP JSON KeyValue key expected str, got {type(key)}")
 
@@ -153,6 +161,7 @@ class OTLPJsonSpanEvent(base.SpanEvent):
 
     @property
     @override
+    @util.memoised
     def otlp_time_unix_nano(self) -> int:
         return int(self.jobj["timeUnixNano"])
 
@@ -314,11 +323,13 @@ class OTLPJsonSpan(base.Span):
 
     @property
     @override
+    @util.memoised
     def otlp_start_time_unix_nano(self) -> int:
         return int(self.jobj["startTimeUnixNano"])
 
     @property
     @override
+    @util.memoised
     def otlp_end_time_unix_nano(self) -> int:
         return int(self.jobj["endTimeUnixNano"])
 
@@ -361,6 +372,47 @@ class OTLPJsonSpan(base.Span):
     def otlp_status(self) -> OTLPJsonStatus:
         return OTLPJsonStatus(self.jobj["status"])
 
+    @override
+    def to_otlp_protobuf(self) -> trace.Span:
+        jobj = self.jobj
+
+        kvs = [iter_otlp_jsonlike_kv(x) for x in jobj.get("attributes") or []]
+        if len({k for k, _ in kvs}) == len(kvs) and not any(
+            isinstance(v, util.JSONLikeDictIter) for _, v in kvs
+        ):
+            ## Nothing to normalise
+            attributes = [
+                common.KeyValue(key=k, value=util.jsonlike_iter_to_any_value(v))
+                for k, v in kvs
+            ]
+        else:
+            attributes = util.jsonlike_dict_iter_to_kvlist(
+                util.iter_jsonlike_dict(self.otlp_attributes_normalised())
+            )
+
+        status = jobj["status"]
+        return trace.Span(
+            trace_id=binascii.a2b_hex(jobj["traceId"]),
+            span_id=binascii.a2b_hex(jobj["spanId"]),
+            trace_state=jobj.get("traceState") or "",
+            parent_span_id=binascii.a2b_hex(jobj["parentSpanId"]),
+            flags=jobj.get("flags") or 0,
+            name=jobj["name"],
+            kind=trace.SpanSpanKind(jobj["kind"]),
+            start_time_unix_nano=int(jobj["startTimeUnixNano"]),
+            end_time_unix_nano=int(jobj["endTimeUnixNano"]),
+            attributes=attributes,
+            dropped_attributes_count=jobj.get("droppedAttributesCount") or 0,
+            events=[x.to_otlp_protobuf() for x in self.otlp_events],
+            dropped_events_count=jobj.get("droppedEventsCount") or 0,
+            links=[x.to_otlp_protobuf() for x in self.otlp_links],
+            dropped_links_count=jobj.get("droppedLinksCount") or 0,
+            status=trace.Status(
+                message=status.get("message") or "",
+                code=trace.StatusStatusCode(status.get("code") or 0),
+            ),
+        )
+
 
 class OTLPJsonInstrumentationScope(base.InstrumentationScope):
     Representation = TypedDict(
@@ -502,8 +554,194 @@ def loado(o: util.JSONLike) -> OTLPJsonSpanCollection:
 
 
 def load(fp: TextIO | BinaryIO) -> OTLPJsonSpanCollection:
-    return loado(json.load(fp))
+    return loado(get_codec().load(fp))
 
 
 def loads(s: str) -> OTLPJsonSpanCollection:
-    return loado(json.loads(s))
+    return loado(get_codec().loads(s))
+
+
+class OTLPJsonStreamingSpanCollection(base.SpanCollection):
+    """
+    A span collection whose resource spans are parsed lazily from a stream
+    (see iterload). It can only be iterated once.
+    """
+
+    def __init__(self, resource_spans: Iterator[OTLPJsonResourceSpanCollection]):
+        self.resource_spans = resource_spans
+
+    @property
+    @override
+    def otlp_resource_spans(self) -> Iterator[OTLPJsonResourceSpanCollection]:
+        return self.resource_spans
+
+
+DEFAULT_ITERLOAD_CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _StreamingJSONReader:
+    """
+    Minimal pull tokenizer for the structural parts of a JSON document, which
+    delegates decoding of complete values to json.JSONDecoder.raw_decode.
+    Only the unconsumed part of the input is kept in memory.
+
+    The configured codec (util.jsoncodec) is not used: it can only decode complete
+    documents, and finding where a value ends in Python costs several times
+    more than raw_decode takes to decode it.
+    """
+
+    def __init__(self, fp: TextIO | BinaryIO, chunk_size: int):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.utf8_decoder: Optional[codecs.IncrementalDecoder] = None
+
+    def _fill(self, min_size: int = 0) -> bool:
+        if self.eof:
+            return False
+
+        self.buf = self.buf[self.pos :]
+        self.pos = 0
+
+        chunk = self.fp.read(max(self.chunk_size, min_size))
+        if isinstance(chunk, bytes):
+            if self.utf8_decoder is None:
+                self.utf8_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+            text = self.utf8_decoder.decode(chunk, final=not chunk)
+        else:
+            text = chunk
+
+        self.eof = not chunk
+        self.buf += text
+        return not self.eof
+
+    def _error(self, msg: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(msg, self.buf, self.pos)
+
+    def peek(self) -> str:
+        """
+        Skips whitespace and returns the next character ("" at the end of the input)
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()  # type: ignore
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if c == "" or c not in chars:
+            raise self._error(f"Expecting one of {chars!r}")
+        self.pos += 1
+        return c
+
+    def value(self) -> util.JSONLike:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                ## Probably a value that is cut off at the end of the buffer.
+                ## Grow the buffer geometrically, so that reparsing is amortised.
+                if self._fill(len(self.buf) - self.pos):
+                    continue
+                raise
+
+            ## Literals (e.g. numbers) can be cut off without a decode error
+            if end == len(self.buf) and self._fill():
+                continue
+
+            self.pos = end
+            return value
+
+
+def iterload(
+    fp: TextIO | BinaryIO, chunk_size: int = DEFAULT_ITERLOAD_CHUNK_SIZE
+) -> Iterator[OTLPJsonResourceSpanCollection]:
+    """
+    Incrementally parses an OTLP JSON document (ExportTraceServiceRequest),
+    yielding its resource spans one at a time, so that memory usage is
+    proportional to the largest ResourceSpans rather than the whole file.
+    """
+    reader = _StreamingJSONReader(fp, chunk_size)
+
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.expect("}")
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise reader._error("Expecting property name")
+            reader.expect(":")
+
+            if key == "resourceSpans":
+                reader.expect("[")
+                if reader.peek() == "]":
+                    reader.expect("]")
+                else:
+                    while True:
+                        yield OTLPJsonResourceSpanCollection(reader.value())  # type: ignore
+                        if reader.expect(",]") == "]":
+                            break
+            else:
+                reader.value()
+
+            if reader.expect(",}") == "}":
+                break
+
+    if reader.peek() != "":
+        raise reader._error("Extra data")
+
+
+def load_streaming(
+    fp: TextIO | BinaryIO, chunk_size: int = DEFAULT_ITERLOAD_CHUNK_SIZE
+) -> OTLPJsonStreamingSpanCollection:
+    return OTLPJsonStreamingSpanCollection(iterload(fp, chunk_size))
+
+
+def iterload_lines(
+    fp: TextIO | BinaryIO,
+) -> Iterator[OTLPJsonResourceSpanCollection]:
+    """
+    Parses newline delimited OTLP JSON (one ExportTraceServiceRequest per line,
+    as written by the collector's file exporter), one line at a time.
+    """
+    codec = get_codec()
+    for line in fp:
+        if line.strip():
+            yield from loado(codec.loads(line)).otlp_resource_spans
+
+
+def load_lines(fp: TextIO | BinaryIO) -> OTLPJsonStreamingSpanCollection:
+    return OTLPJsonStreamingSpanCollection(iterload_lines(fp))
+
+
+def dump_lines(x: base.SpanCollection, fp: TextIO) -> None:
+    """
+    Writes newline delimited OTLP JSON, with one ExportTraceServiceRequest
+    per resource spans.
+    """
+    codec = get_codec()
+    for resource_spans in x.otlp_resource_spans:
+        line = util.JSONLikeDictIter(
+            iter(
+                [
+                    (
+                        "resourceSpans",
+                        util.JSONLikeListIter(
+                            iter([resource_spans.to_otlp_json_iter()])
+                        ),
+                    )
+                ]
+            )
+        )
+        for chunk in codec.iterencode(line):
+            fp.write(chunk)
+        fp.write("\n")
@@ -1,5 +1,7 @@
 from collections.abc import Iterator
 from typing import Optional, BinaryIO, override
+from itertools import batched
+from sys import intern
 import binascii
 
 from .. import base
@@ -25,11 +27,62 @@ def _un_anyvalue(any_val: common.AnyValue) -> util.JSONLikeIter:
             return util.JSONLikeListIter((_un_anyvalue(x) for x in array_value.values))
         case common.AnyValue(kvlist_value=kvlist_value):
             return util.JSONLikeDictIter(
-                ((kv.key, _un_anyvalue(kv.value)) for kv in kvlist_value.values)
+                ((intern(kv.key), _un_anyvalue(kv.value)) for kv in kvlist_value.values)
             )
     raise NotImplementedError()
 
 
+def _any_value_json(any_val: common.AnyValue) -> util.JSONLikeDict:
+    """
+    Same as util.to_otlp_any_value(_un_anyvalue(any_val)), but without the iterators
+    """
+    match any_val:
+        case common.AnyValue(string_value=str_val):
+            return {"stringValue": str_val}
+        case common.AnyValue(bool_value=bool_value):
+            return {"boolValue": bool_value}
+        case common.AnyValue(int_value=int_value):
+            return {"intValue": str(int_value)}
+        case common.AnyValue(double_value=double_value):
+            return {"doubleValue": double_value}
+        case common.AnyValue(array_value=array_value):
+            return {
+                "arrayValue": {
+                    "values": [_any_value_json(x) for x in array_value.values]
+                }
+            }
+        case common.AnyValue(kvlist_value=kvlist_value):
+            return {"kvlistValue": _kv_list_json(kvlist_value.values)}
+    raise NotImplementedError()
+
+
+def _kv_list_json(kvs: list[common.KeyValue]) -> util.JSONLikeList:
+    return [{"key": kv.key, "value": _any_value_json(kv.value)} for kv in kvs]
+
+
+def _is_normalised(kvs: list[common.KeyValue]) -> bool:
+    """
+    Whether the attributes kvs are left as they are by
+    base.Span.otlp_attributes_normalised: no nested key-value lists and no
+    repeated keys
+    """
+    return len({kv.key for kv in kvs}) == len(kvs) and not any(
+        isinstance(_un_anyvalue(kv.value), util.JSONLikeDictIter) for kv in kvs
+    )
+
+
+def _span_event_json(proto: trace.SpanEvent) -> util.JSONLikeDict:
+    result: util.JSONLikeDict = {
+        "timeUnixNano": str(proto.time_unix_nano),
+        "name": proto.name,
+    }
+    if proto.attributes:
+        result["attributes"] = _kv_list_json(proto.attributes)
+    if proto.dropped_attributes_count:
+        result["droppedAttributesCount"] = proto.dropped_attributes_count
+    return result
+
+
 class OTLPProtoSpanEvent(base.SpanEvent):
     _proto: trace.SpanEvent
 
@@ -50,7 +103,7 @@ class OTLPProtoSpanEvent(base.SpanEvent):
     @override
     def otlp_attributes_iter(self) -> util.JSONLikeDictIter:
         return util.JSONLikeDictIter(
-            ((x.key, _un_anyvalue(x.value)) for x in self._proto.attributes)
+            ((intern(x.key), _un_anyvalue(x.value)) for x in self._proto.attributes)
         )
 
     @property
@@ -96,11 +149,13 @@ class OTLPProtoSpanLink(base.SpanLink):
 
     @property
     @override
+    @util.memoised
     def otlp_trace_id(self) -> str:
         return binascii.b2a_hex(self._proto.trace_id).decode("ascii")
 
     @property
     @override
+    @util.memoised
     def otlp_span_id(self) -> str:
         return binascii.b2a_hex(self._proto.span_id).decode("ascii")
 
@@ -113,7 +168,7 @@ class OTLPProtoSpanLink(base.SpanLink):
     @override
     def otlp_attributes_iter(self) -> util.JSONLikeDictIter:
         return util.JSONLikeDictIter(
-            ((x.key, _un_anyvalue(x.value)) for x in self._proto.attributes)
+            ((intern(x.key), _un_anyvalue(x.value)) for x in self._proto.attributes)
         )
 
     @property
@@ -135,11 +190,13 @@ class OTLPProtoSpan(base.Span):
 
     @property
     @override
+    @util.memoised
     def otlp_trace_id(self) -> str:
         return binascii.b2a_hex(self._proto.trace_id).decode("ascii")
 
     @property
     @override
+    @util.memoised
     def otlp_span_id(self) -> str:
         return binascii.b2a_hex(self._proto.span_id).decode("ascii")
 
@@ -150,6 +207,7 @@ class OTLPProtoSpan(base.Span):
 
     @property
     @override
+    @util.memoised
     def otlp_parent_span_id(self) -> str:
         return binascii.b2a_hex(self._proto.parent_span_id).decode("ascii")
 
@@ -182,7 +240,7 @@ class OTLPProtoSpan(base.Span):
     @override
     def otlp_attributes_iter(self) -> util.JSONLikeDictIter:
         return util.JSONLikeDictIter(
-            ((x.key, _un_anyvalue(x.value)) for x in self._proto.attributes)
+            ((intern(x.key), _un_anyvalue(x.value)) for x in self._proto.attributes)
         )
 
     @property
@@ -215,6 +273,45 @@ class OTLPProtoSpan(base.Span):
     def otlp_status(self) -> OTLPProtoStatus:
         return OTLPProtoStatus(self._proto.status)
 
+    @override
+    def to_otlp_json_dict(self) -> util.JSONLikeDict:
+        proto = self._proto
+        result: util.JSONLikeDict = {
+            "traceId": binascii.b2a_hex(proto.trace_id).decode("ascii"),
+            "spanId": binascii.b2a_hex(proto.span_id).decode("ascii"),
+        }
+        if proto.trace_state:
+            result["traceState"] = proto.trace_state
+        result["parentSpanId"] = binascii.b2a_hex(proto.parent_span_id).decode("ascii")
+        if proto.flags != 0:
+            result["flags"] = proto.flags
+        result["name"] = proto.name
+        result["kind"] = int(proto.kind)
+        result["startTimeUnixNano"] = str(proto.start_time_unix_nano)
+        result["endTimeUnixNano"] = str(proto.end_time_unix_nano)
+
+        if _is_normalised(proto.attributes):
+            if proto.attributes:
+                result["attributes"] = _kv_list_json(proto.attributes)
+        else:
+            attributes = self.otlp_attributes_normalised()
+            if len(attributes) > 0:
+                result["attributes"] = util.to_kv_list(attributes)
+
+        if proto.dropped_attributes_count != 0:
+            result["droppedAttributesCount"] = proto.dropped_attributes_count
+        if proto.events:
+            result["events"] = [_span_event_json(event) for event in proto.events]
+
+        status: util.JSONLikeDict = {}
+        if proto.status.message != "":
+            status["message"] = proto.status.message
+        if proto.status.code != 0:
+            status["code"] = int(proto.status.code)
+        result["status"] = status
+
+        return result
+
 
 class OTLPProtoInstrumentationScope(base.InstrumentationScope):
     _proto: common.InstrumentationScope
@@ -236,7 +333,7 @@ class OTLPProtoInstrumentationScope(base.InstrumentationScope):
     @override
     def otlp_attributes_iter(self) -> util.JSONLikeDictIter:
         return util.JSONLikeDictIter(
-            ((x.key, _un_anyvalue(x.value)) for x in self._proto.attributes)
+            ((intern(x.key), _un_anyvalue(x.value)) for x in self._proto.attributes)
         )
 
     @property
@@ -255,7 +352,7 @@ class OTLPProtoResource(base.Resource):
     @override
     def otlp_attributes_iter(self) -> util.JSONLikeDictIter:
         return util.JSONLikeDictIter(
-            ((x.key, _un_anyvalue(x.value)) for x in self._proto.attributes)
+            ((intern(x.key), _un_anyvalue(x.value)) for x in self._proto.attributes)
         )
 
     @property
@@ -308,7 +405,7 @@ class OTLPProtoResourceSpanCollection(base.ResourceSpanCollection):
         return self._proto.schema_url if self._proto.schema_url != "" else None
 
 
-class OTLPProtoSpanCollection(base.SpanCollection):
+class OTLPProtoSpanCollection(base.DirectJSONSpanCollection):
     _proto: trace_collector.ExportTraceServiceRequest
 
     def __init__(self, proto: trace_collector.ExportTraceServiceRequest):
@@ -328,3 +425,93 @@ def load(fp: BinaryIO) -> OTLPProtoSpanCollection:
 
 def loads(s: bytes) -> OTLPProtoSpanCollection:
     return OTLPProtoSpanCollection(trace_collector.ExportTraceServiceRequest().parse(s))
+
+
+class OTLPProtoStreamingSpanCollection(base.DirectJSONSpanCollection):
+    """
+    A span collection whose resource spans are parsed lazily from a stream
+    (see iterload_delimited). It can only be iterated once.
+    """
+
+    def __init__(self, resource_spans: Iterator[OTLPProtoResourceSpanCollection]):
+        self.resource_spans = resource_spans
+
+    @property
+    @override
+    def otlp_resource_spans(self) -> Iterator[OTLPProtoResourceSpanCollection]:
+        return self.resource_spans
+
+
+def _encode_varint(n: int) -> bytes:
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _read_varint(fp: BinaryIO) -> Optional[int]:
+    """
+    Returns None if the stream ends before the first byte
+    """
+    result = 0
+    shift = 0
+    while True:
+        b = fp.read(1)
+        if not b:
+            if shift == 0:
+                return None
+            raise ValueError("Truncated message length in delimited protobuf stream")
+        result |= (b[0] & 0x7F) << shift
+        if not b[0] & 0x80:
+            return result
+        shift += 7
+        if shift >= 64:
+            raise ValueError("Invalid message length in delimited protobuf stream")
+
+
+def iterload_delimited(fp: BinaryIO) -> Iterator[OTLPProtoResourceSpanCollection]:
+    """
+    Parses a stream of varint length-delimited ExportTraceServiceRequest
+    messages (as with Java's writeDelimitedTo), one message at a time.
+    """
+    while (length := _read_varint(fp)) is not None:
+        message = fp.read(length)
+        if len(message) != length:
+            raise ValueError("Truncated message in delimited protobuf stream")
+        yield from loads(message).otlp_resource_spans
+
+
+def load_delimited(fp: BinaryIO) -> OTLPProtoStreamingSpanCollection:
+    return OTLPProtoStreamingSpanCollection(iterload_delimited(fp))
+
+
+DEFAULT_RESOURCE_SPANS_PER_MESSAGE = 1
+
+
+def dump_delimited(
+    x: base.SpanCollection,
+    fp: BinaryIO,
+    resource_spans_per_message: int = DEFAULT_RESOURCE_SPANS_PER_MESSAGE,
+) -> None:
+    """
+    Writes x as a stream of varint length-delimited ExportTraceServiceRequest
+    messages, each with (up to) resource_spans_per_message resource spans.
+    Appending such streams results in a valid stream.
+    """
+    for resource_spans in batched(x.otlp_resource_spans, resource_spans_per_message):
+        message = bytes(
+            trace_collector.ExportTraceServiceRequest(
+                resource_spans=[rs.to_otlp_protobuf() for rs in resource_spans]
+            )
+        )
+        fp.write(_encode_varint(len(message)))
+        fp.write(message)
+
+
+from .mapped import (  # noqa: E402
+    OTLPProtoMappedSpanCollection as OTLPProtoMappedSpanCollection,
+    load_mapped as load_mapped,
+    loads_mapped as loads_mapped,
+)
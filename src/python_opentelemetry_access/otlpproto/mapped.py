@@ -0,0 +1,574 @@
+"""
+Lazy, memory mapped reading of OTLP protobuf (ExportTraceServiceRequest) files.
+
+Rather than parsing the whole message tree up front (as load does), every message
+is a view of a range of the (mapped) buffer. The tags of a message are only scanned
+when one of its fields is first accessed, nested messages are skipped over by their
+length until they are accessed themselves, and field values are decoded on access.
+Scanning for trace/span ids therefore never decodes attributes, events or links.
+"""
+
+from collections.abc import Iterator
+from typing import BinaryIO, Optional, override
+from sys import intern
+import io
+import mmap
+import struct
+
+from .. import base
+from .. import util
+from . import OTLPProtoSpanKind
+
+import opentelemetry_betterproto.opentelemetry.proto.trace.v1 as trace
+
+type Buffer = memoryview
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+## Field numbers, from opentelemetry/proto/{collector/trace,trace,common,resource}/v1/*.proto
+
+
+class _ExportTraceServiceRequest:
+    RESOURCE_SPANS = 1
+
+
+class _ResourceSpans:
+    RESOURCE = 1
+    SCOPE_SPANS = 2
+    SCHEMA_URL = 3
+
+
+class _ScopeSpans:
+    SCOPE = 1
+    SPANS = 2
+    SCHEMA_URL = 3
+
+
+class _Resource:
+    ATTRIBUTES = 1
+    DROPPED_ATTRIBUTES_COUNT = 2
+
+
+class _InstrumentationScope:
+    NAME = 1
+    VERSION = 2
+    ATTRIBUTES = 3
+    DROPPED_ATTRIBUTES_COUNT = 4
+
+
+class _Span:
+    TRACE_ID = 1
+    SPAN_ID = 2
+    TRACE_STATE = 3
+    PARENT_SPAN_ID = 4
+    NAME = 5
+    KIND = 6
+    START_TIME_UNIX_NANO = 7
+    END_TIME_UNIX_NANO = 8
+    ATTRIBUTES = 9
+    DROPPED_ATTRIBUTES_COUNT = 10
+    EVENTS = 11
+    DROPPED_EVENTS_COUNT = 12
+    LINKS = 13
+    DROPPED_LINKS_COUNT = 14
+    STATUS = 15
+    FLAGS = 16
+
+
+class _Event:
+    TIME_UNIX_NANO = 1
+    NAME = 2
+    ATTRIBUTES = 3
+    DROPPED_ATTRIBUTES_COUNT = 4
+
+
+class _Link:
+    TRACE_ID = 1
+    SPAN_ID = 2
+    TRACE_STATE = 3
+    ATTRIBUTES = 4
+    DROPPED_ATTRIBUTES_COUNT = 5
+    FLAGS = 6
+
+
+class _Status:
+    MESSAGE = 2
+    CODE = 3
+
+
+class _KeyValue:
+    KEY = 1
+    VALUE = 2
+
+
+class _AnyValue:
+    STRING_VALUE = 1
+    BOOL_VALUE = 2
+    INT_VALUE = 3
+    DOUBLE_VALUE = 4
+    ARRAY_VALUE = 5
+    KVLIST_VALUE = 6
+
+
+## ArrayValue and KeyValueList
+_VALUES = 1
+
+
+def _read_varint(buf: Buffer, pos: int) -> tuple[int, int]:
+    """
+    The varint at pos, and the position after it
+    """
+    b = buf[pos]
+    if b < 0x80:
+        return b, pos + 1
+    result = b & 0x7F
+    shift = 7
+    pos += 1
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 70:
+            raise ValueError("Invalid varint in protobuf message")
+
+
+def _signed64(n: int) -> int:
+    return n - (1 << 64) if n >= (1 << 63) else n
+
+
+## Field number -> occurrences, each as (wire type, start, end) where for varints
+## start is the decoded value (and end is the position after it)
+type _Fields = dict[int, list[tuple[int, int, int]]]
+
+
+def _scan(buf: Buffer, start: int, end: int) -> _Fields:
+    fields: _Fields = {}
+    pos = start
+    try:
+        while pos < end:
+            tag, pos = _read_varint(buf, pos)
+            wire_type = tag & 0x7
+            match wire_type:
+                case 0:
+                    value_or_start, pos = _read_varint(buf, pos)
+                case 1:
+                    value_or_start = pos
+                    pos += 8
+                case 2:
+                    length, value_or_start = _read_varint(buf, pos)
+                    pos = value_or_start + length
+                case 5:
+                    value_or_start = pos
+                    pos += 4
+                case _:
+                    raise ValueError(
+                        f"Unsupported wire type {wire_type} in protobuf message"
+                    )
+            fields.setdefault(tag >> 3, []).append((wire_type, value_or_start, pos))
+    except IndexError as e:
+        raise ValueError("Truncated protobuf message") from e
+    if pos != end:
+        raise ValueError("Truncated protobuf message")
+    return fields
+
+
+class _MappedMessage:
+    """
+    A protobuf message at buf[start:end], whose fields are decoded on access
+    """
+
+    def __init__(self, buf: Buffer, start: int, end: int):
+        self._buf = buf
+        self._start = start
+        self._end = end
+        self._fields: Optional[_Fields] = None
+
+    def _occurrences(self, field: int) -> list[tuple[int, int, int]]:
+        if self._fields is None:
+            self._fields = _scan(self._buf, self._start, self._end)
+        return self._fields.get(field, [])
+
+    def _last(self, field: int, wire_type: int) -> Optional[tuple[int, int, int]]:
+        ## As for any proto3 parser, the last occurrence of a singular field wins
+        occurrences = self._occurrences(field)
+        if not occurrences:
+            return None
+        occurrence = occurrences[-1]
+        if occurrence[0] != wire_type:
+            raise ValueError(f"Unexpected wire type for field {field}")
+        return occurrence
+
+    def _varint(self, field: int) -> int:
+        occurrence = self._last(field, _VARINT)
+        return 0 if occurrence is None else occurrence[1]
+
+    def _fixed64(self, field: int) -> int:
+        occurrence = self._last(field, _FIXED64)
+        if occurrence is None:
+            return 0
+        return int.from_bytes(self._buf[occurrence[1] : occurrence[2]], "little")
+
+    def _fixed32(self, field: int) -> int:
+        occurrence = self._last(field, _FIXED32)
+        if occurrence is None:
+            return 0
+        return int.from_bytes(self._buf[occurrence[1] : occurrence[2]], "little")
+
+    def _hex(self, field: int) -> str:
+        occurrence = self._last(field, _LENGTH_DELIMITED)
+        if occurrence is None:
+            return ""
+        return self._buf[occurrence[1] : occurrence[2]].hex()
+
+    def _str(self, field: int) -> str:
+        occurrence = self._last(field, _LENGTH_DELIMITED)
+        if occurrence is None:
+            return ""
+        return str(self._buf[occurrence[1] : occurrence[2]], "utf-8")
+
+    def _message(self, field: int) -> tuple[int, int]:
+        """
+        The range of a singular message field (empty if not present)
+        """
+        occurrence = self._last(field, _LENGTH_DELIMITED)
+        return (0, 0) if occurrence is None else (occurrence[1], occurrence[2])
+
+    def _messages(self, field: int) -> Iterator[tuple[int, int]]:
+        for wire_type, start, end in self._occurrences(field):
+            if wire_type != _LENGTH_DELIMITED:
+                raise ValueError(f"Unexpected wire type for field {field}")
+            yield start, end
+
+    def _attributes(self, field: int) -> util.JSONLikeDictIter:
+        return _key_values(self._buf, self._messages(field))
+
+
+def _key_values(
+    buf: Buffer, ranges: Iterator[tuple[int, int]]
+) -> util.JSONLikeDictIter:
+    def items() -> Iterator[tuple[str, util.JSONLikeIter]]:
+        for start, end in ranges:
+            kv = _MappedMessage(buf, start, end)
+            yield (
+                intern(kv._str(_KeyValue.KEY)),
+                _any_value(buf, *kv._message(_KeyValue.VALUE)),
+            )
+
+    return util.JSONLikeDictIter(items())
+
+
+def _any_value(buf: Buffer, start: int, end: int) -> util.JSONLikeIter:
+    ## The same cases as otlpproto._un_anyvalue; the last field set wins (oneof)
+    fields = _scan(buf, start, end)
+    if not fields:
+        raise NotImplementedError()
+    field = max(fields, key=lambda f: fields[f][-1][2])
+    value = _MappedMessage(buf, start, end)
+    value._fields = fields
+    match field:
+        case _AnyValue.STRING_VALUE:
+            return value._str(field)
+        case _AnyValue.BOOL_VALUE:
+            return value._varint(field) != 0
+        case _AnyValue.INT_VALUE:
+            return _signed64(value._varint(field))
+        case _AnyValue.DOUBLE_VALUE:
+            occurrence = value._last(field, _FIXED64)
+            assert occurrence is not None
+            return struct.unpack_from("<d", buf, occurrence[1])[0]
+        case _AnyValue.ARRAY_VALUE:
+            array = _MappedMessage(buf, *value._message(field))
+            return util.JSONLikeListIter(
+                _any_value(buf, s, e) for s, e in array._messages(_VALUES)
+            )
+        case _AnyValue.KVLIST_VALUE:
+            kvlist = _MappedMessage(buf, *value._message(field))
+            return _key_values(buf, kvlist._messages(_VALUES))
+    raise NotImplementedError()
+
+
+class OTLPProtoMappedSpanEvent(_MappedMessage, base.SpanEvent):
+    @property
+    @override
+    def otlp_time_unix_nano(self) -> int:
+        return self._fixed64(_Event.TIME_UNIX_NANO)
+
+    @property
+    @override
+    def otlp_name(self) -> str:
+        return self._str(_Event.NAME)
+
+    @property
+    @override
+    def otlp_attributes_iter(self) -> util.JSONLikeDictIter:
+        return self._attributes(_Event.ATTRIBUTES)
+
+    @property
+    @override
+    def otlp_dropped_attributes_count(self) -> int:
+        return self._varint(_Event.DROPPED_ATTRIBUTES_COUNT)
+
+
+class OTLPProtoMappedStatus(_MappedMessage, base.Status):
+    @property
+    @override
+    def otlp_message(self) -> Optional[str]:
+        message = self._str(_Status.MESSAGE)
+        return message if message != "" else None
+
+    @property
+    @override
+    def otlp_code(self) -> int:
+        return self._varint(_Status.CODE)
+
+
+class OTLPProtoMappedSpanLink(_MappedMessage, base.SpanLink):
+    @property
+    @override
+    @util.memoised
+    def otlp_trace_id(self) -> str:
+        return self._hex(_Link.TRACE_ID)
+
+    @property
+    @override
+    @util.memoised
+    def otlp_span_id(self) -> str:
+        return self._hex(_Link.SPAN_ID)
+
+    @property
+    @override
+    def otlp_state(self) -> str:
+        return self._str(_Link.TRACE_STATE)
+
+    @property
+    @override
+    def otlp_attributes_iter(self) -> util.JSONLikeDictIter:
+        return self._attributes(_Link.ATTRIBUTES)
+
+    @property
+    @override
+    def otlp_dropped_attributes_count(self) -> int:
+        return self._varint(_Link.DROPPED_ATTRIBUTES_COUNT)
+
+    @property
+    @override
+    def otlp_flags(self) -> int:
+        return self._fixed32(_Link.FLAGS)
+
+
+class OTLPProtoMappedSpan(_MappedMessage, base.Span):
+    @property
+    @override
+    @util.memoised
+    def otlp_trace_id(self) -> str:
+        return self._hex(_Span.TRACE_ID)
+
+    @property
+    @override
+    @util.memoised
+    def otlp_span_id(self) -> str:
+        return self._hex(_Span.SPAN_ID)
+
+    @property
+    @override
+    @util.memoised
+    def otlp_trace_state(self) -> Optional[str]:
+        trace_state = self._str(_Span.TRACE_STATE)
+        return trace_state if trace_state != "" else None
+
+    @property
+    @override
+    @util.memoised
+    def otlp_parent_span_id(self) -> str:
+        return self._hex(_Span.PARENT_SPAN_ID)
+
+    @property
+    @override
+    @util.memoised
+    def otlp_flags(self) -> int:
+        return self._fixed32(_Span.FLAGS)
+
+    @property
+    @override
+    @util.memoised
+    def otlp_name(self) -> str:
+        return self._str(_Span.NAME)
+
+    @property
+    @override
+    def otlp_kind(self) -> OTLPProtoSpanKind:
+        return OTLPProtoSpanKind(trace.SpanSpanKind(self._varint(_Span.KIND)))
+
+    @property
+    @override
+    @util.memoised
+    def otlp_start_time_unix_nano(self) -> int:
+        return self._fixed64(_Span.START_TIME_UNIX_NANO)
+
+    @property
+    @override
+    @util.memoised
+    def otlp_end_time_unix_nano(self) -> int:
+        return self._fixed64(_Span.END_TIME_UNIX_NANO)
+
+    @property
+    @override
+    def otlp_attributes_iter(self) -> util.JSONLikeDictIter:
+        return self._attributes(_Span.ATTRIBUTES)
+
+    @property
+    @override
+    def otlp_dropped_attributes_count(self) -> int:
+        return self._varint(_Span.DROPPED_ATTRIBUTES_COUNT)
+
+    @property
+    @override
+    def otlp_events(self) -> Iterator[OTLPProtoMappedSpanEvent]:
+        return (
+            OTLPProtoMappedSpanEvent(self._buf, start, end)
+            for start, end in self._messages(_Span.EVENTS)
+        )
+
+    @property
+    @override
+    def otlp_dropped_events_count(self) -> int:
+        return self._varint(_Span.DROPPED_EVENTS_COUNT)
+
+    @property
+    @override
+    def otlp_links(self) -> Iterator[OTLPProtoMappedSpanLink]:
+        return (
+            OTLPProtoMappedSpanLink(self._buf, start, end)
+            for start, end in self._messages(_Span.LINKS)
+        )
+
+    @property
+    @override
+    def otlp_dropped_links_count(self) -> int:
+        return self._varint(_Span.DROPPED_LINKS_COUNT)
+
+    @property
+    @override
+    def otlp_status(self) -> OTLPProtoMappedStatus:
+        return OTLPProtoMappedStatus(self._buf, *self._message(_Span.STATUS))
+
+
+class OTLPProtoMappedInstrumentationScope(_MappedMessage, base.InstrumentationScope):
+    @property
+    @override
+    def otlp_name(self) -> str:
+        return self._str(_InstrumentationScope.NAME)
+
+    @property
+    @override
+    def otlp_version(self) -> Optional[str]:
+        version = self._str(_InstrumentationScope.VERSION)
+        return version if version != "" else None
+
+    @property
+    @override
+    def otlp_attributes_iter(self) -> util.JSONLikeDictIter:
+        return self._attributes(_InstrumentationScope.ATTRIBUTES)
+
+    @property
+    @override
+    def otlp_dropped_attributes_count(self) -> int:
+        return self._varint(_InstrumentationScope.DROPPED_ATTRIBUTES_COUNT)
+
+
+class OTLPProtoMappedResource(_MappedMessage, base.Resource):
+    @property
+    @override
+    def otlp_attributes_iter(self) -> util.JSONLikeDictIter:
+        return self._attributes(_Resource.ATTRIBUTES)
+
+    @property
+    @override
+    def otlp_dropped_attributes_count(self) -> int:
+        return self._varint(_Resource.DROPPED_ATTRIBUTES_COUNT)
+
+
+class OTLPProtoMappedScopeSpanCollection(_MappedMessage, base.ScopeSpanCollection):
+    @property
+    @override
+    def otlp_scope(self) -> OTLPProtoMappedInstrumentationScope:
+        return OTLPProtoMappedInstrumentationScope(
+            self._buf, *self._message(_ScopeSpans.SCOPE)
+        )
+
+    @property
+    @override
+    def otlp_spans(self) -> Iterator[OTLPProtoMappedSpan]:
+        return (
+            OTLPProtoMappedSpan(self._buf, start, end)
+            for start, end in self._messages(_ScopeSpans.SPANS)
+        )
+
+    @property
+    @override
+    def otlp_schema_url(self) -> Optional[str]:
+        schema_url = self._str(_ScopeSpans.SCHEMA_URL)
+        return schema_url if schema_url != "" else None
+
+
+class OTLPProtoMappedResourceSpanCollection(
+    _MappedMessage, base.ResourceSpanCollection
+):
+    @property
+    @override
+    def otlp_resource(self) -> OTLPProtoMappedResource:
+        return OTLPProtoMappedResource(
+            self._buf, *self._message(_ResourceSpans.RESOURCE)
+        )
+
+    @property
+    @override
+    def otlp_scope_spans(self) -> Iterator[OTLPProtoMappedScopeSpanCollection]:
+        return (
+            OTLPProtoMappedScopeSpanCollection(self._buf, start, end)
+            for start, end in self._messages(_ResourceSpans.SCOPE_SPANS)
+        )
+
+    @property
+    @override
+    def otlp_schema_url(self) -> Optional[str]:
+        schema_url = self._str(_ResourceSpans.SCHEMA_URL)
+        return schema_url if schema_url != "" else None
+
+
+class OTLPProtoMappedSpanCollection(_MappedMessage, base.SpanCollection):
+    """
+    An ExportTraceServiceRequest. Keeps the buffer (and with that, the memory map)
+    alive for as long as it or any of its parts are referenced.
+    """
+
+    @property
+    @override
+    def otlp_resource_spans(self) -> Iterator[OTLPProtoMappedResourceSpanCollection]:
+        return (
+            OTLPProtoMappedResourceSpanCollection(self._buf, start, end)
+            for start, end in self._messages(_ExportTraceServiceRequest.RESOURCE_SPANS)
+        )
+
+
+def loads_mapped(s: bytes) -> OTLPProtoMappedSpanCollection:
+    return OTLPProtoMappedSpanCollection(memoryview(s), 0, len(s))
+
+
+def load_mapped(fp: BinaryIO) -> OTLPProtoMappedSpanCollection:
+    """
+    Memory maps the rest of the file behind fp (from its current position). Falls back
+    to reading it if that is not possible (e.g. for pipes or empty files).
+    """
+    try:
+        start = fp.tell()
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        return loads_mapped(fp.read())
+    return OTLPProtoMappedSpanCollection(memoryview(buf), start, len(buf))
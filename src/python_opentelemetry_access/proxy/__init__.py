@@ -1,7 +1,9 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from abc import ABC, abstractmethod
-from collections.abc import AsyncIterable
-from typing import Iterable, List, Optional, Tuple, override, Any
+from bisect import bisect_left, bisect_right
+import heapq
+from collections.abc import AsyncIterable, Iterator, Sequence
+from typing import Iterable, List, Literal, Optional, Tuple, override, Any
 from datetime import datetime, timedelta
 
 import python_opentelemetry_access.base as base
@@ -13,6 +15,16 @@ class PageToken:
     token: bytes
 
 
+## How much of every span is returned:
+##  - full: everything
+##  - summary: only what is needed to list spans, i.e. the ids, name, kind, timings
+##    and status of spans, the SUMMARY_RESOURCE_ATTRIBUTES of resources and the
+##    names and versions of scopes, without attributes, events or links
+type Verbosity = Literal["full", "summary"]
+
+SUMMARY_RESOURCE_ATTRIBUTES = ("service.name",)
+
+
 class Proxy(ABC):
     @abstractmethod
     async def query_spans_page(
@@ -27,6 +39,7 @@ class Proxy(ABC):
         span_name: Optional[str] = None,
         page_size: Optional[int] | None = None,
         page_token: Optional[PageToken] = None,
+        verbosity: Verbosity = "full",
     ) -> AsyncIterable[base.SpanCollection | PageToken]:
         # A trick to make the type of the function what I want
         # Why yield inside function body effects the type of the function is explained in
@@ -46,6 +59,7 @@ class Proxy(ABC):
         span_name: Optional[str] = None,
         page_size: Optional[int] | None = None,
         starting_page_token: Optional[PageToken] = None,
+        verbosity: Verbosity = "full",
     ) -> AsyncIterable[base.SpanCollection]:
         async for spans_or_page_token in self.query_spans_page(
             auth_info,
@@ -58,6 +72,7 @@ class Proxy(ABC):
             span_name,
             page_size,
             page_token=starting_page_token,
+            verbosity=verbosity,
         ):
             if isinstance(spans_or_page_token, PageToken):
                 async for spans in self.query_spans_async(
@@ -71,6 +86,7 @@ class Proxy(ABC):
                     span_name,
                     page_size,
                     starting_page_token=spans_or_page_token,
+                    verbosity=verbosity,
                 ):
                     yield spans
             else:
@@ -121,7 +137,7 @@ def _match_span(
     from_time: Optional[datetime],
     to_time: Optional[datetime],
     span_ids: Optional[List[Tuple[Optional[str], Optional[str]]]],
-    span_attributes: Optional[util.AttributesFilter],
+    span_attributes: util.CompiledAttributesFilter,
     span_name: Optional[str],
 ) -> bool:
     if span_name is not None and span.name != span_name:
@@ -146,9 +162,7 @@ def _match_span(
     ):
         return False
 
-    return util.match_attributes(
-        actual_attributes=span.attributes, expected_attributes=span_attributes
-    )
+    return span_attributes(span.attributes)
 
 
 def _filter_scope_span_collection(
@@ -156,7 +170,7 @@ def _filter_scope_span_collection(
     from_time: Optional[datetime],
     to_time: Optional[datetime],
     span_ids: Optional[List[Tuple[Optional[str], Optional[str]]]],
-    span_attributes: Optional[util.AttributesFilter],
+    span_attributes: util.CompiledAttributesFilter,
     span_name: Optional[str],
 ) -> base.ReifiedScopeSpanCollection:
     spans.spans = [
@@ -173,8 +187,8 @@ def _filter_resource_span_collection(
     from_time: Optional[datetime],
     to_time: Optional[datetime],
     span_ids: Optional[List[Tuple[Optional[str], Optional[str]]]],
-    scope_attributes: Optional[util.AttributesFilter],
-    span_attributes: Optional[util.AttributesFilter],
+    scope_attributes: util.CompiledAttributesFilter,
+    span_attributes: util.CompiledAttributesFilter,
     span_name: Optional[str],
 ) -> base.ReifiedResourceSpanCollection:
     spans.scope_spans = [
@@ -182,10 +196,7 @@ def _filter_resource_span_collection(
             inner_spans, from_time, to_time, span_ids, span_attributes, span_name
         )
         for inner_spans in spans.scope_spans
-        if util.match_attributes(
-            actual_attributes=inner_spans.scope.attributes,
-            expected_attributes=scope_attributes,
-        )
+        if scope_attributes(inner_spans.scope.attributes)
     ]
 
     spans.scope_spans = [
@@ -206,52 +217,307 @@ def _filter_span_collection(
     span_name: Optional[str],
     page_size: Optional[int],
 ) -> base.ReifiedSpanCollection:
+    ## Compile the filters once rather than once per resource/scope/span
+    resource_filter = util.CompiledAttributesFilter(resource_attributes)
+    scope_filter = util.CompiledAttributesFilter(scope_attributes)
+    span_filter = util.CompiledAttributesFilter(span_attributes)
+
     spans.resource_spans = [
         _filter_resource_span_collection(
             inner_spans,
             from_time,
             to_time,
             span_ids,
-            scope_attributes,
-            span_attributes,
+            scope_filter,
+            span_filter,
             span_name,
         )
         for inner_spans in spans.resource_spans
-        if util.match_attributes(
-            inner_spans.resource.attributes, expected_attributes=resource_attributes
-        )
+        if resource_filter(inner_spans.resource.attributes)
     ]
-    # Could take page_size into account using something like the below code.
-    # But in that case would also need to neturn a next_page_token in case not all spans were returned
-    # result_resource_spans: list[base.ReifiedResourceSpanCollection] = []
-    # result_span_count = 0
-    # for inner_spans in spans.resource_spans:
-    #     if not inner_spans.scope_spans:
-    #         continue
-    #     if (
-    #         page_size is not None
-    #         and result_span_count + len(inner_spans.scope_spans) >= page_size
-    #     ):
-    #         take_count = page_size - result_span_count
-    #         result_resource_spans.append(
-    #             base.ReifiedResourceSpanCollection(
-    #                 inner_spans.resource,
-    #                 inner_spans.scope_spans[:take_count],
-    #                 inner_spans.schema_url,
-    #             )
-    #         )
-    #         result_span_count += take_count
-    #         break
-    #     result_resource_spans.append(inner_spans)
-    #     result_span_count += len(inner_spans.scope_spans)
+    ## NOTE: page_size is not taken into account here, since there is no way to
+    ##       return a page token, see MockProxy for paginated in-memory queries
     return base.ReifiedSpanCollection(
         [inner_spans for inner_spans in spans.resource_spans if inner_spans.scope_spans]
     )
 
 
+def _summarise_resource(resource: base.ReifiedResource) -> base.ReifiedResource:
+    return base.ReifiedResource(
+        attributes={
+            key: value
+            for key, value in resource.attributes.items()
+            if key in SUMMARY_RESOURCE_ATTRIBUTES
+        },
+        dropped_attributes_count=0,
+    )
+
+
+def _summarise_scope(
+    scope: base.ReifiedInstrumentationScope,
+) -> base.ReifiedInstrumentationScope:
+    return replace(scope, attributes={}, dropped_attributes_count=0)
+
+
+def _summarise_span(span: base.ReifiedSpan) -> base.ReifiedSpan:
+    return replace(
+        span,
+        attributes={},
+        dropped_attributes_count=0,
+        events=[],
+        dropped_events_count=0,
+        links=[],
+        dropped_links_count=0,
+    )
+
+
+class _SpanIndex:
+    """
+    Indexes over an in-memory span collection, so that MockProxy can answer
+    queries without copying or scanning the whole collection. Spans are referred
+    to by their position in the collection.
+    """
+
+    def __init__(self, spans: base.ReifiedSpanCollection):
+        self.resource_spans = spans.resource_spans
+        ## (resource_spans index, scope_spans index, span) for each position
+        self.spans: List[Tuple[int, int, base.ReifiedSpan]] = []
+        self.by_trace_id: dict[str, List[int]] = {}
+        self.by_span_id: dict[Tuple[str, str], List[int]] = {}
+        self.by_name: dict[str, List[int]] = {}
+
+        for resource_idx, resource_spans in enumerate(spans.resource_spans):
+            for scope_idx, scope_spans in enumerate(resource_spans.scope_spans):
+                for span in scope_spans.spans:
+                    position = len(self.spans)
+                    self.spans.append((resource_idx, scope_idx, span))
+                    self.by_trace_id.setdefault(span.trace_id, []).append(position)
+                    self.by_span_id.setdefault(
+                        (span.trace_id, span.span_id), []
+                    ).append(position)
+                    self.by_name.setdefault(span.name, []).append(position)
+
+        self.by_start_time = sorted(
+            range(len(self.spans)),
+            key=lambda position: self.spans[position][2].start_time_unix_nano,
+        )
+        self.start_times = [
+            self.spans[position][2].start_time_unix_nano
+            for position in self.by_start_time
+        ]
+        self.by_end_time = sorted(
+            range(len(self.spans)),
+            key=lambda position: self.spans[position][2].end_time_unix_nano,
+        )
+        self.end_times = [
+            self.spans[position][2].end_time_unix_nano for position in self.by_end_time
+        ]
+
+    def _candidates(
+        self,
+        from_time: Optional[datetime],
+        to_time: Optional[datetime],
+        span_ids: Optional[List[Tuple[Optional[str], Optional[str]]]],
+        span_name: Optional[str],
+        after: Optional[int],
+    ) -> Tuple[Sequence[int], int, int, bool]:
+        """
+        Positions of (a superset of) the matching spans after position `after`, as
+        candidates[lo:hi] of the most selective index, and whether they are sorted.
+        Unsorted candidates may include positions up to `after`.
+        """
+        ## (candidates, lo, hi, is_sorted)
+        indexes: List[Tuple[Sequence[int], int, int, bool]] = [
+            (range(len(self.spans)), 0, len(self.spans), True)
+        ]
+
+        if span_ids is not None:
+            ## Same semantics as _match_span, so (None, span_id) matches nothing
+            by_ids: set[int] = set()
+            for trace_id, span_id in span_ids:
+                if trace_id is None:
+                    continue
+                elif span_id is None:
+                    by_ids.update(self.by_trace_id.get(trace_id, []))
+                else:
+                    by_ids.update(self.by_span_id.get((trace_id, span_id), []))
+            indexes.append((sorted(by_ids), 0, len(by_ids), True))
+
+        if span_name is not None:
+            by_name = self.by_name.get(span_name, [])
+            indexes.append((by_name, 0, len(by_name), True))
+
+        if after is not None:
+            ## Sorted candidates can skip straight past `after`
+            indexes = [
+                (candidates, bisect_right(candidates, after, lo, hi), hi, True)
+                for candidates, lo, hi, _ in indexes
+            ]
+
+        if to_time is not None:
+            indexes.append(
+                (
+                    self.by_start_time,
+                    0,
+                    bisect_right(self.start_times, to_time.timestamp() * 1000000000),
+                    False,
+                )
+            )
+
+        if from_time is not None:
+            indexes.append(
+                (
+                    self.by_end_time,
+                    bisect_left(self.end_times, from_time.timestamp() * 1000000000),
+                    len(self.spans),
+                    False,
+                )
+            )
+
+        return min(indexes, key=lambda index: index[2] - index[1])
+
+    def query(
+        self,
+        from_time: Optional[datetime],
+        to_time: Optional[datetime],
+        span_ids: Optional[List[Tuple[Optional[str], Optional[str]]]],
+        resource_attributes: Optional[util.AttributesFilter],
+        scope_attributes: Optional[util.AttributesFilter],
+        span_attributes: Optional[util.AttributesFilter],
+        span_name: Optional[str],
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> List[int]:
+        """
+        Sorted positions of the matching spans, only those after position `after` and
+        at most `limit` of them
+        """
+        resource_filter = util.CompiledAttributesFilter(resource_attributes)
+        scope_filter = util.CompiledAttributesFilter(scope_attributes)
+        span_filter = util.CompiledAttributesFilter(span_attributes)
+
+        resource_matches: dict[int, bool] = {}
+        scope_matches: dict[Tuple[int, int], bool] = {}
+
+        def matches(position: int) -> bool:
+            resource_idx, scope_idx, span = self.spans[position]
+
+            resource_match = resource_matches.get(resource_idx)
+            if resource_match is None:
+                resource_match = resource_matches[resource_idx] = resource_filter(
+                    self.resource_spans[resource_idx].resource.attributes
+                )
+            if not resource_match:
+                return False
+
+            scope_match = scope_matches.get((resource_idx, scope_idx))
+            if scope_match is None:
+                scope_match = scope_matches[(resource_idx, scope_idx)] = scope_filter(
+                    self.resource_spans[resource_idx]
+                    .scope_spans[scope_idx]
+                    .scope.attributes
+                )
+            if not scope_match:
+                return False
+
+            return _match_span(
+                span, from_time, to_time, span_ids, span_filter, span_name
+            )
+
+        candidates, lo, hi, is_sorted = self._candidates(
+            from_time, to_time, span_ids, span_name, after
+        )
+
+        positions: Iterator[int]
+        if is_sorted:
+            positions = (candidates[i] for i in range(lo, hi))
+        else:
+            ## Time indexes are not in collection order, so only put the candidates
+            ## after `after` in order as far as needed
+            heap = [
+                position
+                for position in (candidates[i] for i in range(lo, hi))
+                if after is None or position > after
+            ]
+            heapq.heapify(heap)
+            positions = (heapq.heappop(heap) for _ in range(len(heap)))
+
+        ## Can stop as soon as enough spans were found
+        result: List[int] = []
+        for position in positions:
+            if limit is not None and len(result) >= limit:
+                break
+            if matches(position):
+                result.append(position)
+        return result
+
+    def to_span_collection(
+        self, positions: List[int], verbosity: Verbosity = "full"
+    ) -> base.ReifiedSpanCollection:
+        """
+        Collects the spans at the given (sorted) positions, sharing the resources,
+        scopes and spans with the indexed collection (unless they are summarised)
+        """
+        summary = verbosity == "summary"
+        result: List[base.ReifiedResourceSpanCollection] = []
+        last_resource_idx: Optional[int] = None
+        last_scope_idx: Optional[int] = None
+
+        for position in positions:
+            resource_idx, scope_idx, span = self.spans[position]
+            if resource_idx != last_resource_idx:
+                resource_spans = self.resource_spans[resource_idx]
+                result.append(
+                    base.ReifiedResourceSpanCollection(
+                        resource=_summarise_resource(resource_spans.resource)
+                        if summary
+                        else resource_spans.resource,
+                        scope_spans=[],
+                        schema_url=resource_spans.schema_url,
+                    )
+                )
+                last_resource_idx = resource_idx
+                last_scope_idx = None
+            if scope_idx != last_scope_idx:
+                scope_spans = self.resource_spans[resource_idx].scope_spans[scope_idx]
+                result[-1].scope_spans.append(
+                    base.ReifiedScopeSpanCollection(
+                        scope=_summarise_scope(scope_spans.scope)
+                        if summary
+                        else scope_spans.scope,
+                        spans=[],
+                        schema_url=scope_spans.schema_url,
+                    )
+                )
+                last_scope_idx = scope_idx
+            result[-1].scope_spans[-1].spans.append(
+                _summarise_span(span) if summary else span
+            )
+
+        return base.ReifiedSpanCollection(result)
+
+
 class MockProxy(Proxy):
-    def __init__(self, all_spans: base.SpanCollection):
+    def __init__(
+        self,
+        all_spans: base.SpanCollection,
+        default_page_size: Optional[int] = None,
+        max_page_size: Optional[int] = None,
+    ):
         self._all_spans = all_spans.to_reified()
+        self._index = _SpanIndex(self._all_spans)
+        self.default_page_size = default_page_size
+        self.max_page_size = max_page_size
+
+    def _decode_page_token(self, page_token: PageToken) -> int:
+        try:
+            prefix, position_str = page_token.token.decode("ascii").split(":")
+            position = int(position_str)
+        except ValueError:
+            raise util.InvalidPageTokenException()
+        if prefix != "mock" or not 0 <= position < len(self._index.spans):
+            raise util.InvalidPageTokenException()
+        return position
 
     @override
     async def query_spans_page(
@@ -266,12 +532,20 @@ class MockProxy(Proxy):
         span_name: Optional[str] = None,
         page_size: Optional[int] | None = None,
         page_token: Optional[PageToken] = None,
+        verbosity: Verbosity = "full",
     ) -> AsyncIterable[base.SpanCollection | PageToken]:
-        if page_token is not None:
-            raise util.InvalidPageTokenException()
+        if page_size is None:
+            page_size = self.default_page_size
+        if page_size is not None and page_size < 1:
+            page_size = 1
+        if self.max_page_size is not None and (
+            page_size is None or page_size > self.max_page_size
+        ):
+            page_size = self.max_page_size
+
+        after = self._decode_page_token(page_token) if page_token is not None else None
 
-        yield _filter_span_collection(
-            self._all_spans.to_reified(),
+        positions = self._index.query(
             from_time,
             to_time,
             span_ids,
@@ -279,9 +553,22 @@ class MockProxy(Proxy):
             scope_attributes,
             span_attributes,
             span_name,
-            page_size,
+            after=after,
+            ## One extra to know whether there is a next page
+            limit=page_size + 1 if page_size is not None else None,
         )
 
+        if page_size is not None and len(positions) > page_size:
+            positions = positions[:page_size]
+            next_page_token = f"mock:{positions[-1]}".encode("ascii")
+        else:
+            next_page_token = None
+
+        yield self._index.to_span_collection(positions, verbosity)
+
+        if next_page_token is not None:
+            yield PageToken(next_page_token)
+
     @override
     async def aclose(self) -> None:
         pass
@@ -1,8 +1,17 @@
 import opensearchpy
-from collections.abc import AsyncIterable
+from collections import OrderedDict
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable, Mapping
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from typing import List, Never, Optional, Tuple, override, assert_never, Any
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import batched
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import time
 
 from opensearchpy import AsyncOpenSearch
 
@@ -11,7 +20,10 @@ from eoepca_api_utils.exceptions import APIException
 
 import python_opentelemetry_access.base as base
 import python_opentelemetry_access.opensearch.ss4o as ss4o
-from python_opentelemetry_access.util import InvalidPageTokenException
+from python_opentelemetry_access.util import (
+    ExpiredPageTokenException,
+    InvalidPageTokenException,
+)
 import python_opentelemetry_access.proxy as proxy
 
 from python_opentelemetry_access.telemetry_hooks import Hooks
@@ -41,16 +53,473 @@ GET_OPENSEARCH_CONFIG_HOOK_NAME = (
     os.environ.get("RH_TELEMETRY_GET_OPENSEARCH_CONFIG_HOOK_NAME")
     or "get_opensearch_config"
 )
+## Should return a (hashable) key identifying the user for the purposes of
+## caching the result of the get_opensearch_config hook, or None to not cache
+GET_OPENSEARCH_CONFIG_CACHE_KEY_HOOK_NAME = (
+    os.environ.get("RH_TELEMETRY_GET_OPENSEARCH_CONFIG_CACHE_KEY_HOOK_NAME")
+    or "get_opensearch_config_cache_key"
+)
+
+logger = logging.getLogger("python-opentelemetry-access")
+
+## Passed along with every request instead of to the client, so that users
+## that only differ in e.g. their bearer token can share connections
+_PER_REQUEST_CONFIG_KEYS = frozenset(["extra_headers"])
+
+
+def _is_plain_json(o: Any) -> bool:
+    """
+    Whether o is made of nothing but (exactly) JSON types, so that its JSON
+    serialisation identifies it
+    """
+    match o:
+        case None:
+            return True
+        case bool() | int() | float() | str():
+            return type(o) in (bool, int, float, str)
+        case list() | tuple():
+            return type(o) in (list, tuple) and all(_is_plain_json(x) for x in o)
+        case dict():
+            return type(o) is dict and all(
+                type(k) is str and _is_plain_json(v) for k, v in o.items()
+            )
+        case _:
+            return False
+
+
+def _client_config_key(client_config: Mapping[str, Any]) -> Optional[str]:
+    """
+    The pool key of a client configuration, or None if the configuration holds
+    values (such as an ssl_context) that cannot be compared by their JSON
+    """
+    config = {
+        k: v for k, v in client_config.items() if k not in _PER_REQUEST_CONFIG_KEYS
+    }
+    if not _is_plain_json(config):
+        return None
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+@dataclass
+class _PooledClient:
+    client: AsyncOpenSearch
+    last_used: float
+    in_use: int = 0
+    evicted: bool = False
+
+
+class OpenSearchClientPool:
+    """
+    Keeps long-lived AsyncOpenSearch clients around, keyed by (a hash of) the
+    configuration returned by the get_opensearch_config hook, so that requests
+    do not pay for a new TCP/TLS handshake every time.
+
+    At most max_size idle clients are kept (least recently used are closed first),
+    and clients unused for longer than idle_timeout are closed. Clients that are
+    in use are never closed from under a request, the pool may thus temporarily
+    hold more than max_size clients.
+    """
+
+    def __init__(self, max_size: int, idle_timeout: timedelta) -> None:
+        self.max_size = max(max_size, 0)
+        self.idle_timeout = idle_timeout.total_seconds()
+        self._clients: OrderedDict[str, _PooledClient] = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._closed = False
+
+    def _evict_locked(self, now: float) -> list[_PooledClient]:
+        evicted: list[_PooledClient] = []
+        for key, pooled in list(self._clients.items()):
+            if pooled.in_use == 0 and now - pooled.last_used >= self.idle_timeout:
+                evicted.append(self._clients.pop(key))
+        ## Least recently used first
+        for key, pooled in list(self._clients.items()):
+            if len(self._clients) <= self.max_size:
+                break
+            if pooled.in_use == 0:
+                evicted.append(self._clients.pop(key))
+        for pooled in evicted:
+            pooled.evicted = True
+        return evicted
+
+    async def _close_client(self, client: AsyncOpenSearch) -> None:
+        try:
+            await client.close()
+        except Exception:
+            logger.exception("Failed to close OpenSearch client")
+
+    async def _close_clients(self, pooled_clients: list[_PooledClient]) -> None:
+        for pooled in pooled_clients:
+            await self._close_client(pooled.client)
+
+    @asynccontextmanager
+    async def client(
+        self, client_config: Mapping[str, Any]
+    ) -> AsyncIterator[AsyncOpenSearch]:
+        if self._closed:
+            raise RuntimeError("OpenSearch client pool is closed")
+
+        key = _client_config_key(client_config)
+        if key is None:
+            ## Cannot tell whether a pooled client has the same configuration,
+            ## so use a one-off client
+            client = AsyncOpenSearch(
+                **{
+                    k: v
+                    for k, v in client_config.items()
+                    if k not in _PER_REQUEST_CONFIG_KEYS
+                }
+            )
+            try:
+                yield client
+            finally:
+                await self._close_client(client)
+            return
+
+        async with self._lock:
+            now = time.monotonic()
+            pooled = self._clients.get(key)
+            if pooled is None:
+                pooled = _PooledClient(
+                    client=AsyncOpenSearch(
+                        **{
+                            k: v
+                            for k, v in client_config.items()
+                            if k not in _PER_REQUEST_CONFIG_KEYS
+                        }
+                    ),
+                    last_used=now,
+                )
+                self._clients[key] = pooled
+            self._clients.move_to_end(key)
+            pooled.in_use += 1
+            evicted = self._evict_locked(now)
+        await self._close_clients(evicted)
+
+        try:
+            yield pooled.client
+        finally:
+            async with self._lock:
+                pooled.in_use -= 1
+                pooled.last_used = time.monotonic()
+                close_now = pooled.evicted and pooled.in_use == 0
+                ## Clean up in case the pool was shrunk while this client was busy
+                evicted = self._evict_locked(pooled.last_used)
+            await self._close_clients(([pooled] if close_now else []) + evicted)
+
+    async def aclose(self) -> None:
+        async with self._lock:
+            self._closed = True
+            pooled_clients = list(self._clients.values())
+            self._clients.clear()
+            for pooled in pooled_clients:
+                pooled.evicted = True
+            idle = [pooled for pooled in pooled_clients if pooled.in_use == 0]
+        ## Busy clients are closed when they are released
+        await self._close_clients(idle)
+
+
+def _default_config_cache_key(auth_info: Any) -> Optional[str]:
+    """
+    The whole auth_info, if it is plain JSON. Otherwise None, so that the config
+    is not cached, since there is no telling whether two such auth_infos are of
+    the same user.
+    """
+    if not _is_plain_json(auth_info):
+        return None
+    return hashlib.sha256(
+        json.dumps(auth_info, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+@dataclass
+class _CachedConfig:
+    config: Any
+    expires: float
+
+
+class OpenSearchConfigCache:
+    """
+    TTL/LRU cache of get_opensearch_config hook results, keyed on the identity of
+    the user. Concurrent requests for the same key share a single hook call.
+    """
+
+    def __init__(self, max_size: int, ttl: timedelta) -> None:
+        self.max_size = max_size
+        self.ttl = ttl.total_seconds()
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Any, _CachedConfig] = OrderedDict()
+        self._pending: dict[Any, asyncio.Future[Any]] = {}
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    async def get_or_load(self, key: Any, load: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.enabled or key is None:
+            return await load()
+
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.config
+            del self._entries[key]
+
+        while (pending := self._pending.get(key)) is not None:
+            try:
+                config = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                ## Only retry (as the new leader) if the leading request was
+                ## cancelled, rather than this one
+                task = asyncio.current_task()
+                if not pending.cancelled() or (
+                    task is not None and task.cancelling() > 0
+                ):
+                    raise
+            else:
+                self.hits += 1
+                return config
+
+        self.misses += 1
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            config = await load()
+        except asyncio.CancelledError:
+            ## Is not the fault of the requests waiting for this one
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            ## Do not complain about nobody having awaited the exception
+            future.exception()
+            raise
+        else:
+            future.set_result(config)
+            self._entries[key] = _CachedConfig(
+                config=config, expires=time.monotonic() + self.ttl
+            )
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return config
+        finally:
+            del self._pending[key]
+            logger.debug(
+                "OpenSearch config cache: %d hits, %d misses", self.hits, self.misses
+            )
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+## OpenSearch's default index.max_terms_count
+DEFAULT_MAX_TERMS_COUNT = 65536
+
+
+def _span_ids_filter(
+    span_ids: List[Tuple[Optional[str], Optional[str]]], max_terms_count: int
+) -> list[object]:
+    """
+    Filter clauses selecting the spans identified by any of span_ids, in one query:
+    (trace_id, None) selects a whole trace, (None, span_id) a span in any trace.
+    Ids are looked up with terms queries of at most max_terms_count ids each.
+    """
+
+    def terms(field: str, values: list[str]) -> list[object]:
+        if len(values) == 1:
+            return [{"term": {field: values[0]}}]
+        return [
+            {"terms": {field: list(chunk)}}
+            for chunk in batched(values, max(1, max_terms_count))
+        ]
+
+    def any_of(clauses: list[object]) -> object:
+        if len(clauses) == 1:
+            return clauses[0]
+        return {"bool": {"should": clauses, "minimum_should_match": 1}}
+
+    trace_ids: list[str] = []
+    span_ids_any_trace: list[str] = []
+    span_ids_by_trace: dict[str, list[str]] = {}
+    for trace_id, span_id in dict.fromkeys(span_ids):
+        if trace_id is None and span_id is None:
+            ## Selects everything
+            return []
+        elif span_id is None:
+            trace_ids.append(trace_id)  # type: ignore
+        elif trace_id is None:
+            span_ids_any_trace.append(span_id)
+        else:
+            span_ids_by_trace.setdefault(trace_id, []).append(span_id)
+
+    clauses = terms("traceId", trace_ids) + terms("spanId", span_ids_any_trace)
+    whole_traces = set(trace_ids)
+    for trace_id, ids in span_ids_by_trace.items():
+        if trace_id in whole_traces:
+            continue
+        clauses.append(
+            {
+                "bool": {
+                    "filter": [
+                        {"term": {"traceId": trace_id}},
+                        any_of(terms("spanId", ids)),
+                    ]
+                }
+            }
+        )
+
+    if not clauses:
+        ## No span ids, so nothing is selected
+        return [{"bool": {"must_not": {"match_all": {}}}}]
+    return [any_of(clauses)]
+
+
+## traceId and spanId break ties between spans with the same startTime, so that
+## every span has a unique position and search_after neither skips nor repeats spans
+SORT: list[object] = [
+    {"startTime": {"order": "asc"}},
+    {"traceId": {"order": "asc"}},
+    {"spanId": {"order": "asc"}},
+]
+PAGE_TOKEN_VERSION = 1
+
+## The _source fields fetched for summary verbosity, see proxy.Verbosity
+SUMMARY_SOURCE_INCLUDES = [
+    "traceId",
+    "spanId",
+    "parentSpanId",
+    "traceState",
+    "name",
+    "kind",
+    "startTime",
+    "endTime",
+    "status",
+    "instrumentationScope.name",
+    "instrumentationScope.version",
+    *(f"resource.{key}" for key in proxy.SUMMARY_RESOURCE_ATTRIBUTES),
+]
+## Keep alive of points in time named in page tokens when PIT mode is disabled
+DEFAULT_PIT_KEEP_ALIVE = timedelta(minutes=1)
+
+
+def _encode_page_token(
+    sort_values: list[Any], pit_id: Optional[str] = None
+) -> proxy.PageToken:
+    """
+    Page token continuing after the hit with the given sort values, in the given
+    point in time if any
+    """
+    token: dict[str, Any] = {"v": PAGE_TOKEN_VERSION, "after": sort_values}
+    if pit_id is not None:
+        token["pit"] = pit_id
+    return proxy.PageToken(json.dumps(token, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode_page_token(page_token: proxy.PageToken) -> Tuple[list[Any], Optional[str]]:
+    """
+    The search_after values and point in time id of a page token made by
+    _encode_page_token
+    """
+    try:
+        decoded = json.loads(page_token.token.decode("utf-8"))
+    except ValueError:
+        raise InvalidPageTokenException()
+    match decoded:
+        ## startTime is sorted on as an epoch timestamp, traceId and spanId as strings
+        case {"v": version, "after": [int() as start_time, str(), str()] as after} if (
+            version == PAGE_TOKEN_VERSION and not isinstance(start_time, bool)
+        ):
+            match decoded.get("pit"):
+                case None:
+                    return after, None
+                case str(pit_id) if pit_id:
+                    return after, pit_id
+                case _:
+                    raise InvalidPageTokenException()
+        case _:
+            raise InvalidPageTokenException()
+
+
+def _keep_alive(keep_alive: timedelta) -> str:
+    return f"{max(1, round(keep_alive.total_seconds()))}s"
+
+
+def _is_search_context_missing(e: opensearchpy.TransportError) -> bool:
+    """
+    Whether e was caused by a point in time that expired or was deleted
+    """
+    if e.error == "search_context_missing_exception":
+        return True
+    match e.info:
+        case {"error": {"root_cause": [*root_causes]}}:
+            return any(
+                isinstance(root_cause, dict)
+                and root_cause.get("type") == "search_context_missing_exception"
+                for root_cause in root_causes
+            )
+        case _:
+            return False
 
 
 class OpenSearchSS40Proxy(proxy.Proxy):
     def __init__(
-        self, hooks: dict[str, Hooks], default_page_size: int, max_page_size: int
+        self,
+        hooks: dict[str, Hooks],
+        default_page_size: int,
+        max_page_size: int,
+        client_pool_size: int = 8,
+        client_idle_timeout: timedelta = timedelta(minutes=5),
+        config_cache_size: int = 1024,
+        config_cache_ttl: timedelta = timedelta(minutes=1),
+        max_terms_count: int = DEFAULT_MAX_TERMS_COUNT,
+        pit_keep_alive: Optional[timedelta] = None,
     ) -> None:
         self.hooks = hooks
         self.index_name = "ss4o_traces-default-namespace"
         self.default_page_size = default_page_size
         self.max_page_size = max_page_size
+        ## Should not exceed the index.max_terms_count setting of the index
+        self.max_terms_count = max_terms_count
+        ## If set, queries are paged through a point in time (PIT), opened on the
+        ## first page and kept alive this long after each page
+        self.pit_keep_alive = pit_keep_alive
+        self.client_pool = OpenSearchClientPool(
+            max_size=client_pool_size, idle_timeout=client_idle_timeout
+        )
+        self.config_cache = OpenSearchConfigCache(
+            max_size=config_cache_size, ttl=config_cache_ttl
+        )
+
+    async def _config_cache_key(self, auth_info: Any) -> Any:
+        if GET_OPENSEARCH_CONFIG_CACHE_KEY_HOOK_NAME in self.hooks:
+            return await call_hooks_until_not_none(
+                self.hooks[GET_OPENSEARCH_CONFIG_CACHE_KEY_HOOK_NAME], auth_info
+            )
+        return _default_config_cache_key(auth_info)
+
+    async def _get_client_config(self, auth_info: Any) -> Any:
+        if GET_OPENSEARCH_CONFIG_HOOK_NAME not in self.hooks:
+            raise ValueError(
+                f"Must set hook {GET_OPENSEARCH_CONFIG_HOOK_NAME} ($GET_OPENSEARCH_CONFIG_HOOK_NAME) when using the OpenSearch backend"
+            )
+
+        return await self.config_cache.get_or_load(
+            await self._config_cache_key(auth_info),
+            lambda: call_hooks_until_not_none(
+                self.hooks[GET_OPENSEARCH_CONFIG_HOOK_NAME], auth_info
+            ),
+        )
 
     @override
     async def query_spans_page(
@@ -65,6 +534,7 @@ class OpenSearchSS40Proxy(proxy.Proxy):
         span_name: Optional[str] = None,
         page_size: Optional[int] | None = None,
         page_token: Optional[proxy.PageToken] = None,
+        verbosity: proxy.Verbosity = "full",
     ) -> AsyncIterable[base.SpanCollection | proxy.PageToken]:
         if page_size is None:
             page_size = self.default_page_size
@@ -81,17 +551,7 @@ class OpenSearchSS40Proxy(proxy.Proxy):
             filter.append({"range": {"endTime": {"lte": to_time.isoformat()}}})
 
         if span_ids is not None:
-            if len(span_ids) != 1:
-                raise RuntimeError(
-                    "Currently only supports selecting precisely one trace/span"
-                )
-            (trace_id, span_id) = span_ids[0]
-
-            if trace_id is not None:
-                filter.append({"term": {"traceId": trace_id}})
-
-            if span_id is not None:
-                filter.append({"term": {"spanId": span_id}})
+            filter.extend(_span_ids_filter(span_ids, self.max_terms_count))
 
         def attribbute_to_filter(
             key_prefix: str, key: str, value: str | int | float | bool
@@ -145,38 +605,51 @@ class OpenSearchSS40Proxy(proxy.Proxy):
         q: dict[str, Any] = {
             "size": page_size,
             "query": {"bool": {"filter": filter}},
-            "sort": [
-                {"startTime": {"order": "asc"}}
-                # {"traceId": {"order": "asc"}},
-                # {"spanId": {"order": "asc"}}
-            ],
+            "sort": SORT,
         }
+        if verbosity == "summary":
+            q["_source"] = {"includes": SUMMARY_SOURCE_INCLUDES}
+        pit_id: Optional[str] = None
         if page_token is not None:
-            # q['search_after'] = page_token.token.decode('ascii').split("__")
-            ## Validate
-            token = page_token.token.decode("ascii")
-            try:
-                _ = datetime.fromisoformat(token)
-            except ValueError:
-                raise InvalidPageTokenException()
-            q["search_after"] = [token]
-
-        if GET_OPENSEARCH_CONFIG_HOOK_NAME not in self.hooks:
-            raise ValueError(
-                f"Must set hook {GET_OPENSEARCH_CONFIG_HOOK_NAME} ($GET_OPENSEARCH_CONFIG_HOOK_NAME) when using the OpenSearch backend"
-            )
+            q["search_after"], pit_id = _decode_page_token(page_token)
+        keep_alive = _keep_alive(self.pit_keep_alive or DEFAULT_PIT_KEEP_ALIVE)
 
-        client_config = await call_hooks_until_not_none(
-            self.hooks[GET_OPENSEARCH_CONFIG_HOOK_NAME], auth_info
-        )
+        client_config = await self._get_client_config(auth_info)
+        headers = client_config.get("extra_headers")
 
         try:
-            client = AsyncOpenSearch(**client_config)
-            results = await client.search(
-                body=q,
-                index=self.index_name,
-                headers=client_config.get("extra_headers"),
-            )
+            async with self.client_pool.client(client_config) as client:
+                if page_token is None and self.pit_keep_alive is not None:
+                    pit_id = (
+                        await client.create_pit(
+                            index=self.index_name,
+                            params={"keep_alive": keep_alive},
+                            headers=headers,
+                        )
+                    )["pit_id"]
+
+                if pit_id is not None:
+                    ## The index is part of the point in time
+                    q["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+                    try:
+                        results = await client.search(body=q, headers=headers)
+                    except BaseException:
+                        ## Nobody gets a page token for a point in time created
+                        ## here, so it would only be left to expire
+                        if page_token is None:
+                            await asyncio.shield(
+                                self._delete_pit(client, pit_id, headers)
+                            )
+                        raise
+                    pit_id = results.get("pit_id", pit_id)
+                    if len(results["hits"]["hits"]) < page_size:
+                        ## Last page, otherwise the point in time expires on its own
+                        await self._delete_pit(client, pit_id, headers)
+                        pit_id = None
+                else:
+                    results = await client.search(
+                        body=q, index=self.index_name, headers=headers
+                    )
         # Don't want to turn all connection exceptions to something visible to the end user
         # to not expose implementation details and things that might be secret
         except opensearchpy.AuthenticationException as e:
@@ -186,6 +659,8 @@ class OpenSearchSS40Proxy(proxy.Proxy):
         except opensearchpy.ConnectionTimeout as e:
             raise_error_from_transport_error(e, 500)
         except opensearchpy.NotFoundError as e:
+            if pit_id is not None and _is_search_context_missing(e):
+                raise ExpiredPageTokenException()
             # At least for now a non-existent index is considered empty
             if e.error == "index_not_found_exception":
                 # TODO: do we to put these hardcoded things in here just to keep the format consistent?
@@ -201,26 +676,32 @@ class OpenSearchSS40Proxy(proxy.Proxy):
                 }
             else:
                 raise_error_from_transport_error(e, 404)
-        finally:
-            await client.close()
 
         ## There should be a more clever way of doing this, but
         ## we cannot rely on results['hits']['total']['value'], since
         ## it does not take search_after into account
         if len(results["hits"]["hits"]) == page_size:
-            # next_page_token = \
-            #    (last_hit["_source"]["traceId"]+'__'+last_hit["_source"]["spanId"]).encode('ascii')
-            next_page_token = results["hits"]["hits"][-1]["_source"][
-                "startTime"
-            ].encode("ascii")
+            ## The sort values as returned by OpenSearch, so that search_after
+            ## compares exactly (startTime as an integer epoch timestamp)
+            next_page_token = _encode_page_token(
+                results["hits"]["hits"][-1]["sort"], pit_id
+            )
         else:
             next_page_token = None
 
         yield ss4o.SS4OSpanCollection(results)
 
         if next_page_token is not None:
-            yield proxy.PageToken(next_page_token)
+            yield next_page_token
+
+    async def _delete_pit(
+        self, client: AsyncOpenSearch, pit_id: str, headers: Any
+    ) -> None:
+        try:
+            await client.delete_pit(body={"pit_id": [pit_id]}, headers=headers)
+        except opensearchpy.TransportError:
+            logger.exception("Failed to delete OpenSearch point in time")
 
     @override
     async def aclose(self) -> None:
-        pass
+        await self.client_pool.aclose()
@@ -1,5 +1,6 @@
 import asyncio
-from collections.abc import Iterator
+from bisect import bisect_left
+from collections.abc import Callable, Hashable, Iterator, Mapping
 from dataclasses import dataclass
 from datetime import timedelta
 from typing import (
@@ -13,7 +14,11 @@ from typing import (
     Dict,
     override,
 )
+from functools import wraps
 from itertools import chain, groupby
+from sys import intern
+import os
+import weakref
 
 import opentelemetry_betterproto.opentelemetry.proto.common.v1 as common
 from eoepca_api_utils.exceptions import APIException
@@ -28,6 +33,15 @@ class InvalidPageTokenException(APIException):
         )
 
 
+class ExpiredPageTokenException(APIException):
+    def __init__(self) -> None:
+        super().__init__(
+            status="410",
+            title="Page token has expired",
+            detail="The results this page token refers to are no longer available, restart the query without a page token.",
+        )
+
+
 class DumpIterator[T](Iterator[T]):
     iterator: Iterator[T]
 
@@ -164,8 +178,29 @@ def to_kv_list_iter(jsdict: JSONLikeDictIter) -> JSONLikeListIter:
     )
 
 
+def to_otlp_any_value(jval: JSONLike) -> JSONLikeDict:
+    """
+    Same as forcing to_otlp_any_value_iter, but builds the dicts directly
+    """
+    ## Bool must be before int
+    if isinstance(jval, bool):
+        return {"boolValue": jval}
+    elif isinstance(jval, int):
+        return {"intValue": str(jval)}
+    elif isinstance(jval, str):
+        return {"stringValue": jval}
+    elif isinstance(jval, float):
+        return {"doubleValue": jval}
+    elif isinstance(jval, dict):
+        return {"kvlistValue": to_kv_list(jval)}
+    elif isinstance(jval, list):
+        return {"arrayValue": {"values": [to_otlp_any_value(x) for x in jval]}}
+    else:
+        raise TypeError(f"Unexpected anytype {type(jval)}")
+
+
 def to_kv_list(jsobj: JSONLikeDict) -> JSONLikeList:
-    return force_jsonlike_list_iter(to_kv_list_iter(iter_jsonlike_dict(jsobj)))
+    return [{"key": k, "value": to_otlp_any_value(v)} for k, v in jsobj.items()]
 
 
 def from_otlp_any_value_iter(jsobj: JSONLikeDictIter) -> JSONLikeIter:
@@ -264,6 +299,9 @@ def force_jsonlike_iter(jobj: JSONLikeIter) -> JSONLike:
         return force_jsonlike_dict_iter(jobj)
     elif isinstance(jobj, JSONLikeListIter):
         return force_jsonlike_list_iter(jobj)
+    elif isinstance(jobj, dict) or isinstance(jobj, list):
+        ## Already forced, e.g. the spans of base.DirectJSONSpanCollection
+        return jobj
     else:
         raise TypeError(f"Expected JSONLikeIter, got {type(jobj)}")
 
@@ -297,7 +335,39 @@ def iter_jsonlike_list(jobj: JSONLikeList) -> JSONLikeListIter:
 
 
 def iter_jsonlike_dict(jobj: JSONLikeDict) -> JSONLikeDictIter:
-    return JSONLikeDictIter((k, iter_jsonlike(v)) for k, v in jobj.items())
+    return JSONLikeDictIter((intern(k), iter_jsonlike(v)) for k, v in jobj.items())
+
+
+def intern_keys(jobj: JSONLikeDict) -> JSONLikeDict:
+    """
+    jobj with all (nested) dict keys interned, so that the keys repeated across
+    spans (e.g. attribute names) are only kept in memory once
+    """
+    return {
+        intern(k): intern_keys(v) if isinstance(v, dict) else v for k, v in jobj.items()
+    }
+
+
+class Interner[T]:
+    """
+    Deduplicates equal (but possibly unhashable) values, identified by key(value).
+    Values are only referenced weakly, so they must support weak references.
+    Shared values must not be modified.
+    """
+
+    def __init__(self, key: Callable[[T], Hashable]):
+        self._key = key
+        self._values: weakref.WeakValueDictionary[Hashable, Any] = (
+            weakref.WeakValueDictionary()
+        )
+
+    def intern(self, value: T) -> T:
+        key = self._key(value)
+        existing = self._values.get(key)
+        if existing is not None:
+            return existing
+        self._values[key] = value
+        return value
 
 
 def peek_iterator[T](iter: Iterator[T]) -> Optional[Tuple[T, Iterator[T]]]:
@@ -308,6 +378,38 @@ def peek_iterator[T](iter: Iterator[T]) -> Optional[Tuple[T, Iterator[T]]]:
         return None
 
 
+_memoise = os.environ.get("RH_TELEMETRY_MEMOISE", "").lower() not in ("", "0", "false")
+
+
+def set_memoise(enabled: bool) -> None:
+    global _memoise
+    _memoise = enabled
+
+
+def memoised[S, T](f: Callable[[S], T]) -> Callable[[S], T]:
+    """
+    For the getters of the properties of lazy wrappers (OTLPProtoSpan etc.) that
+    compute their value, e.g. hex encode an id, on every access. When enabled
+    (with set_memoise or $RH_TELEMETRY_MEMOISE), the value is cached on the instance
+    on first access. Disabled by default, as the cached values go stale if the
+    wrapped object is modified.
+    """
+    key = f"_memo_{f.__name__}"
+
+    @wraps(f)
+    def get(self: S) -> T:
+        if not _memoise:
+            return f(self)
+        memo = self.__dict__
+        try:
+            return memo[key]
+        except KeyError:
+            value = memo[key] = f(self)
+            return value
+
+    return get
+
+
 def _normalise_attributes_shallow_any(jobj: JSONLikeIter) -> JSONLikeIter:
     if (
         isinstance(jobj, int)
@@ -378,22 +480,98 @@ type AttributesFilter = dict[str, Optional[list[str | int | float | bool]]]
 """If some key is None, that means the key must exist, and the value can be anything"""
 
 
+_MISSING = object()
+
+
+def _dotted_key_paths(
+    key: str, tree: Mapping[str, Any], dots: Optional[List[int]] = None
+) -> Iterator[Tuple[Tuple[str, ...], Any]]:
+    """
+    The ways a dotted key is stored in the nested dict tree, e.g. 'a.b' can be stored
+    as { 'a.b' : v } or { 'a' : { 'b' : v }}, with the value stored there. At every
+    level the longest part of the key present in tree is tried first.
+
+    Only the keys present in tree are followed, so this takes time linear in the
+    size of tree (times the length of key) rather than in the 2^(dots) possible paths.
+    dots are the positions of the dots in key, if already known.
+    """
+    if dots is None:
+        dots = [i for i, c in enumerate(key) if c == "."]
+    ends = dots + [len(key)]
+
+    def inner(
+        node: Mapping[str, Any], start: int, path: Tuple[str, ...]
+    ) -> Iterator[Tuple[Tuple[str, ...], Any]]:
+        first = bisect_left(ends, start)
+        if len(node) < len(ends) - first:
+            ## Cheaper to look at the keys present than at all the possible parts
+            candidates = sorted(
+                (
+                    start + len(k)
+                    for k in node
+                    if key.startswith(k, start)
+                    and (start + len(k) == len(key) or key[start + len(k)] == ".")
+                ),
+                reverse=True,
+            )
+        else:
+            candidates = ends[first:][::-1]
+        for end in candidates:
+            part = key[start:end]
+            if part not in node:
+                continue
+            if end == len(key):
+                yield (path + (part,), node[part])
+            elif isinstance(node[part], dict):
+                yield from inner(node[part], end + 1, path + (part,))
+
+    return inner(tree, 0, ())
+
+
+class CompiledAttributesFilter:
+    """
+    An AttributesFilter prepared once for matching against many (possibly nested)
+    attribute dictionaries, without first flattening them.
+    """
+
+    __slots__ = ("_conditions",)
+
+    def __init__(self, expected_attributes: Optional[AttributesFilter]) -> None:
+        ## (key, positions of the dots in key, accepted values)
+        self._conditions: List[Tuple[str, List[int], Optional[frozenset]]] = [
+            (
+                k,
+                [i for i, c in enumerate(k) if c == "."],
+                None if vs is None else frozenset(vs),
+            )
+            for k, vs in (expected_attributes or {}).items()
+        ]
+
+    def __bool__(self) -> bool:
+        return bool(self._conditions)
+
+    def __call__(self, actual_attributes: JSONLikeDict) -> bool:
+        for key, dots, values in self._conditions:
+            ## The first path that exists decides
+            _, value = next(
+                _dotted_key_paths(key, actual_attributes, dots), (None, _MISSING)
+            )
+            if value is _MISSING:
+                return False
+            if values is not None and (
+                isinstance(value, (dict, list)) or value not in values
+            ):
+                return False
+
+        return True
+
+
 def match_attributes(
     actual_attributes: JSONLikeDict,
     # spell out the type to avoid circular imports
     expected_attributes: Optional[AttributesFilter],
 ) -> bool:
-    if expected_attributes is None:
-        return True
-
-    normalized_attributes = dict(
-        normalise_attributes_shallow_iter(iter_jsonlike_dict(actual_attributes))
-    )
-
-    return all(
-        k in normalized_attributes and (vs is None or normalized_attributes[k] in vs)
-        for k, vs in expected_attributes.items()
-    )
+    return CompiledAttributesFilter(expected_attributes)(actual_attributes)
 
 
 @dataclass
@@ -0,0 +1,216 @@
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
+from typing import Any, BinaryIO, TextIO, override
+import json
+import os
+
+from . import JSONLike, JSONLikeDictIter, JSONLikeIter, JSONLikeListIter
+
+
+class OTLPJSONEncoder(json.JSONEncoder):
+    ## TODO: Is there a better way to do this (without forcing the dict)?
+    @override
+    def default(self, o):
+        if isinstance(o, JSONLikeDictIter):
+            return {k: v for k, v in iter(o)}
+        else:
+            return super().default(o)
+
+
+def _force(o: Any) -> Any:
+    """
+    Like force_jsonlike_iter, but also accepts (and recurses into) ordinary dicts and lists
+    """
+    if isinstance(o, JSONLikeDictIter):
+        return {k: _force(v) for k, v in o}
+    elif isinstance(o, (JSONLikeListIter, list)):
+        return [_force(x) for x in o]
+    elif isinstance(o, dict):
+        return {k: _force(v) for k, v in o.items()}
+    else:
+        return o
+
+
+class JSONCodec(ABC):
+    name: str
+
+    @abstractmethod
+    def loads(self, s: str | bytes) -> JSONLike:
+        pass
+
+    def load(self, fp: TextIO | BinaryIO) -> JSONLike:
+        return self.loads(fp.read())
+
+    @abstractmethod
+    def dumps(self, o: JSONLike) -> str:
+        pass
+
+    ## Levels of JSONLike*Iter that are encoded incrementally before falling back
+    ## to encoding the (forced) value in one go. For span collections this means
+    ## one span at a time.
+    stream_depth = 6
+
+    def iterencode(self, o: JSONLikeIter) -> Iterator[str]:
+        def inner(o: Any, depth: int) -> Iterator[str]:
+            if depth > 0 and isinstance(o, JSONLikeDictIter):
+                separator = "{"
+                for k, v in o:
+                    yield separator + self.dumps(k) + ":"
+                    yield from inner(v, depth - 1)
+                    separator = ","
+                yield "}" if separator == "," else "{}"
+            elif depth > 0 and isinstance(o, JSONLikeListIter):
+                separator = "["
+                for x in o:
+                    yield separator
+                    yield from inner(x, depth - 1)
+                    separator = ","
+                yield "]" if separator == "," else "[]"
+            else:
+                yield self.dumps(_force(o))
+
+        return inner(o, self.stream_depth)
+
+    ## The separators dumps puts between items and after keys
+    item_separator = ","
+    key_separator = ":"
+
+    def iterencode_shallow(self, o: JSONLikeIter) -> Iterator[str]:
+        """
+        Same output as iterencode, for values with JSONLike*Iter only at the top
+        levels, e.g. the span collections of base.DirectJSONSpanCollection, whose
+        spans are plain dicts: those are encoded with dumps in one go, unforced.
+        """
+
+        def inner(o: Any) -> Iterator[str]:
+            if isinstance(o, JSONLikeDictIter):
+                separator = "{"
+                for k, v in o:
+                    yield separator + self.dumps(k) + self.key_separator
+                    yield from inner(v)
+                    separator = self.item_separator
+                yield "{}" if separator == "{" else "}"
+            elif isinstance(o, JSONLikeListIter):
+                separator = "["
+                for x in o:
+                    yield separator
+                    yield from inner(x)
+                    separator = self.item_separator
+                yield "[]" if separator == "[" else "]"
+            else:
+                yield self.dumps(o)
+
+        return inner(o)
+
+
+class StdlibJSONCodec(JSONCodec):
+    name = "stdlib"
+    item_separator = ", "
+    key_separator = ": "
+
+    @override
+    def loads(self, s: str | bytes) -> JSONLike:
+        return json.loads(s)
+
+    @override
+    def load(self, fp: TextIO | BinaryIO) -> JSONLike:
+        return json.load(fp)
+
+    @override
+    def dumps(self, o: JSONLike) -> str:
+        return json.dumps(o)
+
+    @override
+    def iterencode(self, o: JSONLikeIter) -> Iterator[str]:
+        return OTLPJSONEncoder().iterencode(o)
+
+
+class OrjsonJSONCodec(JSONCodec):
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._orjson = orjson
+
+    @override
+    def loads(self, s: str | bytes) -> JSONLike:
+        return self._orjson.loads(s)
+
+    @override
+    def dumps(self, o: JSONLike) -> str:
+        return self._orjson.dumps(o).decode("utf-8")
+
+
+class MsgspecJSONCodec(JSONCodec):
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        import msgspec.json
+
+        self._decoder = msgspec.json.Decoder()
+        self._encoder = msgspec.json.Encoder(enc_hook=self._enc_hook)
+
+    @staticmethod
+    def _enc_hook(o: Any) -> Any:
+        ## msgspec rejects subclasses of builtin scalars it does not know about,
+        ## such as the (IntEnum-like) betterproto enums
+        for t in (bool, int, float, str):
+            if isinstance(o, t):
+                return t(o)
+        raise NotImplementedError(f"Cannot encode {type(o)}")
+
+    @override
+    def loads(self, s: str | bytes) -> JSONLike:
+        return self._decoder.decode(s)
+
+    @override
+    def dumps(self, o: JSONLike) -> str:
+        return self._encoder.encode(o).decode("utf-8")
+
+
+CODECS: dict[str, Callable[[], JSONCodec]] = {
+    StdlibJSONCodec.name: StdlibJSONCodec,
+    OrjsonJSONCodec.name: OrjsonJSONCodec,
+    MsgspecJSONCodec.name: MsgspecJSONCodec,
+}
+
+## Fastest first
+AUTO_CODEC_PREFERENCE = ["orjson", "msgspec", "stdlib"]
+
+
+def make_codec(name: str) -> JSONCodec:
+    """
+    name is one of CODECS, or 'auto' for the fastest one that is installed
+    """
+    if name == "auto":
+        for candidate in AUTO_CODEC_PREFERENCE:
+            try:
+                return CODECS[candidate]()
+            except ImportError:
+                pass
+    if name not in CODECS:
+        raise ValueError(
+            f"Unknown JSON codec '{name}', expected one of auto, {', '.join(CODECS)}"
+        )
+    return CODECS[name]()
+
+
+_codec: JSONCodec | None = None
+
+
+def get_codec() -> JSONCodec:
+    """
+    The codec used for loading and encoding (OTLP-)JSON throughout the library.
+    Defaults to $RH_TELEMETRY_JSON_CODEC, or else the standard library json module,
+    whose output is byte-for-byte identical to json.dumps.
+    """
+    global _codec
+    if _codec is None:
+        _codec = make_codec(os.environ.get("RH_TELEMETRY_JSON_CODEC") or "stdlib")
+    return _codec
+
+
+def set_codec(codec: str | JSONCodec) -> None:
+    global _codec
+    _codec = make_codec(codec) if isinstance(codec, str) else codec
@@ -0,0 +1,201 @@
+import asyncio
+import base64
+import json
+from collections.abc import AsyncIterator, Iterator
+from typing import Any
+
+from fastapi.testclient import TestClient
+from pytest import fixture, mark, raises
+
+import python_opentelemetry_access.api as api
+import python_opentelemetry_access.otlpjson as otlpjson
+from python_opentelemetry_access.proxy import MockProxy, PageToken, Proxy
+
+BASE_URL = "http://localhost:12345"
+
+
+def _spans() -> Any:
+    with open("tests/examples/ex2.json", "r") as f:
+        return otlpjson.load(f)
+
+
+class _FailingSpanCollection:
+    """Fails after part of the span collection was encoded"""
+
+    def __init__(self, spans: Any):
+        self._spans = spans
+
+    def to_otlp_json_str_iter(self) -> Iterator[str]:
+        yield from list(self._spans.to_otlp_json_str_iter())[:3]
+        raise RuntimeError("Lost the connection to the backend")
+
+    def to_otlp_json_dict(self) -> Any:
+        raise RuntimeError("Lost the connection to the backend")
+
+
+class _FailingProxy(Proxy):
+    async def query_spans_page(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        spans = _spans()
+        yield spans
+        yield _FailingSpanCollection(spans)
+        yield PageToken(b"next")
+
+    async def aclose(self) -> None:
+        pass
+
+
+@fixture
+def client() -> Iterator[TestClient]:
+    saved = api.settings
+    api.settings = api.Settings(
+        _proxy=MockProxy(_spans(), default_page_size=2), _base_url=BASE_URL
+    )
+    yield TestClient(api.wrapped_app)
+    api.settings = saved
+
+
+@mark.parametrize(
+    "url",
+    [
+        "/v1/spans",
+        "/v1/spans?page_size=1",
+        "/v1/spans?span_attributes=string_span_attr",
+        "/v1/spans?verbosity=summary",
+        "/v1/spans/697777f078628bc35093f4f376dfa62d",
+    ],
+)
+def test_streaming_response_same_as_non_streaming(client: TestClient, url: str):
+    ## Follows the next links, to also compare the page tokens
+    while url is not None:
+        api.settings.streaming_responses = False
+        expected = client.get(url)
+        api.settings.streaming_responses = True
+        streamed = client.get(url)
+
+        assert expected.status_code == streamed.status_code == 200
+        assert streamed.headers["content-type"] == expected.headers["content-type"]
+        assert streamed.headers["allow"] == expected.headers["allow"] == "GET"
+        assert json.loads(streamed.content) == json.loads(expected.content)
+
+        url = expected.json()["links"].get("next")
+
+
+def test_streaming_error_before_response(client: TestClient):
+    api.settings.streaming_responses = True
+    response = client.get("/v1/spans?page_token=not-base64!")
+    assert response.status_code == 400
+    assert "errors" in response.json()
+
+
+def test_streaming_failure_midway(client: TestClient):
+    api.settings._proxy = _FailingProxy()
+    api.settings.streaming_responses = True
+
+    response = client.get("/v1/spans")
+    assert response.status_code == 200
+    body = json.loads(response.content)
+    ## Only the span collection that was encoded completely, and no next page
+    assert body["data"] == [
+        {
+            "id": None,
+            "type": "resourceSpans",
+            "attributes": _spans().to_otlp_json_dict(),
+        }
+    ]
+    assert "errors" not in body
+    assert body["links"].get("next") is None
+    assert body["meta"] == {
+        "page": {"next_page_token": None},
+        "error": api.STREAMING_ERROR.model_dump(),
+    }
+
+
+class _SlowProxy(Proxy):
+    """
+    Page tokens are "<delay>:<name>". Each page sleeps for the delay and then
+    returns the name and the next page token.
+    """
+
+    def __init__(self) -> None:
+        self.running = 0
+        self.max_running = 0
+        self.cancelled: list[str] = []
+
+    async def query_spans_page(
+        self, *args: Any, page_token: PageToken | None = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        assert page_token is not None
+        delay, name = page_token.token.decode("ascii").split(":")
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            if name == "fail":
+                raise RuntimeError("Page query failed")
+            await asyncio.sleep(float(delay))
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+        finally:
+            self.running -= 1
+        yield name
+        yield PageToken(f"{delay}:{name}-next".encode("ascii"))
+
+    async def aclose(self) -> None:
+        pass
+
+
+def _page_token(*parts: str) -> str:
+    return ".".join(base64.b64encode(part.encode("ascii")).decode() for part in parts)
+
+
+@fixture
+def slow_proxy() -> Iterator[_SlowProxy]:
+    saved = api.settings
+    proxy = _SlowProxy()
+    api.settings = api.Settings(_proxy=proxy, _base_url=BASE_URL)
+    yield proxy
+    api.settings = saved
+
+
+async def _query_pages(page_token: str) -> list[Any]:
+    return [
+        res
+        async for res in api._query_pages(
+            None, None, api.QueryParams(page_token=page_token)
+        )
+    ]
+
+
+@mark.asyncio
+async def test_page_token_parts_in_order(slow_proxy: _SlowProxy):
+    ## Finish in the reverse order
+    results = await _query_pages(_page_token("0.03:a", "0.02:b", "0.01:c", "0:d"))
+
+    assert [res for res in results if isinstance(res, str)] == ["a", "b", "c", "d"]
+    assert [res.token for res in results if isinstance(res, PageToken)] == [
+        b"0.03:a-next",
+        b"0.02:b-next",
+        b"0.01:c-next",
+        b"0:d-next",
+    ]
+    assert slow_proxy.max_running == 4
+
+
+@mark.asyncio
+async def test_page_token_parts_concurrency_limit(slow_proxy: _SlowProxy):
+    api.settings.max_concurrent_page_queries = 2
+    results = await _query_pages(_page_token(*(f"0.01:{i}" for i in range(6))))
+
+    assert [res for res in results if isinstance(res, str)] == [
+        str(i) for i in range(6)
+    ]
+    assert slow_proxy.max_running == 2
+
+
+@mark.asyncio
+async def test_page_token_parts_failure_cancels_others(slow_proxy: _SlowProxy):
+    with raises(RuntimeError):
+        await _query_pages(_page_token("10:a", "0:fail", "10:b"))
+
+    assert sorted(slow_proxy.cancelled) == ["a", "b"]
+    assert slow_proxy.running == 0
@@ -0,0 +1,83 @@
+import io
+from typing import no_type_check
+
+from click.testing import CliRunner
+
+import python_opentelemetry_access.cli as cli
+import python_opentelemetry_access.otlpjson as otlpjson
+import python_opentelemetry_access.otlpproto as otlpproto
+import python_opentelemetry_access.opensearch.ss4o as ss4o
+
+from pytest import importorskip, mark, raises
+
+pa = importorskip("pyarrow")
+pq = importorskip("pyarrow.parquet")
+arrow = importorskip("python_opentelemetry_access.arrow")
+
+
+@no_type_check
+@mark.parametrize(
+    "path, loader, mode",
+    [
+        ("tests/examples/ex1.json", otlpjson.load, "r"),
+        ("tests/examples/ex2.json", otlpjson.load, "r"),
+        ("tests/examples/flattening.json", otlpjson.load, "r"),
+        ("tests/examples/ex2.binpb", otlpproto.load, "rb"),
+        ("tests/examples/ex2_ss4o_bare.json", ss4o.load_bare, "r"),
+    ],
+)
+@mark.parametrize("rows_per_batch", [1, arrow.DEFAULT_ROWS_PER_BATCH])
+def test_roundtrip(path: str, loader, mode: str, rows_per_batch: int):
+    with open(path, mode) as f:
+        expected = loader(f).to_reified()
+
+    for dump, load in [
+        (arrow.dump_parquet, arrow.load_parquet),
+        (arrow.dump_ipc, arrow.load_ipc),
+    ]:
+        out = io.BytesIO()
+        dump(expected, out, rows_per_batch=rows_per_batch)
+        assert load(io.BytesIO(out.getvalue())) == expected
+
+
+@no_type_check
+def test_pandas_roundtrip():
+    pd = importorskip("pandas")
+    with open("tests/examples/ex2.json", "r") as f:
+        expected = otlpjson.load(f).to_reified()
+
+    out = io.BytesIO()
+    arrow.dump_parquet(expected, out)
+    df = pd.read_parquet(io.BytesIO(out.getvalue()))
+    assert len(df) == len(list(expected.iter_spans()))
+    assert str(df["start_time"].dtype) == "datetime64[ns, UTC]"
+
+    ## Written back by pandas, with its own index and encodings
+    resaved = io.BytesIO()
+    df.to_parquet(resaved)
+    assert arrow.loads_parquet(resaved.getvalue()) == expected
+
+
+def test_not_a_span_table():
+    out = io.BytesIO()
+    pq.write_table(pa.table({"a": [1]}), out)
+    with raises(ValueError):
+        arrow.loads_parquet(out.getvalue())
+
+
+@no_type_check
+@mark.parametrize("fmt", ["parquet", "arrow-ipc"])
+def test_cli_roundtrip(fmt: str, tmp_path):
+    out_path = tmp_path / ("out" + cli.OUT_FORMAT_EXTENSIONS[fmt])
+    back_path = tmp_path / "back.json"
+    for args in [
+        ["--from=otlp-json", f"--to={fmt}", "tests/examples/ex1.json", str(out_path)],
+        [f"--from={fmt}", "--to=otlp-json", str(out_path), str(back_path)],
+    ]:
+        result = CliRunner().invoke(cli.cli, ["convert", *args])
+        assert result.exit_code == 0
+
+    with open("tests/examples/ex1.json", "r") as f:
+        expected = otlpjson.load(f).to_reified()
+    with open(back_path, "r") as f:
+        assert otlpjson.load(f).to_reified() == expected
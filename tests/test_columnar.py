@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta, timezone
+from typing import no_type_check
+
+import numpy as np
+
+import python_opentelemetry_access.base as base
+import python_opentelemetry_access.otlpjson as otlpjson
+import python_opentelemetry_access.otlpproto as otlpproto
+import python_opentelemetry_access.opensearch.ss4o as ss4o
+from python_opentelemetry_access.columnar import SpanBatch
+
+from pytest import mark, raises
+
+
+def _spans(spans: base.SpanCollection) -> list[base.ReifiedSpan]:
+    return [span.to_reified() for _, _, span in spans.iter_spans()]
+
+
+@no_type_check
+@mark.parametrize(
+    "path, loader, mode",
+    [
+        ("tests/examples/ex1.json", otlpjson.load, "r"),
+        ("tests/examples/ex2.json", otlpjson.load, "r"),
+        ("tests/examples/flattening.json", otlpjson.load, "r"),
+        ("tests/examples/ex2.binpb", otlpproto.load, "rb"),
+        ("tests/examples/ex2_ss4o_bare.json", ss4o.load_bare, "r"),
+    ],
+)
+def test_span_batch_roundtrip(path: str, loader, mode: str):
+    with open(path, mode) as f:
+        expected = loader(f).to_reified()
+
+    batch = SpanBatch.from_span_collection(expected)
+    assert len(batch) == len(_spans(expected))
+    assert batch.to_reified() == expected
+    assert _spans(batch) == _spans(expected)
+
+
+def test_span_batch_sort_and_stats():
+    with open("tests/examples/ex2.json", "r") as f:
+        batch = SpanBatch.from_span_collection(otlpjson.load(f))
+
+    by_start = batch.sort_by("start_time")
+    assert np.all(np.diff(by_start.start_time_unix_nano) >= 0)
+
+    by_name = batch.sort_by("name", "duration")
+    names = [span.name for span in _spans(by_name)]
+    assert names == sorted(names)
+
+    stats = batch.duration_stats(percentiles=(50,))
+    assert stats is not None
+    durations = [
+        span.end_time_unix_nano - span.start_time_unix_nano for span in _spans(batch)
+    ]
+    assert stats.count == len(durations)
+    assert stats.min == min(durations)
+    assert stats.max == max(durations)
+    assert stats.percentiles[50] == float(np.median(durations))
+
+    assert batch.filter(np.zeros(len(batch), dtype=bool)).duration_stats() is None
+    assert len(batch.time_mask(datetime.fromtimestamp(0, timezone.utc), None)) == len(
+        batch
+    )
+
+    with raises(ValueError):
+        batch.sort_by("nope")
+
+
+def test_span_batch_time_mask_exact():
+    with open("tests/examples/ex2.json", "r") as f:
+        collection = otlpjson.load(f).to_reified()
+    ## Too many digits for the nanoseconds since the epoch to be exact as floats
+    start = datetime(2025, 10, 17, 12, 34, 56, 123457, timezone.utc)
+    start_unix_nano = 1760704496123457000
+    for _, _, span in collection.iter_spans():
+        span.start_time_unix_nano = start_unix_nano
+        span.end_time_unix_nano = start_unix_nano
+    batch = SpanBatch.from_span_collection(collection)
+    before = start - timedelta(microseconds=1)
+    after = start + timedelta(microseconds=1)
+
+    assert batch.time_mask(start, start).all()
+    assert not batch.time_mask(None, before).any()
+    assert not batch.time_mask(after, None).any()
+    ## Naive datetimes are local time, as for datetime.timestamp
+    assert batch.time_mask(None, start.astimezone().replace(tzinfo=None)).all()
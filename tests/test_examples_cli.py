@@ -1,4 +1,7 @@
-# from pathlib import Path
+from pathlib import Path
+import shutil
+import subprocess
+import sys
 from typing import no_type_check
 
 from click.testing import CliRunner
@@ -9,6 +12,20 @@ import python_opentelemetry_access.cli as cli
 from pytest import mark
 
 
+def test_lazy_imports():
+    ## Only the modules needed by the selected command/format should be imported
+    code = (
+        "import sys, python_opentelemetry_access.cli; "
+        "print(','.join(m for m in ['python_opentelemetry_access.api', 'python_opentelemetry_access.proxy', "
+        "'python_opentelemetry_access.otlpproto', 'python_opentelemetry_access.opensearch.ss4o', 'uvicorn', "
+        "'fastapi', 'opensearchpy', 'pandas', 'pyarrow'] if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == ""
+
+
 def test_list_formats():
     result = CliRunner().invoke(cli.cli, ["list-formats"])
     assert result.exit_code == 0
@@ -55,3 +72,181 @@ def test_example_trace(
         cli.cli, ["convert", "--from=ss4o_bare", f"--to={to}", ss4o_rep_path, "-"]
     )
     assert result.exit_code == 0
+
+
+@no_type_check
+@mark.parametrize(
+    "json_rep_path",
+    [
+        "tests/examples/ex1.json",
+        "tests/examples/ex2.json",
+        "tests/examples/flattening.json",
+    ],
+)
+@mark.parametrize("to", sorted(cli.CONCATENABLE_OUT_FORMATS))
+def test_jsonl_parallel(json_rep_path: str, to: str, tmp_path):
+    jsonl_path = tmp_path / "in.jsonl"
+    result = CliRunner().invoke(
+        cli.cli,
+        [
+            "convert",
+            "--from=otlp-json",
+            "--to=otlp-jsonl",
+            json_rep_path,
+            str(jsonl_path),
+        ],
+    )
+    assert result.exit_code == 0
+    ## Several copies, so that there are more lines than a single batch
+    jsonl_path.write_text(jsonl_path.read_text() * (cli.LINES_PER_TASK + 1))
+
+    outputs = []
+    for jobs in [1, 3]:
+        out_path = tmp_path / f"out_{jobs}"
+        result = CliRunner().invoke(
+            cli.cli,
+            [
+                "convert",
+                "--from=otlp-jsonl",
+                f"--to={to}",
+                f"--jobs={jobs}",
+                str(jsonl_path),
+                str(out_path),
+            ],
+        )
+        assert result.exit_code == 0
+        outputs.append(out_path.read_bytes())
+
+    assert outputs[0] == outputs[1]
+
+
+def test_jobs_unsupported_formats():
+    result = CliRunner().invoke(
+        cli.cli,
+        [
+            "convert",
+            "--from=otlp-json",
+            "--to=otlp-json",
+            "--jobs=2",
+            "tests/examples/ex1.json",
+            "-",
+        ],
+    )
+    assert result.exit_code != 0
+
+
+@no_type_check
+def test_convert_many(tmp_path):
+    json_rep_paths = [
+        "tests/examples/ex1.json",
+        "tests/examples/ex2.json",
+        "tests/examples/flattening.json",
+    ]
+
+    out_dir = tmp_path / "out"
+    result = CliRunner().invoke(
+        cli.cli,
+        [
+            "convert-many",
+            "--from=otlp-json",
+            "--to=otlp-proto",
+            "--jobs=2",
+            f"--output-dir={out_dir}",
+            "tests/examples/ex[12].json",
+            "tests/examples/flattening.json",
+        ],
+    )
+    assert result.exit_code == 0
+    assert sorted(p.name for p in out_dir.iterdir()) == [
+        "ex1.binpb",
+        "ex2.binpb",
+        "flattening.binpb",
+    ]
+
+    merged_path = tmp_path / "merged.jsonl"
+    result = CliRunner().invoke(
+        cli.cli,
+        [
+            "convert-many",
+            "--from=otlp-json",
+            "--to=otlp-jsonl",
+            "--jobs=2",
+            f"--merge={merged_path}",
+            *json_rep_paths,
+        ],
+    )
+    assert result.exit_code == 0
+
+    expected = ""
+    for json_rep_path in json_rep_paths:
+        single_path = tmp_path / "single.jsonl"
+        result = CliRunner().invoke(
+            cli.cli,
+            [
+                "convert",
+                "--from=otlp-json",
+                "--to=otlp-jsonl",
+                json_rep_path,
+                str(single_path),
+            ],
+        )
+        assert result.exit_code == 0
+        expected += single_path.read_text()
+    assert merged_path.read_text() == expected
+
+
+@no_type_check
+def test_convert_many_directory(tmp_path):
+    in_dir = tmp_path / "in"
+    (in_dir / "nested").mkdir(parents=True)
+    (in_dir / ".hidden").mkdir()
+    for path in ["a.json", "nested/b.json", ".c.json", ".hidden/d.json"]:
+        (in_dir / path).write_text(Path("tests/examples/ex1.json").read_text())
+    (in_dir / "notes.txt").write_text("not telemetry")
+
+    for extra_args, expected in [
+        ([], ["a.binpb", "b.binpb"]),
+        (["--glob=a.*"], ["a.binpb"]),
+    ]:
+        out_dir = tmp_path / "out"
+        shutil.rmtree(out_dir, ignore_errors=True)
+        result = CliRunner().invoke(
+            cli.cli,
+            [
+                "convert-many",
+                "--from=otlp-json",
+                "--to=otlp-proto",
+                f"--output-dir={out_dir}",
+                *extra_args,
+                str(in_dir),
+            ],
+        )
+        assert result.exit_code == 0
+        ## Hidden files and other formats are skipped
+        assert sorted(p.name for p in out_dir.iterdir()) == expected
+
+
+def test_convert_many_failures(tmp_path):
+    result = CliRunner().invoke(
+        cli.cli,
+        [
+            "convert-many",
+            "--from=otlp-json",
+            "--to=otlp-proto",
+            f"--output-dir={tmp_path}",
+            "tests/examples/ex1.binpb",
+        ],
+    )
+    assert result.exit_code != 0
+
+    result = CliRunner().invoke(
+        cli.cli,
+        [
+            "convert-many",
+            "--from=otlp-json",
+            "--to=otlp-json",
+            f"--merge={tmp_path / 'merged.json'}",
+            "tests/examples/ex1.json",
+        ],
+    )
+    assert result.exit_code != 0
@@ -1,9 +1,14 @@
-from dataclasses import dataclass
-from datetime import datetime
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
 
-from pytest import mark
+from pytest import mark, raises
 from python_opentelemetry_access import otlpjson, util
-from python_opentelemetry_access.proxy import _filter_span_collection
+from python_opentelemetry_access.columnar import SpanBatch
+from python_opentelemetry_access.proxy import (
+    MockProxy,
+    PageToken,
+    _filter_span_collection,
+)
 
 
 @dataclass
@@ -19,56 +24,83 @@ class Params:
     page_size: int | None = None
 
 
-@mark.parametrize(
-    "params",
-    [
-        Params(
-            expected_spans=["res1_scope1_trace1_span1", "res1_scope2_trace1_span1"],
-            span_name="some_span1",
-        ),
-        Params(
-            expected_spans=["res1_scope1_trace1_span1", "res1_scope2_trace1_span1"],
-            resource_attributes={
-                "int_resource_attr": [100],
-                "string_resource_attr": None,
-            },
-            span_attributes={"string_span_attr": ["span string 1"]},
-        ),
-        Params(
-            expected_spans=[],
-            resource_attributes={
-                "int_resource_attr": [100],
-                "string_resource_attr_typo": None,
-            },
-            span_attributes={"string_span_attr": ["span string 1"]},
-        ),
-        Params(
-            expected_spans=["res1_scope1_trace1_span1", "res1_scope2_trace1_span1"],
-            resource_attributes={"int_resource_attr": [100]},
-            span_attributes={"string_span_attr": ["span string 1"]},
-        ),
-        Params(
-            expected_spans=[
-                "res1_scope1_trace1_span1",
-                "res1_scope1_trace1_span2",
-                "res2_scope1_trace1_span1",
-            ],
-            resource_attributes={
-                "int_resource_attr": [100, 200],
-                "string_resource_attr": ["resource string 1", "resource string 2"],
-            },
-            scope_attributes={"string_scope_attr": ["scope string 1"]},
-        ),
-        Params(
-            expected_spans=[],
-            resource_attributes={"string_resource_attr": ["invalid_value"]},
-        ),
-        Params(
-            expected_spans=[],
-            span_attributes={"invalid_attribute": ["span string 2"]},
-        ),
-    ],
-)
+PARAMS = [
+    Params(
+        expected_spans=["res1_scope1_trace1_span1", "res1_scope2_trace1_span1"],
+        span_name="some_span1",
+    ),
+    Params(
+        expected_spans=["res1_scope1_trace1_span1", "res1_scope2_trace1_span1"],
+        resource_attributes={
+            "int_resource_attr": [100],
+            "string_resource_attr": None,
+        },
+        span_attributes={"string_span_attr": ["span string 1"]},
+    ),
+    Params(
+        expected_spans=[],
+        resource_attributes={
+            "int_resource_attr": [100],
+            "string_resource_attr_typo": None,
+        },
+        span_attributes={"string_span_attr": ["span string 1"]},
+    ),
+    Params(
+        expected_spans=["res1_scope1_trace1_span1", "res1_scope2_trace1_span1"],
+        resource_attributes={"int_resource_attr": [100]},
+        span_attributes={"string_span_attr": ["span string 1"]},
+    ),
+    Params(
+        expected_spans=[
+            "res1_scope1_trace1_span1",
+            "res1_scope1_trace1_span2",
+            "res2_scope1_trace1_span1",
+        ],
+        resource_attributes={
+            "int_resource_attr": [100, 200],
+            "string_resource_attr": ["resource string 1", "resource string 2"],
+        },
+        scope_attributes={"string_scope_attr": ["scope string 1"]},
+    ),
+    Params(
+        expected_spans=[],
+        resource_attributes={"string_resource_attr": ["invalid_value"]},
+    ),
+    Params(
+        expected_spans=[],
+        span_attributes={"invalid_attribute": ["span string 2"]},
+    ),
+    Params(
+        expected_spans=["res1_scope1_trace1_span1", "res1_scope1_trace1_span2"],
+        span_ids=[("res1_scope1_trace1", None)],
+    ),
+    Params(
+        expected_spans=["res1_scope1_trace1_span1", "res1_scope2_trace1_span2"],
+        span_ids=[
+            ("res1_scope1_trace1", "res1_scope1_trace1_span1"),
+            ("res1_scope2_trace1", "res1_scope2_trace1_span2"),
+            ("res1_scope2_trace1", "no_such_span"),
+        ],
+    ),
+    Params(
+        expected_spans=["res2_scope1_trace1_span1"],
+        span_ids=[("res2_scope1_trace1", None)],
+        span_name="some_span3",
+        from_time=datetime(2024, 10, 1, tzinfo=timezone.utc),
+        to_time=datetime(2024, 11, 1, tzinfo=timezone.utc),
+    ),
+    Params(
+        expected_spans=[],
+        to_time=datetime(2024, 10, 1, tzinfo=timezone.utc),
+    ),
+    Params(
+        expected_spans=[],
+        from_time=datetime(2024, 11, 1, tzinfo=timezone.utc),
+    ),
+]
+
+
+@mark.parametrize("params", PARAMS)
 def test_filtering(params: Params) -> None:
     filtered_spans = _filter_span_collection(
         otlpjson.loado(_get_spans()).to_reified(),
@@ -91,6 +123,225 @@ def test_filtering(params: Params) -> None:
     assert span_ids == set(params.expected_spans)
 
 
+@mark.parametrize("params", PARAMS)
+def test_span_batch_filtering(params: Params) -> None:
+    batch = SpanBatch.from_span_collection(otlpjson.loado(_get_spans()))
+    mask = batch.time_mask(params.from_time, params.to_time) & batch.attributes_mask(
+        params.span_attributes
+    )
+    if params.span_ids is not None:
+        mask &= batch.span_ids_mask(params.span_ids)
+    if params.span_name is not None:
+        mask &= batch.name_mask(params.span_name)
+    ## Resource and scope attributes are matched per group, not per span
+    resource_filter = util.CompiledAttributesFilter(params.resource_attributes)
+    scope_filter = util.CompiledAttributesFilter(params.scope_attributes)
+    mask &= [
+        resource_filter(batch.resource_spans[r][0].attributes)
+        and scope_filter(batch.scope_spans[s][0].attributes)
+        for r, s in zip(batch.resource_spans_index, batch.scope_spans_index)
+    ]
+
+    span_ids = set(
+        span.to_reified().span_id for _, _, span in batch.filter(mask).iter_spans()
+    )
+    assert span_ids == set(params.expected_spans)
+
+
+@mark.parametrize(
+    "expected_attributes, matches",
+    [
+        (None, True),
+        ({}, True),
+        ({"http.method": None}, True),
+        ({"http.method": ["GET", "POST"]}, True),
+        ({"http.method": ["PUT"]}, False),
+        ({"http.status_code": [200]}, True),
+        ({"service.name": ["svc"]}, True),
+        ({"k8s.pod.name": ["pod-1"]}, True),
+        ({"k8s.pod.uid": None}, False),
+        ({"name": ["pod-1"]}, False),
+        ({"tags": ["a"]}, False),
+        ({"tags": None}, True),
+        ({"http.method": None, "service.name": ["other"]}, False),
+    ],
+)
+def test_compiled_attributes_filter(
+    expected_attributes: util.AttributesFilter | None, matches: bool
+) -> None:
+    attributes: util.JSONLikeDict = {
+        "http.method": "GET",
+        "http": {"status_code": 200},
+        "service": {"name": "svc"},
+        "k8s": {"pod.name": "pod-1"},
+        "tags": ["a", "b"],
+    }
+
+    compiled = util.CompiledAttributesFilter(expected_attributes)
+    assert compiled(attributes) == matches
+    assert util.match_attributes(attributes, expected_attributes) == matches
+
+
+def test_compiled_attributes_filter_dotted_keys() -> None:
+    ## Backtracks when the longest part present leads nowhere
+    attributes: util.JSONLikeDict = {"a.b": {"x": 1}, "a": {"b": {"c": 2}}}
+    assert util.match_attributes(attributes, {"a.b.c": [2]})
+    assert util.match_attributes(attributes, {"a.b.x": [1]})
+
+    ## Only the parts present are tried, rather than all 2^(dots) ways of
+    ## splitting the key
+    key = ".".join(["k"] * 64)
+    nested: util.JSONLikeDict = {"k": 1}
+    for _ in range(63):
+        nested = {"k": nested, "other": 0}
+    assert util.match_attributes(nested, {key: [1]})
+    assert not util.match_attributes(nested, {key + ".k": None})
+    assert not util.match_attributes({"k": 1}, {key: None})
+
+
+def test_span_batch_filtering_dotted_keys() -> None:
+    nested: util.JSONLikeDict = {"k": 1}
+    for _ in range(63):
+        nested = {"k": nested, "other": 0}
+    collection = otlpjson.loado(_get_spans()).to_reified()
+    del collection.resource_spans[1:]
+    del collection.resource_spans[0].scope_spans[1:]
+    span = collection.resource_spans[0].scope_spans[0].spans[0]
+    collection.resource_spans[0].scope_spans[0].spans = [
+        replace(span, span_id=f"{i:016x}", attributes=attributes)
+        for i, attributes in enumerate(
+            [{"a.b": {"x": 1}, "a": {"b": {"c": 2}}}, {"a": {"b": {"x": 3}}}, nested]
+        )
+    ]
+    batch = SpanBatch.from_span_collection(collection)
+    key = ".".join(["k"] * 64)
+    for expected_attributes in [
+        {"a.b.c": [2]},
+        {"a.b.x": [1]},
+        {"a.b.x": None},
+        {"a.b": None},
+        {key: [1]},
+        {key + ".k": None},
+    ]:
+        attributes_filter = util.CompiledAttributesFilter(expected_attributes)
+        assert batch.attributes_mask(expected_attributes).tolist() == [
+            attributes_filter(span.attributes)
+            for span in collection.resource_spans[0].scope_spans[0].spans
+        ]
+
+
+@mark.asyncio
+@mark.parametrize("params", PARAMS)
+async def test_mock_proxy_filtering(params: Params) -> None:
+    proxy = MockProxy(otlpjson.loado(_get_spans()))
+
+    span_ids = [
+        span.otlp_span_id
+        async for spans in proxy.query_spans_async(
+            None,
+            from_time=params.from_time,
+            to_time=params.to_time,
+            span_ids=params.span_ids,
+            resource_attributes=params.resource_attributes,
+            scope_attributes=params.scope_attributes,
+            span_attributes=params.span_attributes,
+            span_name=params.span_name,
+            page_size=params.page_size,
+        )
+        for _, _, span in spans.iter_spans()
+    ]
+
+    ## In collection order, and without duplicates
+    assert span_ids == sorted(params.expected_spans)
+
+
+@mark.asyncio
+@mark.parametrize("page_size", [1, 2, 3, 5, 6])
+@mark.parametrize("params", PARAMS)
+async def test_mock_proxy_pagination(params: Params, page_size: int) -> None:
+    proxy = MockProxy(otlpjson.loado(_get_spans()))
+
+    span_ids: list[str] = []
+    page_token: PageToken | None = None
+    pages = 0
+    while True:
+        pages += 1
+        next_page_token = None
+        async for res in proxy.query_spans_page(
+            None,
+            from_time=params.from_time,
+            to_time=params.to_time,
+            span_ids=params.span_ids,
+            resource_attributes=params.resource_attributes,
+            scope_attributes=params.scope_attributes,
+            span_attributes=params.span_attributes,
+            span_name=params.span_name,
+            page_size=page_size,
+            page_token=page_token,
+        ):
+            if isinstance(res, PageToken):
+                next_page_token = res
+            else:
+                page = [span.otlp_span_id for _, _, span in res.iter_spans()]
+                assert len(page) <= page_size
+                span_ids.extend(page)
+        if next_page_token is None:
+            break
+        page_token = next_page_token
+
+    assert span_ids == sorted(params.expected_spans)
+    assert pages == max(1, -(-len(params.expected_spans) // page_size))
+
+
+@mark.asyncio
+@mark.parametrize("token", [b"", b"mock:", b"mock:-1", b"mock:100", b"other:1"])
+async def test_mock_proxy_invalid_page_token(token: bytes) -> None:
+    proxy = MockProxy(otlpjson.loado(_get_spans()))
+
+    with raises(util.InvalidPageTokenException):
+        async for _ in proxy.query_spans_page(None, page_token=PageToken(token)):
+            pass
+
+
+@mark.asyncio
+async def test_mock_proxy_summary() -> None:
+    with open("tests/examples/ex2.json", "r") as f:
+        proxy = MockProxy(otlpjson.load(f))
+
+    full = [
+        (resource, scope, span)
+        async for spans in proxy.query_spans_async(None)
+        for resource, scope, span in spans.iter_spans()
+    ]
+    summary = [
+        (resource, scope, span)
+        async for spans in proxy.query_spans_async(None, verbosity="summary")
+        for resource, scope, span in spans.iter_spans()
+    ]
+
+    assert len(summary) == len(full)
+    for (resource, scope, span), (full_resource, full_scope, full_span) in zip(
+        summary, full
+    ):
+        assert resource.attributes == {
+            "service.name": full_resource.attributes["service.name"]
+        }
+        assert (scope.name, scope.version, scope.attributes) == (
+            full_scope.name,
+            full_scope.version,
+            {},
+        )
+        assert span.attributes == {} and span.events == [] and span.links == []
+        assert (span.span_id, span.name, span.start_time_unix_nano, span.status) == (
+            full_span.span_id,
+            full_span.name,
+            full_span.start_time_unix_nano,
+            full_span.status,
+        )
+    ## The indexed spans are left alone
+    assert any(span.attributes for _, _, span in full)
+
+
 def _get_spans() -> util.JSONLike:
     return {
         "resourceSpans": [
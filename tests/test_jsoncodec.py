@@ -0,0 +1,102 @@
+import json
+
+from typing import no_type_check
+
+import python_opentelemetry_access.base as base
+import python_opentelemetry_access.cli as cli
+import python_opentelemetry_access.otlpjson as otlpjson
+import python_opentelemetry_access.otlpproto as otlpproto
+import python_opentelemetry_access.opensearch.ss4o as ss4o
+from python_opentelemetry_access.util import jsoncodec
+
+from pytest import mark, raises
+
+
+def _available_codecs() -> list[str]:
+    available = []
+    for name in jsoncodec.CODECS:
+        try:
+            jsoncodec.make_codec(name)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+@no_type_check
+@mark.parametrize("codec_name", _available_codecs())
+@mark.parametrize(
+    "json_rep_path, ss4o_rep_path",
+    [
+        ("tests/examples/ex1.json", "tests/examples/ex1_ss4o_bare.json"),
+        ("tests/examples/ex2.json", "tests/examples/ex2_ss4o_bare.json"),
+        (
+            "tests/examples/flattening.json",
+            "tests/examples/flattening_ss4o_bare.json",
+        ),
+    ],
+)
+def test_codec_roundtrip(codec_name: str, json_rep_path: str, ss4o_rep_path: str):
+    jsoncodec.set_codec("stdlib")
+    with open(json_rep_path, "r") as f:
+        expected = otlpjson.load(f).to_otlp_json()
+    with open(ss4o_rep_path, "r") as f:
+        expected_ss4o = ss4o.load_bare(f).to_otlp_json()
+
+    try:
+        jsoncodec.set_codec(codec_name)
+        with open(json_rep_path, "rb") as f:
+            actual = otlpjson.load(f).to_otlp_json()
+        with open(ss4o_rep_path, "r") as f:
+            actual_ss4o = ss4o.load_bare(f).to_otlp_json()
+    finally:
+        jsoncodec.set_codec("stdlib")
+
+    assert json.loads(actual) == json.loads(expected)
+    assert json.loads(actual_ss4o) == json.loads(expected_ss4o)
+
+    if codec_name == "stdlib":
+        assert actual == expected
+
+
+@no_type_check
+@mark.parametrize("codec_name", _available_codecs())
+@mark.parametrize(
+    "path, loader, mode",
+    [
+        ("tests/examples/ex1.binpb", otlpproto.load, "rb"),
+        ("tests/examples/ex2.binpb", otlpproto.load, "rb"),
+        ("tests/examples/flattening.binpb", otlpproto.load, "rb"),
+        ("tests/examples/ex1_ss4o_bare.json", ss4o.load_bare, "r"),
+        ("tests/examples/ex2_ss4o_bare.json", ss4o.load_bare, "r"),
+        ("tests/examples/flattening_ss4o_bare.json", ss4o.load_bare, "r"),
+    ],
+)
+def test_direct_json_encoding(codec_name: str, path: str, loader, mode: str):
+    def load():
+        with open(path, mode) as f:
+            return loader(f)
+
+    assert base.DirectJSONSpanCollection in type(load()).__mro__
+    try:
+        jsoncodec.set_codec(codec_name)
+        expected = "".join(
+            jsoncodec.get_codec().iterencode(
+                base.SpanCollection.to_otlp_json_iter(load())
+            )
+        )
+        assert load().to_otlp_json() == expected
+        assert load().to_otlp_json_dict() == json.loads(expected)
+    finally:
+        jsoncodec.set_codec("stdlib")
+
+
+def test_unknown_codec():
+    with raises(ValueError):
+        jsoncodec.make_codec("nope")
+
+    assert jsoncodec.make_codec("auto").name in _available_codecs()
+
+
+def test_cli_codec_choices():
+    assert sorted(cli.JSON_CODECS) == sorted(["auto", *jsoncodec.CODECS])
@@ -0,0 +1,454 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import opensearchpy
+
+from pytest import mark, raises
+
+from python_opentelemetry_access.proxy import PageToken
+from python_opentelemetry_access.proxy.opensearch.ss4o import (
+    OpenSearchClientPool,
+    OpenSearchConfigCache,
+    OpenSearchSS40Proxy,
+    _decode_page_token,
+    _default_config_cache_key,
+    _encode_page_token,
+    _span_ids_filter,
+)
+from python_opentelemetry_access.util import (
+    ExpiredPageTokenException,
+    InvalidPageTokenException,
+)
+
+
+def _config(host: str, token: str = "token") -> dict:
+    return {
+        "hosts": [{"host": host, "port": 9200}],
+        "use_ssl": True,
+        "extra_headers": {"Authorization": f"Bearer {token}"},
+    }
+
+
+@mark.asyncio
+async def test_client_reused_for_same_config():
+    pool = OpenSearchClientPool(max_size=4, idle_timeout=timedelta(minutes=5))
+
+    async with pool.client(_config("a", token="user1")) as client1:
+        pass
+    async with pool.client(_config("a", token="user2")) as client2:
+        pass
+    async with pool.client(_config("b")) as client3:
+        pass
+
+    ## Per-request headers do not affect which client is used
+    assert client1 is client2
+    assert client1 is not client3
+
+    await pool.aclose()
+
+
+@mark.asyncio
+async def test_unhashable_config_is_not_pooled():
+    pool = OpenSearchClientPool(max_size=4, idle_timeout=timedelta(minutes=5))
+    config = {**_config("a"), "http_auth": object()}
+
+    async with pool.client(config) as client1:
+        pass
+    async with pool.client(config) as client2:
+        pass
+
+    ## A one-off client every time, closed after use
+    assert client1 is not client2
+    assert len(pool._clients) == 0
+
+    await pool.aclose()
+
+
+@mark.asyncio
+async def test_pool_is_bounded():
+    pool = OpenSearchClientPool(max_size=2, idle_timeout=timedelta(minutes=5))
+
+    async with pool.client(_config("a")) as client_a:
+        pass
+    for host in ["b", "c"]:
+        async with pool.client(_config(host)):
+            pass
+
+    assert len(pool._clients) == 2
+    ## Least recently used client was evicted
+    async with pool.client(_config("a")) as client_a_again:
+        pass
+    assert client_a is not client_a_again
+
+    await pool.aclose()
+
+
+@mark.asyncio
+async def test_idle_clients_are_evicted():
+    pool = OpenSearchClientPool(max_size=4, idle_timeout=timedelta(seconds=0))
+
+    async with pool.client(_config("a")) as client1:
+        ## Clients in use are never evicted
+        async with pool.client(_config("b")):
+            pass
+        assert [pooled.client for pooled in pool._clients.values()] == [client1]
+    async with pool.client(_config("a")) as client2:
+        pass
+
+    assert client1 is not client2
+
+    await pool.aclose()
+    assert len(pool._clients) == 0
+
+
+@mark.asyncio
+async def test_config_cache():
+    cache = OpenSearchConfigCache(max_size=2, ttl=timedelta(minutes=1))
+    calls: list[str] = []
+
+    async def load(key: str) -> dict:
+        calls.append(key)
+        await asyncio.sleep(0)
+        return _config(key)
+
+    results = await asyncio.gather(
+        *(cache.get_or_load(key, lambda key=key: load(key)) for key in "aab")
+    )
+    assert results == [_config("a"), _config("a"), _config("b")]
+    assert await cache.get_or_load("a", lambda: load("a")) == _config("a")
+    assert calls == ["a", "b"]
+    assert cache.hits == 2 and cache.misses == 2
+    assert cache.hit_rate == 0.5
+
+    ## Not cached
+    await cache.get_or_load(None, lambda: load("anonymous"))
+    await cache.get_or_load(None, lambda: load("anonymous"))
+    assert calls == ["a", "b", "anonymous", "anonymous"]
+
+    ## Least recently used entry is dropped
+    await cache.get_or_load("c", lambda: load("c"))
+    await cache.get_or_load("b", lambda: load("b"))
+    assert calls[-2:] == ["c", "b"]
+
+
+@mark.asyncio
+async def test_config_cache_expiry_and_errors():
+    cache = OpenSearchConfigCache(max_size=2, ttl=timedelta(seconds=0))
+    calls: list[str] = []
+
+    async def load() -> dict:
+        calls.append("a")
+        return _config("a")
+
+    await cache.get_or_load("a", load)
+    await cache.get_or_load("a", load)
+    assert calls == ["a", "a"]
+
+    async def fail() -> dict:
+        raise ValueError("hook failed")
+
+    cache = OpenSearchConfigCache(max_size=2, ttl=timedelta(minutes=1))
+    with raises(ValueError):
+        await cache.get_or_load("a", fail)
+    ## Failures are not cached
+    assert await cache.get_or_load("a", load) == _config("a")
+
+
+@mark.asyncio
+async def test_config_cache_cancelled_leader():
+    cache = OpenSearchConfigCache(max_size=2, ttl=timedelta(minutes=1))
+    started = asyncio.Event()
+    calls: list[str] = []
+
+    async def load(name: str) -> dict:
+        calls.append(name)
+        started.set()
+        await asyncio.sleep(0 if name == "waiter" else 10)
+        return _config(name)
+
+    leader = asyncio.create_task(cache.get_or_load("a", lambda: load("leader")))
+    await started.wait()
+    waiter = asyncio.create_task(cache.get_or_load("a", lambda: load("waiter")))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    ## The waiter takes over rather than being cancelled along with the leader
+    assert await waiter == _config("waiter")
+    with raises(asyncio.CancelledError):
+        await leader
+    assert calls == ["leader", "waiter"]
+
+
+def test_default_config_cache_key():
+    assert _default_config_cache_key({"user": "a", "roles": ["x"]}) == (
+        _default_config_cache_key({"roles": ["x"], "user": "a"})
+    )
+    assert _default_config_cache_key({"user": "a"}) != _default_config_cache_key(
+        {"user": "b"}
+    )
+    ## Not cached, since objects cannot be told apart by their JSON (or repr)
+    assert _default_config_cache_key({"user": object()}) is None
+
+
+def test_span_ids_filter():
+    ## As before, a single trace or span is looked up with term queries
+    assert _span_ids_filter([("t1", None)], 10) == [{"term": {"traceId": "t1"}}]
+    assert _span_ids_filter([("t1", "s1")], 10) == [
+        {
+            "bool": {
+                "filter": [
+                    {"term": {"traceId": "t1"}},
+                    {"term": {"spanId": "s1"}},
+                ]
+            }
+        }
+    ]
+
+    ## Many traces in one query, chunked by max_terms_count
+    trace_ids = [f"t{i}" for i in range(5)]
+    assert _span_ids_filter([(t, None) for t in trace_ids + ["t0"]], 2) == [
+        {
+            "bool": {
+                "should": [
+                    {"terms": {"traceId": ["t0", "t1"]}},
+                    {"terms": {"traceId": ["t2", "t3"]}},
+                    {"terms": {"traceId": ["t4"]}},
+                ],
+                "minimum_should_match": 1,
+            }
+        }
+    ]
+
+    ## Spans of traces that are selected as a whole are not looked up separately
+    assert _span_ids_filter(
+        [("t1", None), ("t1", "s1"), ("t2", "s2"), ("t2", "s3"), (None, "s4")], 10
+    ) == [
+        {
+            "bool": {
+                "should": [
+                    {"term": {"traceId": "t1"}},
+                    {"term": {"spanId": "s4"}},
+                    {
+                        "bool": {
+                            "filter": [
+                                {"term": {"traceId": "t2"}},
+                                {"terms": {"spanId": ["s2", "s3"]}},
+                            ]
+                        }
+                    },
+                ],
+                "minimum_should_match": 1,
+            }
+        }
+    ]
+
+    assert _span_ids_filter([("t1", None), (None, None)], 10) == []
+    assert _span_ids_filter([], 10) == [{"bool": {"must_not": {"match_all": {}}}}]
+
+
+def test_page_token():
+    after = [1700000000123, "697777f078628bc35093f4f376dfa62d", "7f2aedeb88337ec1"]
+    assert _decode_page_token(_encode_page_token(after)) == (after, None)
+    assert _decode_page_token(_encode_page_token(after, "pit")) == (after, "pit")
+
+    for token in [
+        b"2023-11-14T22:13:20.123Z",
+        b"not json",
+        b"\xff",
+        b'{"v":2,"after":[1,"t","s"]}',
+        b'{"v":1,"after":[1,"t"]}',
+        b'{"v":1,"after":["1","t","s"]}',
+        b'{"v":1,"after":[true,"t","s"]}',
+        b'[1,"t","s"]',
+        b'{"v":1,"after":[1,"t","s"],"pit":""}',
+    ]:
+        with raises(InvalidPageTokenException):
+            _decode_page_token(PageToken(token))
+
+
+class _FakeClient:
+    """
+    Answers searches from the spans in ex2_ss4o_bare.json, sorted the same way as
+    OpenSearch would
+    """
+
+    def __init__(self) -> None:
+        with open("tests/examples/ex2_ss4o_bare.json", "r") as f:
+            sources = json.load(f)
+        self.hits = sorted(
+            (
+                {
+                    "_source": source,
+                    "sort": [
+                        int(
+                            datetime.fromisoformat(source["startTime"]).timestamp()
+                            * 1000
+                        ),
+                        source["traceId"],
+                        source["spanId"],
+                    ],
+                }
+                for source in sources
+            ),
+            key=lambda hit: hit["sort"],
+        )
+        self.calls: list[tuple] = []
+        self.expired = False
+        self.failure: BaseException | None = None
+
+    async def create_pit(self, *, index, params, headers):
+        self.calls.append(("create_pit", index, params["keep_alive"]))
+        return {"pit_id": "pit1"}
+
+    async def delete_pit(self, *, body, headers):
+        self.calls.append(("delete_pit", body["pit_id"]))
+
+    async def search(self, *, body, headers, index=None):
+        self.calls.append(("search", index, body.get("pit")))
+        if self.failure is not None:
+            raise self.failure
+        if self.expired:
+            raise opensearchpy.NotFoundError(
+                404,
+                "search_phase_execution_exception",
+                {
+                    "error": {
+                        "root_cause": [{"type": "search_context_missing_exception"}]
+                    }
+                },
+            )
+        after = body.get("search_after")
+        hits = [hit for hit in self.hits if after is None or hit["sort"] > after]
+        if "_source" in body:
+            hits = [
+                {
+                    **hit,
+                    "_source": _project(hit["_source"], body["_source"]["includes"]),
+                }
+                for hit in hits
+            ]
+        return {
+            **({"pit_id": body["pit"]["id"]} if "pit" in body else {}),
+            "hits": {"hits": hits[: body["size"]]},
+        }
+
+
+def _project(source: dict, includes: list[str]) -> dict:
+    result: dict = {}
+    for path in includes:
+        key, _, inner_key = path.partition(".")
+        if key not in source:
+            continue
+        if inner_key:
+            if inner_key in source[key]:
+                result.setdefault(key, {})[inner_key] = source[key][inner_key]
+        else:
+            result[key] = source[key]
+    return result
+
+
+def _fake_proxy(client: _FakeClient, **kwargs) -> OpenSearchSS40Proxy:
+    proxy = OpenSearchSS40Proxy({}, default_page_size=4, max_page_size=4, **kwargs)
+
+    async def get_client_config(auth_info):
+        return {}
+
+    @asynccontextmanager
+    async def pooled_client(client_config):
+        yield client
+
+    proxy._get_client_config = get_client_config  # type: ignore
+    proxy.client_pool.client = pooled_client  # type: ignore
+    return proxy
+
+
+@mark.asyncio
+@mark.parametrize("pit_keep_alive", [None, timedelta(minutes=2)])
+async def test_query_pages(pit_keep_alive):
+    client = _FakeClient()
+    proxy = _fake_proxy(client, pit_keep_alive=pit_keep_alive)
+
+    span_ids = [
+        span.otlp_span_id
+        async for spans in proxy.query_spans_async(None)
+        for _, _, span in spans.iter_spans()
+    ]
+    ## Every span exactly once, in order
+    assert span_ids == [hit["_source"]["spanId"] for hit in client.hits]
+
+    searches = [call for call in client.calls if call[0] == "search"]
+    assert len(searches) == 3
+    if pit_keep_alive is None:
+        assert client.calls == [("search", proxy.index_name, None)] * 3
+    else:
+        pit = {"id": "pit1", "keep_alive": "120s"}
+        assert client.calls == [
+            ("create_pit", proxy.index_name, "120s"),
+            *[("search", None, pit)] * 3,
+            ("delete_pit", ["pit1"]),
+        ]
+
+
+@mark.asyncio
+async def test_expired_pit():
+    client = _FakeClient()
+    proxy = _fake_proxy(client, pit_keep_alive=timedelta(minutes=1))
+
+    results = [res async for res in proxy.query_spans_page(None)]
+    assert isinstance(results[-1], PageToken)
+
+    client.expired = True
+    with raises(ExpiredPageTokenException):
+        async for _ in proxy.query_spans_page(None, page_token=results[-1]):
+            pass
+
+
+@mark.asyncio
+@mark.parametrize("failure", [RuntimeError("boom"), asyncio.CancelledError()])
+async def test_failed_search_deletes_pit(failure: BaseException):
+    client = _FakeClient()
+    proxy = _fake_proxy(client, pit_keep_alive=timedelta(minutes=1))
+    results = [res async for res in proxy.query_spans_page(None)]
+    assert isinstance(results[-1], PageToken)
+
+    client.failure = failure
+    client.calls.clear()
+    with raises(type(failure)):
+        async for _ in proxy.query_spans_page(None):
+            pass
+    assert client.calls[-1] == ("delete_pit", ["pit1"])
+
+    ## A point in time from a page token belongs to the caller
+    client.calls.clear()
+    with raises(type(failure)):
+        async for _ in proxy.query_spans_page(None, page_token=results[-1]):
+            pass
+    assert not any(call[0] == "delete_pit" for call in client.calls)
+
+
+@mark.asyncio
+async def test_summary_query():
+    client = _FakeClient()
+    ## Resources without any of the summary attributes are left out entirely
+    del client.hits[0]["_source"]["resource"]["service.name"]
+    proxy = _fake_proxy(client)
+
+    all_resource_spans = [
+        resource_spans
+        async for collection in proxy.query_spans_async(None, verbosity="summary")
+        for resource_spans in collection.to_otlp_json_dict()["resourceSpans"]
+    ]
+    resources = [
+        resource_spans["resource"].get("attributes", [])
+        for resource_spans in all_resource_spans
+    ]
+    assert resources == [[]] + [
+        [{"key": "service.name", "value": {"stringValue": "instrumentation"}}]
+    ] * (len(resources) - 1)
+    for resource_spans in all_resource_spans:
+        for scope_spans in resource_spans["scopeSpans"]:
+            assert scope_spans["scope"]["name"] == "pytest-opentelemetry"
+            for span in scope_spans["spans"]:
+                assert "attributes" not in span and "events" not in span
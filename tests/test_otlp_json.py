@@ -1,6 +1,9 @@
+import io
 import json
 
-# import python_opentelemetry_access.base as base
+from pytest import mark, raises
+
+import python_opentelemetry_access.base as base
 import python_opentelemetry_access.otlpjson as otlpjson
 
 
@@ -115,3 +118,60 @@ def test_roundtrip_complete_json():
         json.dumps(span_collection)
         == otlpjson.OTLPJsonSpanCollection(span_collection).to_otlp_json()
     )
+
+
+@mark.parametrize(
+    "json_rep_path",
+    [
+        "tests/examples/ex1.json",
+        "tests/examples/ex2.json",
+        "tests/examples/flattening.json",
+    ],
+)
+def test_direct_protobuf_encoding(json_rep_path: str):
+    with open(json_rep_path, "r") as f:
+        spans = otlpjson.load(f)
+
+    for _, _, span in spans.iter_spans():
+        assert bytes(span.to_otlp_protobuf()) == bytes(base.Span.to_otlp_protobuf(span))
+
+
+@mark.parametrize(
+    "json_rep_path",
+    [
+        "tests/examples/ex1.json",
+        "tests/examples/ex2.json",
+        "tests/examples/flattening.json",
+    ],
+)
+@mark.parametrize("chunk_size", [1, 7, 1024 * 1024])
+def test_iterload(json_rep_path: str, chunk_size: int):
+    with open(json_rep_path, "r") as f:
+        expected = otlpjson.load(f)
+
+    with open(json_rep_path, "rb") as f:
+        streamed = otlpjson.load_streaming(f, chunk_size=chunk_size)
+        assert streamed.to_otlp_json() == expected.to_otlp_json()
+
+    with open(json_rep_path, "r") as f:
+        resource_spans = list(otlpjson.iterload(f, chunk_size=chunk_size))
+    assert [rs.jobj for rs in resource_spans] == expected.jobj["resourceSpans"]
+
+
+def test_iterload_edge_cases():
+    assert list(otlpjson.iterload(io.StringIO("{}"))) == []
+    assert list(otlpjson.iterload(io.StringIO(' { "resourceSpans" : [ ] } '))) == []
+
+    rs = list(
+        otlpjson.iterload(
+            io.BytesIO(
+                '{"other": [1, {"x": 2}], "resourceSpans": [{"n": "é"}, {"n": 12345}]}'.encode()
+            ),
+            chunk_size=1,
+        )
+    )
+    assert [r.jobj for r in rs] == [{"n": "é"}, {"n": 12345}]
+
+    for bad in ['{"resourceSpans": [{}', '{"resourceSpans": [] ] }', "[]", "{} {}"]:
+        with raises(json.JSONDecodeError):
+            list(otlpjson.iterload(io.StringIO(bad), chunk_size=2))
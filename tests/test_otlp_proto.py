@@ -1,7 +1,13 @@
 import binascii
+import io
+import struct
+
+from pytest import mark, raises
 
 # import python_opentelemetry_access.base as base
+import python_opentelemetry_access.otlpjson as otlpjson
 import python_opentelemetry_access.otlpproto as otlpproto
+import python_opentelemetry_access.util as util
 
 import opentelemetry_betterproto.opentelemetry.proto.common.v1 as common
 import opentelemetry_betterproto.opentelemetry.proto.trace.v1 as trace
@@ -138,3 +144,169 @@ def test_roundtrip_complete_proto():
         span_collection
         == otlpproto.OTLPProtoSpanCollection(span_collection).to_otlp_protobuf()
     )
+
+
+@mark.parametrize(
+    "proto_rep_path",
+    [
+        "tests/examples/ex1.binpb",
+        "tests/examples/ex2.binpb",
+        "tests/examples/flattening.binpb",
+    ],
+)
+@mark.parametrize("resource_spans_per_message", [1, 2])
+def test_delimited_roundtrip(proto_rep_path: str, resource_spans_per_message: int):
+    with open(proto_rep_path, "rb") as f:
+        expected = otlpproto.load(f)
+
+    out = io.BytesIO()
+    otlpproto.dump_delimited(
+        expected, out, resource_spans_per_message=resource_spans_per_message
+    )
+    ## Appending another stream gives a valid stream
+    otlpproto.dump_delimited(
+        expected, out, resource_spans_per_message=resource_spans_per_message
+    )
+
+    out.seek(0)
+    actual = otlpproto.load_delimited(out)
+    expected_resource_spans = [
+        rs.to_otlp_protobuf() for rs in expected.otlp_resource_spans
+    ]
+    assert [
+        rs.to_otlp_protobuf() for rs in actual.otlp_resource_spans
+    ] == expected_resource_spans * 2
+
+
+def test_delimited_varint():
+    for n in [0, 1, 127, 128, 300, 2**32]:
+        assert otlpproto._read_varint(io.BytesIO(otlpproto._encode_varint(n))) == n
+    assert otlpproto._read_varint(io.BytesIO(b"")) is None
+
+    with raises(ValueError):
+        list(otlpproto.iterload_delimited(io.BytesIO(b"\x80")))
+    with raises(ValueError):
+        list(otlpproto.iterload_delimited(io.BytesIO(b"\x05abc")))
+
+
+@mark.parametrize(
+    "proto_rep_path, json_rep_path",
+    [
+        ("tests/examples/ex1.binpb", "tests/examples/ex1.json"),
+        ("tests/examples/ex2.binpb", "tests/examples/ex2.json"),
+        ("tests/examples/flattening.binpb", "tests/examples/flattening.json"),
+    ],
+)
+def test_load_mapped(proto_rep_path: str, json_rep_path: str, tmp_path):
+    with open(json_rep_path, "r") as f:
+        expected = otlpjson.load(f).to_reified()
+
+    with open(proto_rep_path, "rb") as f:
+        mapped = otlpproto.load_mapped(f)
+        ## Can be iterated more than once
+        assert mapped.to_reified() == expected
+        assert mapped.to_reified() == expected
+
+    with open(proto_rep_path, "rb") as f:
+        assert otlpproto.loads_mapped(f.read()).to_reified() == expected
+
+    empty_path = tmp_path / "empty.binpb"
+    empty_path.write_bytes(b"")
+    with open(empty_path, "rb") as f:
+        assert list(otlpproto.load_mapped(f).iter_spans()) == []
+
+
+def _field(number: int, wire_type: int, payload: bytes | int) -> bytes:
+    tag = otlpproto._encode_varint(number << 3 | wire_type)
+    if isinstance(payload, int):
+        return tag + otlpproto._encode_varint(payload)
+    if wire_type == 2:
+        return tag + otlpproto._encode_varint(len(payload)) + payload
+    return tag + payload
+
+
+def _key_value(key: str, any_value: bytes) -> bytes:
+    return _field(1, 2, key.encode()) + _field(2, 2, any_value)
+
+
+def test_load_mapped_wire_format():
+    attributes = [
+        _key_value("negative", _field(3, 0, 2**64 - 3)),
+        _key_value("double", _field(4, 1, struct.pack("<d", 3.2))),
+        _key_value("bool", _field(2, 0, 1)),
+        _key_value("empty", _field(1, 2, b"")),
+        _key_value(
+            "array",
+            _field(5, 2, _field(1, 2, _field(3, 0, 3)) + _field(1, 2, _field(3, 0, 2))),
+        ),
+        _key_value(
+            "kvlist", _field(6, 2, _field(1, 2, _key_value("inner", _field(2, 0, 0))))
+        ),
+        ## For a oneof the last field wins
+        _key_value("last", _field(3, 0, 1) + _field(1, 2, b"str")),
+    ]
+    span = (
+        _field(1, 2, binascii.a2b_hex("ABC123"))
+        + _field(2, 2, binascii.a2b_hex("DEF456"))
+        + _field(5, 2, b"old name")
+        + _field(5, 2, b"name")
+        + _field(6, 0, 2)
+        + _field(7, 1, (12345).to_bytes(8, "little"))
+        + _field(16, 5, (7).to_bytes(4, "little"))
+        + b"".join(_field(9, 2, a) for a in attributes)
+        + _field(15, 2, _field(2, 2, b"oops") + _field(3, 0, 2))
+    )
+
+    def request(span: bytes) -> bytes:
+        return _field(1, 2, _field(2, 2, _field(2, 2, span)))
+
+    [(_, _, mapped)] = list(otlpproto.loads_mapped(request(span)).iter_spans())
+    assert mapped.otlp_trace_id == "abc123"
+    assert mapped.otlp_span_id == "def456"
+    assert mapped.otlp_parent_span_id == ""
+    assert mapped.otlp_trace_state is None
+    assert mapped.otlp_name == "name"
+    assert mapped.otlp_kind.otlp_kind_code == 2
+    assert mapped.otlp_start_time_unix_nano == 12345
+    assert mapped.otlp_end_time_unix_nano == 0
+    assert mapped.otlp_flags == 7
+    assert mapped.otlp_attributes == {
+        "negative": -3,
+        "double": 3.2,
+        "bool": True,
+        "empty": "",
+        "array": [3, 2],
+        "kvlist": {"inner": False},
+        "last": "str",
+    }
+    assert mapped.otlp_status.otlp_message == "oops"
+    assert mapped.otlp_status.otlp_code == 2
+
+    ## Fields that are not accessed are not decoded
+    broken_attributes = request(span + _field(9, 2, b"\xff"))
+    [(_, _, mapped)] = list(otlpproto.loads_mapped(broken_attributes).iter_spans())
+    assert mapped.otlp_trace_id == "abc123"
+    with raises(ValueError):
+        mapped.otlp_attributes
+
+    with raises(ValueError):
+        list(otlpproto.loads_mapped(request(span)[:-1]).iter_spans())
+
+
+def test_memoised_accessors():
+    proto = trace.Span(trace_id=binascii.a2b_hex("ABC123"), flags=3)
+    span = otlpproto.OTLPProtoSpan(proto)
+    assert span.to_otlp_json().count('"flags"') == 1
+
+    try:
+        util.set_memoise(False)
+        assert span.otlp_trace_id == "abc123"
+        proto.trace_id = binascii.a2b_hex("DEF456")
+        assert span.otlp_trace_id == "def456"
+
+        util.set_memoise(True)
+        assert span.otlp_trace_id == "def456"
+        proto.trace_id = binascii.a2b_hex("ABC123")
+        assert span.otlp_trace_id == "def456"
+    finally:
+        util.set_memoise(False)
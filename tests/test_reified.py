@@ -1,4 +1,7 @@
+import json
+
 import python_opentelemetry_access.base as base
+import python_opentelemetry_access.otlpjson as otlpjson
 import python_opentelemetry_access.util as util
 
 
@@ -152,3 +155,82 @@ def test_roundtrip_complete_proto():
             for rsc in [resource_span_collection]
         ]
     }
+
+
+def test_reified_slots():
+    ## Every base class needs (empty) __slots__ for the instances to go without a __dict__
+    for cls in [
+        base.ReifiedSpanEvent,
+        base.ReifiedStatus,
+        base.ReifiedSpanKind,
+        base.ReifiedSpanLink,
+        base.ReifiedSpan,
+        base.ReifiedInstrumentationScope,
+        base.ReifiedResource,
+        base.ReifiedScopeSpanCollection,
+        base.ReifiedResourceSpanCollection,
+        base.ReifiedSpanCollection,
+    ]:
+        assert not any("__dict__" in vars(c) for c in cls.__mro__)
+    assert not hasattr(base.ReifiedStatus(message=None, code=0), "__dict__")
+
+
+def test_reification_interning():
+    with open("tests/examples/ex2.json", "r") as f:
+        source = f.read()
+    a = otlpjson.loads(source).to_reified()
+    b = otlpjson.loads(source).to_reified()
+    assert a == b
+
+    ## Shared within a single reification only, so modifying one collection
+    ## does not affect the other
+    for rs_a, rs_b in zip(a.resource_spans, b.resource_spans):
+        assert rs_a.resource is not rs_b.resource
+        for ss_a, ss_b in zip(rs_a.scope_spans, rs_b.scope_spans):
+            assert ss_a.scope is not ss_b.scope
+    a.resource_spans[0].resource.attributes["modified"] = True
+    assert "modified" not in b.resource_spans[0].resource.attributes
+
+    doubled = json.loads(source)
+    doubled["resourceSpans"] *= 2
+    c = otlpjson.loado(doubled).to_reified()
+    half = len(c.resource_spans) // 2
+    for rs_1, rs_2 in zip(c.resource_spans[:half], c.resource_spans[half:]):
+        assert rs_1.resource is rs_2.resource
+        for ss_1, ss_2 in zip(rs_1.scope_spans, rs_2.scope_spans):
+            assert ss_1.scope is ss_2.scope
+
+    spans_a = [span for _, _, span in a.iter_spans()]
+    spans_b = [span for _, _, span in b.iter_spans()]
+    for span_a, span_b in zip(spans_a, spans_b):
+        for key_a, key_b in zip(span_a.attributes, span_b.attributes):
+            assert key_a is key_b
+
+    ## Attributes are a map, so their order does not matter
+    interners = base.ReifiedInterners()
+    resource = base.ReifiedResource(
+        attributes={"a": 1, "b": {"c": 2, "d": 3}}, dropped_attributes_count=0
+    )
+    reordered = base.ReifiedResource(
+        attributes={"b": {"d": 3, "c": 2}, "a": 1}, dropped_attributes_count=0
+    )
+    assert interners.resources.intern(resource) is resource
+    assert interners.resources.intern(reordered) is resource
+    ## Equal in Python, but not the same JSON
+    assert (
+        interners.resources.intern(
+            base.ReifiedResource(
+                attributes={"a": True, "b": {"c": 2, "d": 3}},
+                dropped_attributes_count=0,
+            )
+        )
+        is not resource
+    )
+    assert (
+        interners.resources.intern(
+            base.ReifiedResource(
+                attributes={"a": 1, "b": {"c": 2, "d": 3}}, dropped_attributes_count=0
+            )
+        )
+        is resource
+    )
@@ -3,6 +3,7 @@
 import python_opentelemetry_access.util as util
 import python_opentelemetry_access.opensearch as opensearch
 from pandas import Timestamp
+from pytest import mark, raises
 
 
 def test_roundtrip_complete_json():
@@ -161,3 +162,40 @@ def test_roundtrip_complete_json():
 
     tmp_span = next(ss4o_scope_collection.otlp_spans)
     assert tmp_span.to_otlp_json() == ss4o_span.to_otlp_json()
+
+
+@mark.parametrize(
+    "t",
+    [
+        "2018-12-13T14:51:00Z",
+        "2024-10-15T15:46:34.8836542Z",
+        "2024-10-15T15:46:34.883833942Z",
+        "2024-10-15T15:46:34.883833942123Z",
+        "1969-12-31T23:59:59.999999999Z",
+        "2018-12-13T14:51:00.1+02:00",
+        "2024-02-29T00:00:00-05:30",
+        "2024-02-29T00:00-0530",
+        "2018-12-13 14:51:00",
+        "20181213T145100Z",
+    ],
+)
+def test_parse_ns_isotime(t: str):
+    assert opensearch.ss4o._parse_ns_isotime(t) == int(
+        Timestamp(t).asm8.astype("datetime64[ns]")
+    )
+
+
+@mark.parametrize(
+    "t",
+    [
+        "2024-02-30T00:00:00Z",
+        "2024-01-01T24:00:00Z",
+        "2024-01-01T00:00:00Zjunk",
+        "2024-01-01T00:00:00+25:00",
+        "2024-01-01T00:00:00+05:60",
+        "2024-01-01T00:00:00+05:",
+    ],
+)
+def test_parse_ns_isotime_invalid(t: str):
+    with raises(ValueError):
+        opensearch.ss4o._parse_ns_isotime(t)
@@ -0,0 +1,105 @@
+"""
+Compares the direct conversions (protobuf and SS4O to OTLP JSON, OTLP JSON to
+protobuf) with the generic ones they replace, in spans per second.
+
+Usage (from the repository root):
+    uv run utils/benchmarks/conversion.py [--copies N] [--json-codec NAME]
+
+The examples in tests/examples are repeated N times to get larger inputs.
+"""
+
+import argparse
+import time
+from collections.abc import Callable
+
+import python_opentelemetry_access.base as base
+import python_opentelemetry_access.otlpjson as otlpjson
+import python_opentelemetry_access.otlpproto as otlpproto
+import python_opentelemetry_access.opensearch.ss4o as ss4o
+from python_opentelemetry_access.util.jsoncodec import get_codec, set_codec
+
+import opentelemetry_betterproto.opentelemetry.proto.trace.v1 as trace
+import opentelemetry_betterproto.opentelemetry.proto.collector.trace.v1 as trace_collector
+
+
+def _generic_json(x: base.SpanCollection) -> str:
+    return "".join(get_codec().iterencode(base.SpanCollection.to_otlp_json_iter(x)))
+
+
+def _generic_proto(
+    x: base.SpanCollection,
+) -> trace_collector.ExportTraceServiceRequest:
+    """
+    x.to_otlp_protobuf(), with the spans converted by the generic base.Span method
+    """
+    return trace_collector.ExportTraceServiceRequest(
+        resource_spans=[
+            trace.ResourceSpans(
+                resource=rs.otlp_resource.to_otlp_protobuf(),
+                scope_spans=[
+                    trace.ScopeSpans(
+                        scope=ss.otlp_scope.to_otlp_protobuf(),
+                        spans=[
+                            base.Span.to_otlp_protobuf(span) for span in ss.otlp_spans
+                        ],
+                        schema_url=ss.otlp_schema_url or "",
+                    )
+                    for ss in rs.otlp_scope_spans
+                ],
+                schema_url=rs.otlp_schema_url or "",
+            )
+            for rs in x.otlp_resource_spans
+        ]
+    )
+
+
+def _time(f: Callable[[], object], repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--copies", type=int, default=200)
+    parser.add_argument("--json-codec", default="stdlib")
+    args = parser.parse_args()
+    set_codec(args.json_codec)
+
+    with open("tests/examples/ex2.json", "r") as f:
+        json_source = otlpjson.load(f).jobj
+    json_source = {"resourceSpans": json_source["resourceSpans"] * args.copies}
+    proto_source = bytes(otlpjson.loado(json_source).to_otlp_protobuf())
+    with open("tests/examples/ex2_ss4o_bare.json", "r") as f:
+        ss4o_source = ss4o.load_bare(f)._search_results
+    ss4o_source = ss4o_source * args.copies  # type: ignore
+
+    ## Loaded once, the conversions alone are timed
+    cases: list[
+        tuple[str, base.SpanCollection, Callable[[base.SpanCollection], object]]
+    ]
+    cases = [
+        ("otlp-proto -> otlp-json", otlpproto.loads(proto_source), _generic_json),
+        ("otlp-json -> otlp-proto", otlpjson.loado(json_source), _generic_proto),
+        ("ss4o -> otlp-json", ss4o.loado_bare(ss4o_source), _generic_json),
+    ]
+    direct: dict[str, Callable[[base.SpanCollection], object]] = {
+        "otlp-json": lambda x: x.to_otlp_json(),
+        "otlp-proto": lambda x: x.to_otlp_protobuf(),
+    }
+
+    print(f"{'spans/s':<30} {'generic':>12} {'direct':>12}")
+    for name, x, generic in cases:
+        n_spans = sum(1 for _ in x.iter_spans())
+        to_direct = direct[name.split(" -> ")[1]]
+        print(
+            f"{name:<30} {n_spans / _time(lambda: generic(x)):12.0f}"
+            f" {n_spans / _time(lambda: to_direct(x)):12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Measures cold-start time of the CLI and the import time of the library's modules.
+
+Usage (from the repository root):
+    uv run utils/benchmarks/import_time.py [--repeat N]
+
+Each measurement runs in a fresh interpreter. For a breakdown of where the time
+goes, run e.g. `python -X importtime -m python_opentelemetry_access list-formats`.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = [
+    "python_opentelemetry_access.cli",
+    "python_opentelemetry_access.otlpjson",
+    "python_opentelemetry_access.otlpproto",
+    "python_opentelemetry_access.opensearch.ss4o",
+    "python_opentelemetry_access.proxy",
+    "python_opentelemetry_access.proxy.opensearch.ss4o",
+    "python_opentelemetry_access.api",
+]
+
+COMMANDS = [
+    ["list-formats"],
+    [
+        "convert",
+        "--from=otlp-json",
+        "--to=otlp-proto",
+        "tests/examples/ex1.json",
+        "/dev/null",
+    ],
+]
+
+
+def _time(args: list[str], repeat: int) -> tuple[float, float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), min(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline, _ = _time(["-c", "pass"], args.repeat)
+    print(f"{'interpreter startup':<60} {baseline * 1000:8.1f} ms (median)")
+
+    for module in MODULES:
+        median, best = _time(["-c", f"import {module}"], args.repeat)
+        print(
+            f"{'import ' + module:<60} {(median - baseline) * 1000:8.1f} ms "
+            f"(best {(best - baseline) * 1000:.1f} ms)"
+        )
+
+    for command in COMMANDS:
+        median, best = _time(
+            ["-m", "python_opentelemetry_access", *command], args.repeat
+        )
+        print(
+            f"{'cli ' + ' '.join(command[:3]):<60} {median * 1000:8.1f} ms "
+            f"(best {best * 1000:.1f} ms)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Measures the memory held by reified span collections, in bytes per span.
+
+Usage (from the repository root):
+    uv run utils/benchmarks/reified_memory.py [--copies N] [FILE ...]
+
+Every FILE (OTLP JSON, default: the examples in tests/examples) is loaded and
+reified N times, keeping only the reified collections, as MockProxy does.
+"""
+
+import argparse
+import gc
+import sys
+import tracemalloc
+
+import python_opentelemetry_access.base as base
+import python_opentelemetry_access.otlpjson as otlpjson
+
+DEFAULT_FILES = [
+    "tests/examples/ex1.json",
+    "tests/examples/ex2.json",
+    "tests/examples/flattening.json",
+]
+
+
+def _object_size(o: object) -> int:
+    """
+    The size of o itself, including its __dict__ (if it has one) but not the values
+    """
+    size = sys.getsizeof(o)
+    if hasattr(o, "__dict__"):
+        size += sys.getsizeof(o.__dict__)
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--copies", type=int, default=200)
+    parser.add_argument("files", nargs="*", default=DEFAULT_FILES)
+    args = parser.parse_args()
+
+    sources = []
+    for path in args.files:
+        with open(path, "r") as f:
+            sources.append(f.read())
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+
+    collections: list[base.ReifiedSpanCollection] = []
+    for _ in range(args.copies):
+        for source in sources:
+            collections.append(otlpjson.loads(source).to_reified())
+
+    gc.collect()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    spans = [span for c in collections for _, _, span in c.iter_spans()]
+    print(f"{'spans':<40} {len(spans):10}")
+    print(f"{'bytes/span (total)':<40} {(after - before) / len(spans):10.1f}")
+    print(f"{'peak bytes/span':<40} {(peak - before) / len(spans):10.1f}")
+    for name, o in [
+        ("ReifiedSpan object", spans[0]),
+        ("ReifiedStatus object", spans[0].status),
+        ("ReifiedSpanKind object", spans[0].kind),
+    ]:
+        print(f"{name + ' (bytes)':<40} {_object_size(o):10}")
+
+
+if __name__ == "__main__":
+    main()